@@ -0,0 +1,287 @@
+"""Summarizes a directory of saved sessions.
+
+Every txt and tses session in the directory is parsed by a pool of
+processes into its command counts, round trip time percentiles, flown
+distance and rotation and error rate, along with the totals of all of them.
+The summaries are cached by the modification time of their file, so only
+new and changed sessions are parsed again.
+
+Usage: python analytics.py [sessions_dir] [-o summary.json|summary.csv]
+"""
+import os
+import sys
+import csv
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from log import DIRECTION_VECTORS, ROTATIONS
+from session_file import ERROR, OK, TIMEOUT, SessionFile, read_text_session
+
+# the cache of the summaries, kept in the sessions directory
+CACHE_FILE = '.analytics_cache.json'
+SESSION_EXTENSIONS = ('.txt', '.tses')
+# log-spaced round trip time bins from 1 ms to 100 s, the summaries keep a
+# histogram of them, so the percentiles of many sessions can be combined
+RTT_BINS = np.geomspace(1e-3, 100, 101)
+PERCENTILES = (50, 90, 99)
+# the columns of the csv output
+CSV_FIELDS = ('file', 'starting_time', 'commands', 'ok', 'errors',
+              'timeouts', 'error_rate', 'duration', 'distance', 'rotation',
+              'rtt_mean', 'rtt_p50', 'rtt_p90', 'rtt_p99', 'rtt_max')
+
+
+def load_session(path):
+    """Reads the commands of a txt or tses session.
+
+    Args:
+        path (string): The path of the session file
+    Returns:
+        tuple: The starting time, the commands and their outcomes as
+        arrays, the send and the receive times, NaN for timeouts
+    """
+    if path.endswith('.tses'):
+        session = SessionFile(path)
+        records = session.records
+        commands = [session.strings[ind] for ind in records['command']]
+        return (session.starting_time, commands, np.array(records['kind']),
+                np.array(records['stime']), np.array(records['rtime']))
+
+    starting_time, records, _ = read_text_session(path)
+    if not records:
+        empty = np.empty(0)
+        return starting_time, [], empty.astype(int), empty, empty
+    commands, stimes, rtimes, kinds = zip(*records)
+    return (starting_time, list(commands), np.array(kinds),
+            np.array(stimes, dtype=float), np.array(rtimes, dtype=float))
+
+
+def path_length(commands):
+    """Returns the distance in cm and the rotation in degrees flown by the
+    pathing, "go" and rotation commands given."""
+    distance = 0.0
+    rotation = 0.0
+    for command in commands:
+        parts = command.split(' ')
+        try:
+            if parts[0] in DIRECTION_VECTORS and len(parts) == 2:
+                distance += abs(float(parts[1]))
+            elif parts[0] == 'go' and len(parts) == 5:
+                distance += float(
+                    np.linalg.norm(np.array(parts[1:4], dtype=float)))
+            elif parts[0] in ROTATIONS and len(parts) == 2:
+                rotation += abs(float(parts[1]))
+        except ValueError:
+            # not a number
+            continue
+    return distance, rotation
+
+
+def summarize_session(path):
+    """Computes the summary of a session file.
+
+    Args:
+        path (string): The path of the session file
+    Returns:
+        dict: The summary, None if the file is not a session
+    """
+    try:
+        starting_time, commands, kinds, stimes, rtimes = load_session(path)
+    except (OSError, ValueError, IndexError) as e:
+        print('[ERROR] Could not read {}: {}'.format(path, e))
+        return None
+
+    answered = kinds != TIMEOUT
+    rtts = rtimes[answered] - stimes[answered]
+    summary = {
+        'file': os.path.basename(path),
+        'starting_time': starting_time,
+        'commands': len(commands),
+        'ok': int(np.count_nonzero(kinds == OK)),
+        'errors': int(np.count_nonzero(kinds == ERROR)),
+        'timeouts': int(np.count_nonzero(kinds == TIMEOUT)),
+        'duration': float(np.fmax(stimes, rtimes).max())
+        if len(commands) else 0.0,
+        'rtt_histogram': np.histogram(np.clip(rtts, RTT_BINS[0],
+                                              RTT_BINS[-1]),
+                                      RTT_BINS)[0].tolist(),
+        'rtt_sum': float(rtts.sum()),
+        'rtt_max': float(rtts.max()) if len(rtts) else None
+    }
+    summary['distance'], summary['rotation'] = path_length(
+        [command for command, ok in zip(commands, kinds == OK) if ok])
+    _add_rates(summary, rtts)
+    return summary
+
+
+def aggregate(summaries):
+    """Combines the summaries of many sessions.
+
+    The percentiles are taken from the combined histograms, so they are
+    the upper edges of their RTT_BINS bins, capped by the longest round
+    trip time.
+
+    Args:
+        summaries (list): The summaries of the sessions
+    Returns:
+        dict: The total counts, distance and rotation and the combined
+        round trip time stats
+    """
+    total = {'file': 'total', 'starting_time': '', 'sessions': len(summaries)}
+    for field in ('commands', 'ok', 'errors', 'timeouts', 'duration',
+                  'distance', 'rotation', 'rtt_sum'):
+        total[field] = sum(summary[field] for summary in summaries)
+    histogram = np.zeros(len(RTT_BINS) - 1, dtype=np.int64)
+    for summary in summaries:
+        histogram += summary['rtt_histogram']
+    total['rtt_histogram'] = histogram.tolist()
+    maxima = [s['rtt_max'] for s in summaries if s['rtt_max'] is not None]
+    total['rtt_max'] = max(maxima, default=None)
+    _add_rates(total, histogram=histogram)
+    return total
+
+
+def _add_rates(summary, rtts=None, histogram=None):
+    """Adds the error rate and the round trip time mean and percentiles,
+    exact from rtts or approximated from a histogram."""
+    answered = summary['ok'] + summary['errors']
+    summary['error_rate'] = ((summary['errors'] + summary['timeouts']) /
+                             summary['commands'] if summary['commands'] else
+                             0.0)
+    summary['rtt_mean'] = (summary['rtt_sum'] / answered
+                           if answered else None)
+    for percentile in PERCENTILES:
+        key = 'rtt_p{}'.format(percentile)
+        if not answered:
+            summary[key] = None
+        elif rtts is not None:
+            summary[key] = float(np.percentile(rtts, percentile))
+        else:
+            rank = np.searchsorted(np.cumsum(histogram),
+                                   answered * percentile / 100)
+            # the bin edge may lie beyond any recorded round trip time
+            summary[key] = min(float(RTT_BINS[rank + 1]), summary['rtt_max'])
+
+
+def summarize_directory(sessions_dir, workers=None, use_cache=True):
+    """Summarizes every session of a directory.
+
+    Args:
+        sessions_dir (string): The directory of the sessions
+        workers (int): The number of parsing processes, None uses one per
+            cpu
+        use_cache (bool): If the cached summaries of unchanged files are
+            used and the cache is updated
+    Returns:
+        tuple: The summaries of the sessions sorted by file name, and
+        their aggregate
+    """
+    cache_path = os.path.join(sessions_dir, CACHE_FILE)
+    cache = {}
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError) as e:
+            print('[ERROR] Ignoring the cache {}: {}'.format(cache_path, e))
+
+    summaries = {}
+    stale = []
+    with os.scandir(sessions_dir) as entries:
+        for entry in entries:
+            if not (entry.is_file()
+                    and entry.name.endswith(SESSION_EXTENSIONS)):
+                continue
+            stat = entry.stat()
+            key = [stat.st_mtime_ns, stat.st_size]
+            cached = cache.get(entry.name)
+            if cached is not None and cached['key'] == key:
+                summaries[entry.name] = cached
+            else:
+                stale.append((entry.name, key))
+
+    if stale:
+        paths = [os.path.join(sessions_dir, name) for name, _ in stale]
+        workers = workers or os.cpu_count() or 1
+        # files are handed out in chunks, so thousands of small sessions do
+        # not cost a round trip to a worker each
+        chunksize = max(len(paths) // (4 * workers), 1)
+        with ProcessPoolExecutor(workers) as executor:
+            parsed = executor.map(summarize_session, paths,
+                                  chunksize=chunksize)
+            for (name, key), summary in zip(stale, parsed):
+                if summary is not None:
+                    summary['key'] = key
+                    summaries[name] = summary
+
+    if use_cache and (stale or len(summaries) != len(cache)):
+        try:
+            with open(cache_path, 'w') as f:
+                json.dump(summaries, f)
+        except OSError as e:
+            print('[ERROR] Could not write the cache {}: {}'.format(
+                cache_path, e))
+
+    ordered = [summaries[name] for name in sorted(summaries)]
+    return ordered, aggregate(ordered)
+
+
+def write_json(f, summaries, total):
+    hidden = ('key', 'rtt_histogram', 'rtt_sum')
+    json.dump(
+        {
+            'sessions': [{
+                field: value
+                for field, value in summary.items() if field not in hidden
+            } for summary in summaries],
+            'total': {
+                field: value
+                for field, value in total.items() if field not in hidden
+            }
+        },
+        f,
+        indent=2)
+    f.write('\n')
+
+
+def write_csv(f, summaries, total):
+    writer = csv.DictWriter(f, CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(summaries)
+    writer.writerow(total)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Summarizes a directory of saved sessions.')
+    parser.add_argument('sessions_dir', nargs='?', default='../sessions')
+    parser.add_argument('-o', '--output',
+                        help='the json or csv file, stdout if not given')
+    parser.add_argument('--format', choices=('json', 'csv'),
+                        help='defaults to the extension of the output')
+    parser.add_argument('--workers', type=int,
+                        help='parsing processes, one per cpu by default')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse every session again')
+    args = parser.parse_args()
+
+    output_format = args.format
+    if output_format is None:
+        output_format = ('csv' if args.output
+                         and args.output.endswith('.csv') else 'json')
+    summaries, total = summarize_directory(args.sessions_dir, args.workers,
+                                           not args.no_cache)
+    write = write_csv if output_format == 'csv' else write_json
+    if args.output is None:
+        write(sys.stdout, summaries, total)
+    else:
+        with open(args.output, 'w', newline='') as f:
+            write(f, summaries, total)
+        print('[INFO]  Summarized {} sessions to {}'.format(
+            len(summaries), args.output))
+
+
+if __name__ == '__main__':
+    main()
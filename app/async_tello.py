@@ -0,0 +1,357 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from time import time
+
+try:
+    import libh264decoder
+except ImportError:
+    # the decoder library is not built, the stream is received undecoded
+    libh264decoder = None
+
+from console import console
+from log import Logger, decode_response, iter_session
+from tello import DECODE_QUEUE_SIZE, TIMEOUT
+from telemetry import TelemetryReceiver
+from replay import ReplayStep, drift_report, replay_schedule
+from video import (LATEST, AccessUnitAssembler, FrameHub, FramePool,
+                   decode_frames)
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    """Forwards every datagram received on an endpoint to a callback."""
+
+    def __init__(self, on_datagram):
+        self.on_datagram = on_datagram
+
+    def datagram_received(self, data, address):
+        self.on_datagram(data, address)
+
+    def error_received(self, exc):
+        console.error('{}', exc)
+
+
+class AsyncTello:
+    """Handles the communication between the client and the tello on an
+    asyncio event loop.
+
+    The cmd, state and video ports are asyncio datagram endpoints instead of
+    threads blocked on sockets, so a single event loop can drive many drones.
+    The video packets are reassembled on the event loop and the access units
+    are decoded in order by a single executor thread, so decoding never
+    blocks the loop.
+    The command port is bound to an ephemeral local port by default, since
+    tello replies to the address the command came from.
+
+    Attributes:
+        cmd_address: The (ip, port) tuple commands are sent to
+        telemetry: The TelemetryReceiver holding the latest state of tello
+        log: The Logger of the session
+        frames: The FrameHub the decoded frames are published to
+        dropped_access_units: The number of access units dropped because
+            the decoder fell behind
+    """
+
+    def __init__(self,
+                 tello_ip='192.168.10.1',
+                 cmd_port=8889,
+                 state_port=8890,
+                 video_port=11111,
+                 host='0.0.0.0',
+                 local_cmd_port=0,
+                 history_seconds=600,
+                 video_format='rgb24',
+                 video_size=None):
+        """Configures the endpoints, connect opens them.
+
+        Args:
+            tello_ip (string): The ip of tello
+            cmd_port (int): The port tello receives commands on
+            state_port (int): The local port tello sends its state to, None
+                does not receive the state
+            video_port (int): The local port tello streams the video to,
+                opened once "streamon" succeeds
+            host (string): The local ip to bind the endpoints to
+            local_cmd_port (int): The local port commands are sent from, 0
+                picks a free one
+            history_seconds (int): The duration of state history kept in
+                telemetry.history, no history is kept without a state_port
+            video_format (string): The format of the decoded frames, one of
+                "rgb24", "bgr24", "gray" and "yuv420p"
+            video_size (tuple): The (width, height) the frames are scaled
+                to, None keeps the size of the stream
+        """
+        self.host = host
+        self.cmd_address = (tello_ip, cmd_port)
+        self.local_cmd_port = local_cmd_port
+        self.state_port = state_port
+        self.video_port = video_port
+
+        self.cmd_transport = None
+        self.state_transport = None
+        self.video_transport = None
+
+        # future of the command that awaits a response
+        self.pending = None
+
+        self.log = Logger()
+        self.telemetry = TelemetryReceiver(
+            history_seconds if state_port is not None else None)
+
+        # h264 decoder, fed by the executor thread only
+        self.video_format = video_format
+        self.decoder = None
+        if libh264decoder is not None:
+            self.decoder = libh264decoder.H264Decoder()
+            self.decoder.set_output(video_format, *(video_size or (0, 0)))
+        self.assembler = AccessUnitAssembler(self._on_access_unit)
+        self.frame_pool = FramePool()
+        self.frames = FrameHub()
+        self.decode_executor = None
+        # access units handed to the executor and not decoded yet
+        self.decoding = 0
+        self.dropped_access_units = 0
+
+    async def connect(self):
+        """Opens the command and state endpoints."""
+        loop = asyncio.get_running_loop()
+        self.cmd_transport, _ = await loop.create_datagram_endpoint(
+            lambda: _DatagramProtocol(self._on_response),
+            local_addr=(self.host, self.local_cmd_port))
+        if self.state_port is not None:
+            self.state_transport, _ = await loop.create_datagram_endpoint(
+                lambda: _DatagramProtocol(self._on_state),
+                local_addr=(self.host, self.state_port))
+
+    def close(self):
+        """Closes the open endpoints and stops decoding."""
+        for transport in (self.cmd_transport, self.state_transport,
+                          self.video_transport):
+            if transport is not None:
+                transport.close()
+        self.cmd_transport = None
+        self.state_transport = None
+        self.video_transport = None
+        if self.decode_executor is not None:
+            self.decode_executor.shutdown(wait=False)
+            self.decode_executor = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def send_command(self, command, reverse=False):
+        """Sends the given command to tello and awaits the response.
+
+        Args:
+            command (string): The command to be sent
+            reverse (bool): If the command belongs to reverse pathing commands
+        Returns:
+            bool: True if the command sent successfully and the response was
+            "OK". False if the command could not be sent, the response was
+            "ERROR" or the timeout window expired.
+        """
+        if self.pending is not None:
+            # if the client is waiting for a reponse, no further command
+            # can be accepted and sent
+            console.error('Another command awaits reponse, please wait')
+            return False
+
+        if command != 'command' and not self.log.initialized:
+            # if tello is not initialized it cannot accept any commands
+            console.error('Tello must be initialized. Run "command" first.')
+            return False
+
+        if not reverse:
+            # if the command is part of fetching, dont print it
+            console.info('Sending: {}', command)
+        pending = self.pending = asyncio.get_running_loop().create_future()
+        self.log.set_command_sent(command)
+        self.cmd_transport.sendto(command.encode('utf-8'), self.cmd_address)
+
+        try:
+            success = await asyncio.wait_for(pending, TIMEOUT)
+        except asyncio.TimeoutError:
+            console.error('Command {} timed out.', command)
+            self.log.reset()
+            return False
+        finally:
+            if self.pending is pending:
+                self.pending = None
+
+        if success and command == 'streamon':
+            await self._open_video_endpoint()
+        return success
+
+    def _on_response(self, data, address):
+        """Resolves the pending command future with the result of
+        log.received, unless the response was a late one."""
+        response = decode_response(data)
+        console.info('Response: {}', response)
+
+        success = self.log.received(response)
+        if success is None:
+            console.info('Discarded a response that answers no pending '
+                         'command')
+            return
+        pending, self.pending = self.pending, None
+        if pending is not None and not pending.done():
+            pending.set_result(success)
+
+    def _on_state(self, data, address):
+        self.telemetry.parse(data)
+
+    async def _open_video_endpoint(self):
+        if self.video_transport is not None:
+            # the stream was turned on before
+            return
+        if self.decoder is None:
+            console.error('libh264decoder not found, video is not decoded')
+        else:
+            self.decode_executor = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.get_running_loop()
+        self.video_transport, _ = await loop.create_datagram_endpoint(
+            lambda: _DatagramProtocol(self._on_video),
+            local_addr=(self.host, self.video_port))
+
+    def _on_video(self, data, address):
+        self.assembler.feed(data)
+
+    def _on_access_unit(self, access_unit):
+        """Hands a complete access unit to the decoding executor, unless
+        DECODE_QUEUE_SIZE of them already wait to be decoded."""
+        if self.decode_executor is None:
+            return
+        if self.decoding >= DECODE_QUEUE_SIZE:
+            # the decoder fell behind, the loop keeps draining the socket
+            self.dropped_access_units += 1
+            return
+        self.decoding += 1
+        future = asyncio.get_running_loop().run_in_executor(
+            self.decode_executor, self._decode, access_unit)
+        future.add_done_callback(self._on_decoded)
+
+    def _decode(self, access_unit):
+        """Decodes an access unit and publishes its frames, on the executor
+        thread."""
+        for frame in decode_frames(self.decoder, access_unit,
+                                   self.frame_pool, self.video_format):
+            self.frames.publish(frame)
+
+    def _on_decoded(self, future):
+        self.decoding -= 1
+        if not future.cancelled() and future.exception() is not None:
+            console.error('{}', future.exception())
+
+    @property
+    def frame(self):
+        """numpy.ndarray: The latest decoded frame, None before the first
+        one."""
+        return self.frames.frame
+
+    def subscribe_frames(self, policy=LATEST, maxsize=4):
+        """Subscribes a consumer to the decoded frames.
+
+        Args:
+            policy (string): What happens when the consumer falls behind,
+                one of video.LATEST, video.DROP_OLDEST and video.BLOCK
+            maxsize (int): The number of frames queued for the consumer
+        Returns:
+            FrameSubscription: The subscription to get the frames from
+        """
+        return self.frames.subscribe(policy, maxsize)
+
+    def unsubscribe_frames(self, subscription):
+        """Stops delivering frames to the given subscription."""
+        self.frames.unsubscribe(subscription)
+
+    def get_video_stats(self):
+        """Returns the reassembly counters and the number of access units
+        dropped because the decoder fell behind."""
+        stats = self.assembler.stats()
+        stats['dropped'] = self.dropped_access_units
+        return stats
+
+    async def fetch(self):
+        """Sends the route back to where the session started, a straight
+        line followed by the rotation to the starting heading."""
+        console.info('Returning home...')
+        r_cmds = self.log.reverse_path_cmd()
+        for cmd in r_cmds:
+            await self.send_command(cmd, reverse=True)
+
+    async def replay_session(self, session_file, speed=None):
+        """Streams the commands of the session file given and executes them.
+
+        With a speed, each command is sent when it is due by the recorded
+        timing, otherwise as soon as the previous one is answered. The
+        drift from the recording is printed once done.
+
+        Args:
+            session_file (string): The file of the session to be loaded
+            speed (float): The factor the recorded timing is sped up by,
+                e.g. 1.0 reproduces it and 2.0 halves every pause. None
+                replays as fast as tello answers
+        Returns:
+            list: The ReplayStep of every command
+        """
+        steps = []
+        start = time()
+        schedule = replay_schedule(iter_session(session_file), speed)
+        for cmd, due, original_rtt in schedule:
+            send_lag = 0.0
+            if due is not None:
+                delay = start + due - time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                send_lag = max(-delay, 0.0)
+            sent = time()
+            success = await self.send_command(cmd)
+            steps.append(
+                ReplayStep(cmd, success, original_rtt, time() - sent,
+                           send_lag))
+
+        console.info('Replay drift: {}', drift_report(steps))
+        return steps
+
+    def write_session(self, session_name):
+        """Writes the current session to a txt file by calling log.save
+
+        Args:
+            session_name (string): The name of the session
+        """
+        os.makedirs('../sessions', exist_ok=True)
+        name = '../sessions/session_{}.txt'.format(session_name)
+        self.log.save(name)
+
+    def get_status(self):
+        return self.log.status
+
+    def get_battery(self):
+        """Returns the battery level of the latest state received, or the
+        response of the last "battery?" query if no state has arrived."""
+        battery = self.telemetry.get('bat')
+        if np.isnan(battery):
+            return self.log.battery
+        return int(battery)
+
+    def get_state(self):
+        """Returns the latest state of tello as a dictionary, or None if no
+        state has been received."""
+        return self.telemetry.snapshot()
+
+    async def initialize(self):
+        """Sends "command" command, after which tello starts streaming its
+        state, battery included, to the state port.
+
+        Returns:
+            bool: True if "command" was sent successfully, False if "command"
+            failed
+        """
+        return await self.send_command('command')
@@ -0,0 +1,118 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class _Call:
+    """A function queued to run on the writing thread."""
+
+    def __init__(self, function):
+        self.function = function
+        self.future = Future()
+
+    def run(self):
+        try:
+            self.future.set_result(self.function())
+        except Exception as e:
+            self.future.set_exception(e)
+
+
+# queued by close, the writing thread returns once it gets it
+_CLOSE = object()
+
+
+class BatchWriter:
+    """Hands queued items to a write function in batches on a background
+    thread.
+
+    Items are queued by put and written in batches of at most batch_size by
+    the writing thread, so the threads producing them, e.g. the receiving
+    threads of Tello, never wait for the disk.
+
+    Attributes:
+        closed: A boolean that indicates if close was called
+    """
+
+    def __init__(self, write_batch, batch_size=64, on_close=None):
+        """Starts the writing thread.
+
+        Args:
+            write_batch (function): Called on the writing thread with a list
+                of the items queued since the previous batch
+            batch_size (int): The number of items written at most per batch
+            on_close (function): Called on the writing thread once the
+                items queued before close are written, None calls nothing
+        """
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.on_close = on_close
+        self.closed = False
+
+        self.queue = queue.SimpleQueue()
+        self.writer_thread = threading.Thread(target=self._writer_thread,
+                                              daemon=True)
+        self.writer_thread.start()
+
+    def put(self, item):
+        """Queues an item to be written."""
+        self.queue.put(item)
+
+    def call(self, function, timeout=None):
+        """Runs a function on the writing thread once the items queued
+        before it are written, and waits for it.
+
+        Args:
+            function (function): Called without arguments
+            timeout (float): Seconds to wait, None waits forever
+        Returns:
+            The result of the function
+        Raises:
+            ValueError: If the writer is closed or its thread has died
+            TimeoutError: If the function did not run within the timeout
+            Exception: Whatever the function raised
+        """
+        if self.closed or not self.writer_thread.is_alive():
+            raise ValueError('The writer is closed')
+        call = _Call(function)
+        self.queue.put(call)
+        return call.future.result(timeout)
+
+    def close(self):
+        """Writes the queued items and stops the writing thread."""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_CLOSE)
+        self.writer_thread.join()
+
+    def _writer_thread(self):
+        """Writes the queued items in batches until closed."""
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            items = []
+            for item in batch:
+                if item is _CLOSE:
+                    running = False
+                    break
+                if isinstance(item, _Call):
+                    # write the items queued before the call first
+                    self._write(items)
+                    items = []
+                    item.run()
+                    continue
+                items.append(item)
+            self._write(items)
+
+        if self.on_close is not None:
+            self.on_close()
+
+    def _write(self, items):
+        if items:
+            self.write_batch(items)
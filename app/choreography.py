@@ -0,0 +1,150 @@
+"""Flies a swarm through a session file per drone in lockstep.
+
+Usage: python choreography.py ip=session_file [ip=session_file ...]
+"""
+import argparse
+from time import time
+from collections import namedtuple
+from concurrent.futures import as_completed
+
+from console import console
+from log import read_session
+from swarm import Swarm
+
+# the outcome of a step: the command and success per ip, the seconds from
+# sending to the last response, the seconds between the first and the last
+# response and the ip of the drone that answered last
+StepResult = namedtuple(
+    'StepResult',
+    ['step', 'commands', 'results', 'duration', 'barrier_wait', 'slowest'])
+
+
+class Choreography:
+    """Executes the commands of many drones in lockstep steps.
+
+    Step n sends the n-th command of every drone at once and waits at a
+    barrier until all of them are answered before the next step starts. A
+    drone that has no n-th command hovers during the step.
+
+    Attributes:
+        steps: A list with a dictionary of the command per ip per step
+        results: The StepResult of every executed step
+    """
+
+    def __init__(self, swarm, sessions):
+        """Loads the session files.
+
+        Args:
+            swarm (Swarm): The swarm the drones belong to
+            sessions (dict): The session file per ip
+        """
+        self.swarm = swarm
+        commands = {ip: read_session(path) for ip, path in sessions.items()}
+        num_steps = max((len(cmds) for cmds in commands.values()), default=0)
+        self.steps = [{
+            ip: cmds[step]
+            for ip, cmds in commands.items() if step < len(cmds)
+        } for step in range(num_steps)]
+        self.results = []
+
+    def run_step(self, step):
+        """Sends the commands of a step at once and waits for all of the
+        responses.
+
+        Args:
+            step (int): The number of the step
+        Returns:
+            StepResult: The outcome of the step
+        """
+        commands = self.steps[step]
+        start = time()
+        futures = {
+            self.swarm.send(ip, command): ip
+            for ip, command in commands.items()
+        }
+        # the time every drone answered, in the order they did
+        answered = {}
+        for future in as_completed(futures):
+            answered[futures[future]] = time()
+
+        stamps = list(answered.values()) or [start]
+        result = StepResult(
+            step=step,
+            commands=commands,
+            results={ip: future.result()
+                     for future, ip in futures.items()},
+            duration=stamps[-1] - start,
+            barrier_wait=stamps[-1] - stamps[0],
+            slowest=next(reversed(answered), None))
+        self.results.append(result)
+        return result
+
+    def run(self, stop_on_failure=True):
+        """Executes every step in order.
+
+        Args:
+            stop_on_failure (bool): If the choreography stops after a step
+                in which a command failed
+        Returns:
+            bool: True if every command of every step succeeded
+        """
+        for step in range(len(self.steps)):
+            result = self.run_step(step)
+            console.info('Step {}: {:.3f} s, barrier wait {:.3f} s, '
+                         'slowest {}', step, result.duration,
+                         result.barrier_wait, result.slowest)
+            if not all(result.results.values()):
+                failed = [ip for ip, ok in result.results.items() if not ok]
+                console.error('Step {} failed on {}', step,
+                              ', '.join(failed))
+                if stop_on_failure:
+                    return False
+        return all(all(r.results.values()) for r in self.results)
+
+    def report(self):
+        """Returns the total barrier wait and the number of steps each
+        drone was the slowest in.
+
+        Returns:
+            dict: The number of 'steps' executed, the total 'barrier_wait'
+            in seconds and the 'slowest' count per ip
+        """
+        slowest = {}
+        for result in self.results:
+            if result.slowest is not None:
+                slowest[result.slowest] = slowest.get(result.slowest, 0) + 1
+        return {
+            'steps': len(self.results),
+            'barrier_wait': sum(r.barrier_wait for r in self.results),
+            'slowest': slowest
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Flies a swarm through a session per drone in lockstep.')
+    parser.add_argument('sessions', nargs='+', metavar='ip=session_file')
+    parser.add_argument('--cmd-port', type=int, default=8889)
+    parser.add_argument('--state-port', type=int, default=8890)
+    parser.add_argument('--keep-going', action='store_true',
+                        help='continue after a step in which a command failed')
+    args = parser.parse_args()
+
+    sessions = dict(arg.split('=', 1) for arg in args.sessions)
+    swarm = Swarm(list(sessions), cmd_port=args.cmd_port,
+                  state_port=args.state_port)
+    try:
+        initialized = swarm.initialize()
+        if not all(initialized.values()):
+            console.error('Not initialized: {}', ', '.join(
+                ip for ip, ok in initialized.items() if not ok))
+            return
+        choreography = Choreography(swarm, sessions)
+        choreography.run(stop_on_failure=not args.keep_going)
+        console.info('{}', choreography.report())
+    finally:
+        swarm.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import threading
+from time import time
+from collections import deque
+
+# pathing commands and the maximum value tello accepts for each of them
+MOVE_LIMITS = {
+    'up': 500,
+    'down': 500,
+    'left': 500,
+    'right': 500,
+    'forward': 500,
+    'back': 500,
+    'cw': 360,
+    'ccw': 360
+}
+
+
+class CommandQueue:
+    """A FIFO queue of commands waiting to be dispatched to tello.
+
+    Consecutive pathing commands of the same direction are coalesced while
+    they wait in the queue, e.g. three "forward 20" become "forward 60", as
+    long as the sum stays within the limit tello accepts.
+
+    Attributes:
+        coalesce: A boolean that indicates if moves are coalesced
+        enqueued: The number of commands put in the queue
+        coalesced: The number of commands merged into a queued one
+        dispatched: The number of commands taken out of the queue
+        total_wait: The total time dispatched commands spent in the queue
+        max_wait: The longest time a dispatched command spent in the queue
+    """
+
+    def __init__(self, coalesce=True):
+        self.coalesce = coalesce
+        # list of [direction, value, enqueue time] entries, the value of a
+        # non pathing command is None and its direction is the whole command
+        self.entries = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.enqueued = 0
+        self.coalesced = 0
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, command):
+        """Appends the command to the queue or merges it into the last
+        queued command.
+
+        Args:
+            command (string): The command to be queued
+        """
+        direction, value = _split_move(command)
+        with self.condition:
+            self.enqueued += 1
+            if self.coalesce and value is not None and self.entries:
+                last = self.entries[-1]
+                if (last[0] == direction and last[1] is not None
+                        and last[1] + value <= MOVE_LIMITS[direction]):
+                    # same direction as the last queued command
+                    last[1] += value
+                    self.coalesced += 1
+                    return
+            self.entries.append([direction, value, time()])
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """Removes and returns the first command of the queue.
+
+        Blocks until a command is available, the timeout expires or the
+        queue is closed.
+
+        Args:
+            timeout (float): Seconds to wait, None waits forever
+        Returns:
+            string: The command, None if the timeout expired or the queue
+            was closed
+        """
+        with self.condition:
+            if not self.condition.wait_for(
+                    lambda: self.entries or self.closed, timeout):
+                return None
+            if self.closed:
+                return None
+            direction, value, enqueued = self.entries.popleft()
+
+            wait = time() - enqueued
+            self.dispatched += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+        if value is None:
+            return direction
+        return '{} {}'.format(direction, value)
+
+    def clear(self):
+        """Discards every queued command."""
+        with self.condition:
+            self.entries.clear()
+
+    def close(self):
+        """Wakes up the waiting getters, get returns None from now on."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def stats(self):
+        """Returns the queue metrics.
+
+        Returns:
+            dict: The queue depth, the enqueued, coalesced and dispatched
+            command counts and the mean and max wait time in seconds
+        """
+        with self.condition:
+            mean_wait = (self.total_wait / self.dispatched
+                         if self.dispatched else 0.0)
+            return {
+                'depth': len(self.entries),
+                'enqueued': self.enqueued,
+                'coalesced': self.coalesced,
+                'dispatched': self.dispatched,
+                'mean_wait': mean_wait,
+                'max_wait': self.max_wait
+            }
+
+
+def _split_move(command):
+    """Splits a pathing command to its direction and integer value.
+
+    Args:
+        command (string): The command to be split
+    Returns:
+        tuple: (direction, value) for pathing commands, (command, None) for
+        any other command
+    """
+    parts = command.split(' ')
+    if len(parts) == 2 and parts[0] in MOVE_LIMITS:
+        try:
+            return parts[0], int(parts[1])
+        except ValueError:
+            pass
+    return command, None
@@ -0,0 +1,126 @@
+import sys
+import queue
+import atexit
+import threading
+from time import time
+
+# the levels of the messages, only the ones at or above the level of the
+# console are printed
+DEBUG = 10
+INFO = 20
+ERROR = 40
+PREFIXES = {DEBUG: '[DEBUG] ', INFO: '[INFO]  ', ERROR: '[ERROR] '}
+
+
+class Console:
+    """Prints leveled, rate-limited messages from a background thread.
+
+    Messages are formatted and printed by the printing thread, so the
+    threads that log them, e.g. the receiving threads of Tello, never wait
+    for the console. Every message format is limited to burst messages at
+    once and rate messages per second after that. The messages over the
+    limit are counted and reported along with the next printed one.
+
+    Attributes:
+        level: The lowest level printed
+        rate: The messages per second printed per format
+        burst: The messages printed at once per format
+        suppressed: The number of messages not printed over the limit
+    """
+
+    def __init__(self, level=INFO, rate=10.0, burst=20, stream=None):
+        """Sets the level and the limits, the printing thread starts with
+        the first message.
+
+        Args:
+            level (int): The lowest level printed, one of DEBUG, INFO and
+                ERROR
+            rate (float): The messages per second printed per format
+            burst (int): The messages printed at once per format
+            stream: The file the messages are printed to, sys.stdout by
+                default
+        """
+        self.level = level
+        self.rate = rate
+        self.burst = burst
+        self.stream = stream
+        self.suppressed = 0
+        # the [tokens, last refill, suppressed] of every format
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.queue = queue.SimpleQueue()
+        self.printer_thread = None
+
+    def debug(self, message, *args):
+        self.log(DEBUG, message, *args)
+
+    def info(self, message, *args):
+        self.log(INFO, message, *args)
+
+    def error(self, message, *args):
+        self.log(ERROR, message, *args)
+
+    def log(self, level, message, *args):
+        """Queues a message to be printed, if its level is printed and its
+        format is within the limits.
+
+        Args:
+            level (int): The level of the message
+            message (string): The format of the message, formatted with args
+                by the printing thread
+        """
+        if level < self.level:
+            return
+        now = time()
+        with self.lock:
+            bucket = self.buckets.get(message)
+            if bucket is None:
+                bucket = self.buckets[message] = [self.burst, now, 0]
+            bucket[0] = min(bucket[0] + (now - bucket[1]) * self.rate,
+                            self.burst)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed += 1
+                return
+            bucket[0] -= 1
+            skipped, bucket[2] = bucket[2], 0
+            if self.printer_thread is None:
+                self.printer_thread = threading.Thread(
+                    target=self._printer_thread, daemon=True)
+                self.printer_thread.start()
+                atexit.register(self.flush)
+        self.queue.put((level, message, args, skipped))
+
+    def flush(self, timeout=1.0):
+        """Waits until the queued messages are printed.
+
+        Args:
+            timeout (float): The seconds to wait at most
+        """
+        if self.printer_thread is None:
+            return
+        printed = threading.Event()
+        self.queue.put(printed)
+        printed.wait(timeout)
+
+    def _printer_thread(self):
+        while True:
+            item = self.queue.get()
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            level, message, args, skipped = item
+            try:
+                line = PREFIXES[level] + (message.format(*args)
+                                          if args else message)
+            except (IndexError, KeyError, ValueError) as e:
+                line = '{}{!r} {!r}: {}'.format(PREFIXES[ERROR], message,
+                                                args, e)
+            if skipped:
+                line += ' ({} similar messages suppressed)'.format(skipped)
+            print(line, file=self.stream or sys.stdout)
+
+
+# the console the modules of the app log to
+console = Console()
@@ -0,0 +1,98 @@
+import os
+import shutil
+
+from batch_writer import BatchWriter
+
+# seconds snapshot waits for the writing thread
+SNAPSHOT_TIMEOUT = 10.0
+
+
+class SessionJournal:
+    """Appends the records of a session to a text file as they happen.
+
+    The file has the format of Logger.to_text, so it is a readable session
+    file at any time and a crash loses at most the records of the latest
+    batch. Records are written in batches by a BatchWriter. The file is
+    only created along with the first record, so a session in which
+    nothing happened leaves no file behind.
+
+    Attributes:
+        path: The path of the journal file
+        written: The number of records written
+    """
+
+    def __init__(self, path, header, batch_size=64):
+        """Starts the writing thread, the file is created by the first
+        record.
+
+        Args:
+            path (string): The path of the journal file
+            header (string): The first line of the file
+            batch_size (int): The number of records written at most between
+                two flushes
+        """
+        self.path = path
+        self.header = header
+        self.file = None
+        self.written = 0
+        self.writer = BatchWriter(self._write, batch_size, self._close_file)
+
+    @property
+    def closed(self):
+        return self.writer.closed
+
+    def write(self, record):
+        """Queues a record to be appended.
+
+        Args:
+            record (string): The line of the record, without a line break
+        """
+        self.writer.put(record)
+
+    def snapshot(self, path, timeout=SNAPSHOT_TIMEOUT):
+        """Writes the queued records and copies the journal to the given
+        path. The journal keeps being appended to at its own path, so every
+        snapshot is an independent file.
+
+        Args:
+            path (string): The path of the copy
+            timeout (float): Seconds to wait for the copy
+        Raises:
+            ValueError: If the journal is closed
+            TimeoutError: If the copy did not finish within the timeout
+            OSError: If the copy could not be written
+        """
+        self.writer.call(lambda: self._copy(path), timeout)
+
+    def close(self, discard=False):
+        """Writes the queued records and closes the file.
+
+        Args:
+            discard (bool): Deletes the file once closed, e.g. for a session
+                that never connected
+        """
+        self.writer.close()
+        if discard and self.file is not None:
+            os.remove(self.path)
+            self.file = None
+
+    def _write(self, records):
+        if self.file is None:
+            self.file = open(self.path, 'w')
+            self.file.write(self.header + '\n')
+        # every record starts a new line, as in Logger.to_text
+        self.file.write(''.join('\n' + record for record in records))
+        self.file.flush()
+        self.written += len(records)
+
+    def _copy(self, path):
+        if self.file is None:
+            # nothing was written yet, the copy only holds the header
+            with open(path, 'w') as f:
+                f.write(self.header + '\n')
+        else:
+            shutil.copyfile(self.path, path)
+
+    def _close_file(self):
+        if self.file is not None:
+            self.file.close()
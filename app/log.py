@@ -1,9 +1,123 @@
 from time import time
 from datetime import datetime
-from collections import namedtuple
+from collections import namedtuple, deque
+
+import numpy as np
+
+from console import console
+from journal import SessionJournal
+from session_file import OK, SessionFile
 
 cmdPoint = namedtuple('cmdPoint', ['command', 'sTime', 'rTime'])
 
+# the latest cmdPoints kept in memory of a journaled session, the whole
+# session is in the journal. a session without a journal keeps them all
+COMMAND_HISTORY = 1000
+# seconds a response to a timed out or resent command may still arrive
+STRAY_WINDOW = 10.0
+# a response arriving sooner than this fraction of the shortest round trip
+# time seen for its command cannot be the answer to it
+EARLY_FRACTION = 0.5
+
+# unit vector of every pathing direction in the body frame of tello, x
+# forward, y left and z up
+DIRECTION_VECTORS = {
+    'forward': np.array([1.0, 0.0, 0.0]),
+    'back': np.array([-1.0, 0.0, 0.0]),
+    'left': np.array([0.0, 1.0, 0.0]),
+    'right': np.array([0.0, -1.0, 0.0]),
+    'up': np.array([0.0, 0.0, 1.0]),
+    'down': np.array([0.0, 0.0, -1.0])
+}
+# the sign of the yaw change of the rotations, counterclockwise is positive
+ROTATIONS = {'cw': -1, 'ccw': 1}
+# the largest distance per axis and the smallest one on every axis tello
+# accepts in a "go" command
+GO_LIMIT = 500
+GO_MINIMUM = 20
+# speed in cm/s of the "go" commands of the route home
+RETURN_SPEED = 50
+
+
+def decode_response(data):
+    """Decodes the body of a response datagram.
+
+    Args:
+        data (bytes): The datagram received from tello
+    Returns:
+        string: The response without surrounding whitespace
+    """
+    try:
+        response = data.decode('utf-8')
+    except UnicodeDecodeError:
+        response = data.decode('latin-1')
+    return response.strip()
+
+
+def iter_session(session_file):
+    """Yields the executed commands of a session file written by
+    Logger.to_text, or of a binary .tses file, without loading it whole.
+
+    The initial "command" and the failures and states the journal writes
+    as "#" comment lines are skipped.
+
+    Args:
+        session_file (string): The file of the session
+    Yields:
+        tuple: (command, sTime, rTime) of every command, oldest first
+    """
+    if session_file.endswith('.tses'):
+        records = _binary_records(session_file)
+    else:
+        records = _text_records(session_file)
+
+    first = True
+    for command, send_time, rsp_time in records:
+        if first and command == 'command':
+            first = False
+            continue
+        first = False
+        yield command, send_time, rsp_time
+
+
+def _binary_records(session_file, chunk=4096):
+    session = SessionFile(session_file)
+    for start in range(0, len(session), chunk):
+        # only a chunk of the mapped records is converted at a time
+        for stime, rtime, command, kind in session.records[
+                start:start + chunk].tolist():
+            if kind == OK:
+                yield session.strings[command], stime, rtime
+
+
+def _text_records(session_file):
+    with open(session_file, 'r') as f:
+        # line1: date, line2: new_line
+        next(f, None)
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            command, _, times = line.rstrip('\n').partition('\t')
+            send_time, rsp_time = map(float, times.split())
+            yield command, send_time, rsp_time
+
+
+def read_session(session_file):
+    """Reads the commands of a session file, see iter_session.
+
+    Args:
+        session_file (string): The file of the session
+    Returns:
+        List of strings: The commands after the initial "command"
+    """
+    return [command for command, _, _ in iter_session(session_file)]
+
+
+def is_error(response):
+    """Returns True if the response reports a failed command, e.g.
+    "error" or "error Not joystick"."""
+    return response.lower().startswith('error')
+
 
 class Logger:
     """Handles the logs of a tello session.
@@ -11,20 +125,57 @@ class Logger:
     Attributes:
         starting_time: The starting datetime of the session
         start_stamp: Starting timestamp
-        command_sent: A list tuple containing the body and the time of the
-            command sent to tello
-        command_tuples: A list of cmdPoint tuples
+        command_sent: A deque of [seq, command, send time, sends] lists of
+            the commands sent to tello that await a response, oldest first
+        strays: A deque of [seq, command, count, until, late] lists of the
+            responses that may still arrive for commands that timed out
+            (late) or were resent and answered (not late)
+        command_tuples: A deque of the cmdPoint tuples, only the latest
+            COMMAND_HISTORY ones if the session is journaled
+        journal: The SessionJournal every record is appended to, None if
+            the session is only kept in memory
+        pose: A float array with the x, y, z position in cm and the yaw in
+            degrees of tello, relative to where the session started
+        min_rtt: The shortest round trip time seen per command name
+        late: The number of responses to timed out commands discarded
+        duplicates: The number of responses to resent commands discarded
+        unmatched: The number of responses that arrived while no command
+            awaited one
         battery: The battery level of tello
         status: The status of tello
         initialized: A boolean that indicates if tello is initialized
     """
 
-    def __init__(self):
+    def __init__(self, stray_window=STRAY_WINDOW, journal_path=None):
+        """Starts the session.
+
+        Args:
+            stray_window (float): The seconds a response to a timed out or
+                resent command may still arrive
+            journal_path (string): The file the session is streamed to,
+                None keeps it in memory only
+        """
         self.starting_time = datetime.now().strftime('%A %d. %B, %H:%M')
         self.start_stamp = time()
 
-        self.command_sent = ()  # tuple with the command sent and its timestamp
-        self.command_tuples = []  # list of cmdPoints
+        # the commands sent and their timestamps
+        self.command_sent = deque()
+        self.next_seq = 0
+        self.journal = None
+        history = None
+        if journal_path is not None:
+            self.journal = SessionJournal(journal_path, self.starting_time)
+            history = COMMAND_HISTORY
+        self.command_tuples = deque(maxlen=history)  # cmdPoints
+        self.pose = np.zeros(4)
+
+        # the responses still expected for expired or resent commands
+        self.strays = deque()
+        self.stray_window = stray_window
+        self.min_rtt = {}
+        self.late = 0
+        self.duplicates = 0
+        self.unmatched = 0
 
         self.battery = None
         self.status = 'Not connected'
@@ -32,140 +183,236 @@ class Logger:
         self.initialized = False
 
     def set_command_sent(self, command):
-        self.command_sent = (command, time() - self.start_stamp)
+        """Records a command sent to tello.
+
+        Args:
+            command (string): The body of the command
+        Returns:
+            int: The sequence number of the command
+        """
+        seq = self.next_seq
+        self.next_seq += 1
+        self.command_sent.append([seq, command, time() - self.start_stamp, 1])
+        return seq
+
+    def resent(self):
+        """Records that the oldest command awaiting a response was sent
+        again, so it may be answered more than once."""
+        if self.command_sent:
+            self.command_sent[0][3] += 1
 
     def reset(self):
-        """Sets the command_sent attribute to an empty tuple."""
-        self.command_sent = ()
+        """Drops the oldest command that awaits a response, as it timed
+        out.
+
+        A response to it may still arrive late, it is then discarded instead
+        of being taken for the response of the next command.
+        """
+        if self.command_sent:
+            seq, command, send_time, sends = self.command_sent.popleft()
+            self._expect_strays(seq, command, sends, late=True)
+            self._journal('# timeout {}\t {}'.format(command, send_time))
+
+    def _expect_strays(self, seq, command, count, late):
+        until = time() - self.start_stamp + self.stray_window
+        self.strays.append([seq, command, count, until, late])
+
+    def _fits(self, sent, response, rsp_time):
+        """Returns True if the response can be the answer to the sent
+        command.
+
+        A query is answered with its value, any other command with "ok" or
+        an error. Neither can be answered sooner than the shortest round
+        trip time seen for the command allows.
+        """
+        _, command, send_time, _ = sent
+        name = command.split(' ')[0]
+        if name.endswith('?'):
+            if response.lower() == 'ok':
+                return False
+        elif response.lower() != 'ok' and not is_error(response):
+            return False
+        min_rtt = self.min_rtt.get(name)
+        return (min_rtt is None
+                or rsp_time - send_time >= EARLY_FRACTION * min_rtt)
 
     def received(self, response):
         """Handles tello's response.
 
+        Tello answers in order without tagging the responses, so a response
+        is matched to the oldest command that awaits one. While a timed out
+        or resent command may still be answered, a response that does not
+        fit the oldest command is taken for such a late or duplicate
+        response and discarded.
+
         If it is not an error response, updates the command_tuples list,
         the status and the battery level.
 
         Args:
-            response (string): The body of the response
+            response (string): The decoded body of the response
         Returns:
-            bool: True if execution was successful, False if response was
-            "Error" or a command was not sent
+            bool: True if execution was successful, False if the response
+            was an error. None if the response was discarded, as it answers
+            no command that awaits one.
         """
         rsp_time = time() - self.start_stamp
 
-        if response == 'Error':
+        while self.strays and self.strays[0][3] < rsp_time:
+            # no response is expected this late
+            self.strays.popleft()
+
+        oldest = self.command_sent[0] if self.command_sent else None
+        if self.strays and (oldest is None
+                            or not self._fits(oldest, response, rsp_time)):
+            stray = self.strays[0]
+            if stray[4]:
+                self.late += 1
+            else:
+                self.duplicates += 1
+            stray[2] -= 1
+            if not stray[2]:
+                self.strays.popleft()
+            return None
+        if oldest is None:
+            self.unmatched += 1
+            return None
+
+        seq, command, send_time, sends = self.command_sent.popleft()
+        if sends > 1:
+            # the other copies may be answered too
+            self._expect_strays(seq, command, sends - 1, late=False)
+        else:
+            # the round trip time of a resent command is ambiguous
+            name = command.split(' ')[0]
+            rtt = rsp_time - send_time
+            self.min_rtt[name] = min(self.min_rtt.get(name, rtt), rtt)
+
+        if is_error(response):
             # tello failed to execute command
-            self.reset()
+            self._journal('# error {}\t {} {}'.format(command, send_time,
+                                                      rsp_time))
             return False
 
-        try:
-            # form the cmdPoint tuple
-            cmd_tuple = cmdPoint(command=self.command_sent[0],
-                                 sTime=self.command_sent[1],
-                                 rTime=rsp_time)
-            self.command_tuples.append(cmd_tuple)
-        except IndexError:
-            # IndexError: command_sent is an empty tuple
-            return False
+        # form the cmdPoint tuple
+        cmd_tuple = cmdPoint(command=command, sTime=send_time, rTime=rsp_time)
+        self.command_tuples.append(cmd_tuple)
+        self._journal('{cmd.command}\t {cmd.sTime} {cmd.rTime}'.format(
+            cmd=cmd_tuple))
 
-        # update tello's status
-        self.update_status(self.command_sent[0])
+        # update tello's status and pose
+        self.update_status(command)
+        self.update_pose(command)
 
-        if self.command_sent[0] == 'battery?':
+        if command == 'battery?':
             self.battery = response
 
         return True
 
-    def get_pathing_commands(self):
-        """Forms a list of the grouped pathing commands.
+    def update_pose(self, command):
+        """Moves the pose by an executed pathing, rotation or "go" command.
 
-        Pathing commands have the following format: {direction} {value}
-        Same commands are grouped, that means that they are represented
-        as {direction} {sum_value}.
-
-        Returns:
-            List of strings: The grouped command strings.
+        Args:
+            command (string): The body of the command executed
         """
-        pathing_command_list = [
-            'up', 'down', 'left', 'right', 'forward', 'back', 'cw', 'ccw'
-        ]
-        filtered_commands = list(
-            filter(lambda x: x.command.split(' ')[0] in pathing_command_list,
-                   self.command_tuples))
-
-        last_cmd = None
-        sum_value = 0  # value of consecutive same commands
-        grouped = []
-        for ind, cmd in enumerate(filtered_commands):
-            direction, value = cmd.command.split(' ')
-            value = int(value)
-
-            if not ind:
-                # if first command, just set last command to current
-                # and increase the sum_value
-                last_cmd = direction
-                sum_value += value
-                continue
-
-            if last_cmd == direction:
-                # if same command just increase the sum_value
-                sum_value += value
+        parts = command.split(' ')
+        try:
+            if parts[0] in DIRECTION_VECTORS and len(parts) == 2:
+                body = DIRECTION_VECTORS[parts[0]] * float(parts[1])
+            elif parts[0] == 'go' and len(parts) == 5:
+                body = np.array(parts[1:4], dtype=float)
+            elif parts[0] in ROTATIONS and len(parts) == 2:
+                yaw = self.pose[3] + ROTATIONS[parts[0]] * float(parts[1])
+                # keep the yaw in [-180, 180)
+                self.pose[3] = (yaw + 180) % 360 - 180
+                return
             else:
-                # if commands diviate, append to grouped the last command
-                # with the sum_value
-                grouped.append('{} {}'.format(last_cmd, sum_value))
-                last_cmd = direction
-                # sum_value must be set to current value and not 0!
-                sum_value = value
-
-            if ind == len(filtered_commands) - 1:
-                # if the last command, add it to grouped along with the
-                # sum value
-                grouped.append('{} {}'.format(direction, sum_value))
-        return grouped
+                return
+        except ValueError:
+            # not a number
+            return
+        self.pose[:3] += _yaw_matrix(self.pose[3]) @ body
 
     def reverse_path_cmd(self):
-        """Iterates through the grouped pathing commands and returns their
-        reveresed.
+        """Returns the shortest route from the current pose back to where
+        the session started.
 
-        The reverse of a command is defined by the reverse_cmd_map dictionary.
+        The route is a straight line of "go" commands, a single one unless
+        the distance exceeds GO_LIMIT on an axis, followed by the rotation
+        back to the starting heading. Within GO_MINIMUM on every axis tello
+        cannot move closer, so no "go" command is sent.
 
         Returns:
-            List of strings: The reversed pathing commands
+            List of strings: The commands of the route
+        """
+        # the offset to the origin in the body frame of tello
+        offset = _yaw_matrix(self.pose[3]).T @ -self.pose[:3]
+        offset = np.rint(offset).astype(int)
+
+        route = []
+        if np.abs(offset).max() > GO_MINIMUM:
+            legs = int(np.ceil(np.abs(offset).max() / GO_LIMIT))
+            # equal legs, the last one takes the rounding remainder
+            leg = offset // legs
+            for ind in range(legs):
+                x, y, z = offset - leg * (legs - 1) if ind == legs - 1 else leg
+                route.append('go {} {} {} {}'.format(x, y, z, RETURN_SPEED))
+
+        yaw = int(round(self.pose[3]))
+        if yaw > 0:
+            route.append('cw {}'.format(yaw))
+        elif yaw < 0:
+            route.append('ccw {}'.format(-yaw))
+        return route
+
+    def _journal(self, record):
+        if self.journal is not None:
+            self.journal.write(record)
+
+    def record_state(self, stamp, state):
+        """Appends a state of tello to the journal as a comment line.
+
+        Args:
+            stamp (float): The timestamp the state was received
+            state (numpy.ndarray): The values in telemetry.STATE_FIELDS
+                order
+        """
+        self._journal('# state\t {} {}'.format(
+            stamp - self.start_stamp, ' '.join(map(str, state.tolist()))))
+
+    def save(self, txt_name):
+        """Saves the session to a txt file.
+
+        A journaled session is already on disk, so its journal is copied.
+        The journal keeps being appended to, so every save is a separate
+        file.
+
+        Args:
+            txt_name (string): The name of the file
+        Raises:
+            ValueError: If the journal is already closed
+            TimeoutError: If the journal could not be copied in time
         """
-        # path_cmd is a list of cmdPoints
-        path_cmd = self.get_pathing_commands()
-
-        reverse_cmd_map = {
-            'forward': 'back',
-            'back': 'forward',
-            'left': 'right',
-            'right': 'left',
-            'up': 'down',
-            'down': 'up',
-            'cw': 'ccw',
-            'ccw': 'cw'
-        }
-
-        reversed_path_cmd = []
-        for cmd in reversed(path_cmd):
-            direction, value = cmd.split(' ')
-            try:
-                reversed_dir = reverse_cmd_map[direction]
-                reversed_cmd = '{} {}'.format(reversed_dir, value)
-                reversed_path_cmd.append(reversed_cmd)
-            except KeyError:
-                # direction not found in reverse_cmd_map
-                print('Invalid direction')
-        return reversed_path_cmd
+        if self.journal is not None:
+            self.journal.snapshot(txt_name)
+        else:
+            self.to_text(txt_name)
+
+    def close(self):
+        """Writes the pending records of the journal and closes it. The
+        journal of a session in which tello never connected is deleted."""
+        if self.journal is not None:
+            self.journal.close(discard=not self.initialized)
 
     def to_text(self, txt_name):
-        """Generates a txt file with the commands of the current session.
+        """Generates a txt file with the commands of the current session
+        kept in command_tuples, all of them unless the session is
+        journaled.
 
         Args:
             txt_name (string): The name of the generated file
         """
         if self.starting_time is None:
-            print('[INFO] Empty session.')
+            console.info('Empty session.')
             return
         with open(txt_name, 'w') as f:
             f.write(self.starting_time + '\n')
@@ -186,3 +433,11 @@ class Logger:
             self.status = 'In air'
         elif cmd == 'land':
             self.status = 'Landed'
+
+
+def _yaw_matrix(yaw):
+    """Returns the matrix rotating the body frame of tello to the frame of
+    the session start, for the given yaw in degrees."""
+    rad = np.radians(yaw)
+    cos, sin = np.cos(rad), np.sin(rad)
+    return np.array([[cos, -sin, 0.0], [sin, cos, 0.0], [0.0, 0.0, 1.0]])
@@ -0,0 +1,271 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# the values of a histogram are counted in integer units of its resolution,
+# exactly below 2 ** SUB_BUCKET_BITS units and with a relative error of
+# 2 ** (1 - SUB_BUCKET_BITS), about 1.6%, above
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_BUCKETS = SUB_BUCKETS >> 1
+# the percentiles of the snapshots
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Histogram:
+    """Counts values in log-linear buckets, as an HDR histogram does.
+
+    Recording is a few integer operations and never allocates, and the
+    percentiles keep the same relative precision from microseconds to
+    hours. Values are in seconds.
+
+    Attributes:
+        name: The name of the histogram
+        count: The number of recorded values
+        total: The sum of the recorded values
+        min: The smallest recorded value
+        max: The largest recorded value
+    """
+
+    def __init__(self, name, resolution=1e-6, highest=3600.0):
+        """Allocates the buckets.
+
+        Args:
+            name (string): The name of the histogram
+            resolution (float): The smallest difference told apart, in
+                seconds
+            highest (float): The largest value tracked, larger values are
+                counted as it
+        """
+        self.name = name
+        self.resolution = resolution
+        self.highest = int(highest / resolution)
+        self.counts = [0] * (self._index(self.highest) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        """Counts a value, negative values are counted as 0."""
+        units = min(max(int(value / self.resolution), 0), self.highest)
+        self.counts[self._index(units)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percentile):
+        """Returns the value below which the given percent of the recorded
+        values are, None if nothing was recorded."""
+        if not self.count:
+            return None
+        rank = max(self.count * percentile / 100, 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                break
+        # the middle of the bucket, within the recorded range
+        low, high = self._bounds(index)
+        value = (low + high) / 2 * self.resolution
+        return min(max(value, self.min), self.max)
+
+    def snapshot(self):
+        """Returns the count, sum, min, mean, percentiles and max."""
+        snapshot = {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.min,
+            'mean': self.total / self.count if self.count else None
+        }
+        for percentile in PERCENTILES:
+            snapshot['p{:g}'.format(percentile)] = self.percentile(percentile)
+        snapshot['max'] = self.max
+        return snapshot
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def _index(units):
+        if units < SUB_BUCKETS:
+            return units
+        shift = units.bit_length() - SUB_BUCKET_BITS
+        return SUB_BUCKETS + (shift - 1) * HALF_BUCKETS + (
+            (units >> shift) - HALF_BUCKETS)
+
+    @staticmethod
+    def _bounds(index):
+        """Returns the smallest and the largest units of a bucket."""
+        if index < SUB_BUCKETS:
+            return index, index
+        shift, sub = divmod(index - SUB_BUCKETS, HALF_BUCKETS)
+        shift += 1
+        low = (sub + HALF_BUCKETS) << shift
+        return low, low + (1 << shift) - 1
+
+
+class Counter:
+    """Counts events, e.g. timeouts or drops.
+
+    Attributes:
+        name: The name of the counter
+        value: The number of events
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def increment(self, amount=1):
+        self.value += amount
+
+    def reset(self):
+        self.value = 0
+
+
+class _NullHistogram:
+    """The histogram of a disabled registry, records nothing."""
+    name = None
+
+    def record(self, value):
+        pass
+
+
+class _NullCounter:
+    """The counter of a disabled registry, counts nothing."""
+    name = None
+
+    def increment(self, amount=1):
+        pass
+
+
+NULL_HISTOGRAM = _NullHistogram()
+NULL_COUNTER = _NullCounter()
+
+
+class MetricsRegistry:
+    """Holds the named histograms and counters of a process.
+
+    Instruments are looked up once and kept by their users, which then
+    record without any lookup. A disabled registry hands out instruments
+    that record nothing, so instrumented code costs an empty method call.
+
+    Attributes:
+        enabled: If the instruments record
+        histograms: A dictionary of the Histogram of every name
+        counters: A dictionary of the Counter of every name
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name, **kwargs):
+        """Returns the histogram of the given name, created on first use
+        with the Histogram keyword arguments given."""
+        if not self.enabled:
+            return NULL_HISTOGRAM
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(name, **kwargs)
+            return self.histograms[name]
+
+    def counter(self, name):
+        """Returns the counter of the given name, created on first use."""
+        if not self.enabled:
+            return NULL_COUNTER
+        with self.lock:
+            if name not in self.counters:
+                self.counters[name] = Counter(name)
+            return self.counters[name]
+
+    def snapshot(self):
+        """Returns the snapshot of every histogram and the value of every
+        counter."""
+        with self.lock:
+            histograms = list(self.histograms.values())
+            counters = list(self.counters.values())
+        return {
+            'histograms': {h.name: h.snapshot()
+                           for h in histograms},
+            'counters': {c.name: c.value
+                         for c in counters}
+        }
+
+    def reset(self):
+        """Empties every histogram and counter."""
+        with self.lock:
+            for instrument in (list(self.histograms.values()) +
+                               list(self.counters.values())):
+                instrument.reset()
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_text(self):
+        """Returns the snapshot in the Prometheus text format, the
+        histograms as summaries in seconds."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            lines.append('# TYPE {} summary'.format(name))
+            for percentile in PERCENTILES:
+                value = histogram['p{:g}'.format(percentile)]
+                lines.append('{}{{quantile="{:g}"}} {}'.format(
+                    name, percentile / 100,
+                    'NaN' if value is None else repr(value)))
+            lines.append('{}_sum {!r}'.format(name, histogram['sum']))
+            lines.append('{}_count {}'.format(name, histogram['count']))
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('# TYPE {} counter'.format(name))
+            lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serves the snapshots over http from a background thread, in the
+        text format at /metrics and as json at /metrics.json.
+
+        Args:
+            port (int): The port to listen on, 0 picks a free one
+            host (string): The ip to listen on
+        Returns:
+            ThreadingHTTPServer: The server, stopped by its shutdown method
+        """
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        server.daemon_threads = True
+        server.registry = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        registry = self.server.registry
+        if self.path == '/metrics':
+            body, content_type = registry.to_text(), 'text/plain'
+        elif self.path == '/metrics.json':
+            body, content_type = registry.to_json(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes are not worth a line on the console
+        pass
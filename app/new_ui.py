@@ -6,6 +6,7 @@ from tkinter import messagebox
 from tkinter import simpledialog, filedialog
 
 from tello import Tello
+from video import DisplayStats
 
 # dimensions of the ui window
 win_width = 500
@@ -34,6 +35,9 @@ first_btn_y = 0.15 * win_height
 second_btn_y = dist_bar_y
 third_btn_y = angle_bar_y
 
+# milliseconds between refreshes of the displayed tello state
+refresh_interval = 1000
+
 move_map = {
     'w': 'forward',
     's': 'back',
@@ -54,6 +58,8 @@ class ControlUI:
 
         self.frame = None
         self.stream_flag = False
+        # skipped frames and decode to display latency of the video loop
+        self.display_stats = DisplayStats()
 
         self.root = tk.Tk()
         self.root.title('Tello drone')
@@ -114,6 +120,14 @@ class ControlUI:
             width=btn_width,
             height=btn_height)
 
+        self.record_btn = tk.Button(
+            self.root, text='Record', command=self.toggle_recording)
+        self.record_btn.place(
+            x=btn_x + btn_x_interv + btn_width,
+            y=first_btn_y + btn_height + btn_interv,
+            width=btn_width,
+            height=btn_height)
+
         # --------------------------- sliders ------------------------------
         dist_label = tk.Label(
             self.root, text='Distance (20-500 cm)', font='Helvetica 10 bold')
@@ -174,14 +188,17 @@ class ControlUI:
 
     def initialize(self):
         """Initializes tello and updates the displayed status and battery."""
-        self.tello = Tello()
+        # frames are decoded as bgr, the format cv2.imshow expects
+        self.tello = Tello(video_format='bgr24')
         flag = self.tello.initialize()
         if not flag:
-            # initialization fails
+            # initialization fails, release the ports before a retry
+            self.tello.close()
             del self.tello
         else:
-            self.update_status()
-            self.update_battery()
+            self.display_stats = DisplayStats(
+                self.tello.display_histogram)
+            self.refresh_state()
 
     def save_session(self):
         """Opens a dialogue for the user to input a session name. Calls
@@ -260,7 +277,8 @@ class ControlUI:
         cmd = '{} {}'.format(direction, value)
 
         try:
-            self.tello.send_command(cmd)
+            # queued, so fast key presses are coalesced instead of dropped
+            self.tello.queue_command(cmd)
         except AttributeError:
             # tello not initialized, ignore the event
             pass
@@ -276,6 +294,17 @@ class ControlUI:
         battery_level = self.tello.get_battery()
         self.battery_label['text'] = battery_level
 
+    def refresh_state(self):
+        """Refreshes the status and battery labels periodically from the
+        state tello streams, without sending any query command."""
+        try:
+            self.update_status()
+            self.update_battery()
+        except AttributeError:
+            # tello not initialized
+            return
+        self.root.after(refresh_interval, self.refresh_state)
+
     def start_stream(self):
         """Sends streamon command and starts the video thread."""
         try:
@@ -295,19 +324,37 @@ class ControlUI:
         except AttributeError:
             self._show_warning()
 
+    def toggle_recording(self):
+        """Starts or stops recording the video stream to disk."""
+        try:
+            if self.tello.recorder is None:
+                self.tello.start_recording()
+                self.record_btn['text'] = 'Stop Rec'
+            else:
+                self.tello.stop_recording()
+                self.record_btn['text'] = 'Record'
+        except AttributeError:
+            self._show_warning()
+
     def video_loop(self):
-        """Reads the tello frame, converts it to PIL image and updates
-        the GUI image."""
-        # while self.stream_flag:
+        """Waits for every new tello frame and displays it.
+
+        Counts the frames decoded but never displayed and measures the
+        latency from decoding to display in display_stats.
+        """
+        seq = 0
         while self.stream_flag:
-            frame = self.tello.frame
-            # while stream flag is True
-            if frame is None:
-                # skip initial none frames
+            # wake up periodically to check the stream flag
+            latest = self.tello.wait_for_frame(seq, timeout=0.5)
+            if latest is None:
+                # no new frame
                 continue
+            frame, new_seq, stamp = latest
 
             cv2.imshow('ds', frame)
-            cv2.waitKey(10)
+            cv2.waitKey(1)
+            self.display_stats.update(new_seq - seq - 1, stamp)
+            seq = new_seq
 
     def _show_warning(self):
         """Displays a message box with a warning text."""
@@ -0,0 +1,252 @@
+import os
+import abc
+import socket
+import struct
+from time import time, sleep
+
+import numpy as np
+
+from video import PACKET_SIZE, START_CODES
+from recorder import INDEX_DTYPE
+
+# frame rate assumed when replaying a stream without timestamps
+DEFAULT_FPS = 30
+# the udp port tello streams the video to
+VIDEO_PORT = 11111
+
+# NAL unit types of coded slices, the picture data of an access unit
+VCL_NAL_TYPES = range(1, 6)
+# NAL unit types that may only precede the slices of an access unit, e.g.
+# SEI, SPS, PPS and the access unit delimiter
+PREFIX_NAL_TYPES = set(range(6, 10)) | set(range(14, 19))
+
+# pcap link types
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+
+
+class SocketSource:
+    """Receives the video packets from tello on the video socket.
+
+    Attributes:
+        blocking: False, tello does not wait for a slow decoder, so access
+            units are dropped instead of delaying the socket
+    """
+    blocking = False
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def receive(self, assembler):
+        """Receives a packet into the assembler.
+
+        Args:
+            assembler (AccessUnitAssembler): The reassembly stage
+        Returns:
+            bool: False once the socket is closed
+        """
+        try:
+            assembler.receive(self.sock)
+        except socket.error:
+            if self.sock.fileno() == -1:
+                # the socket was closed
+                return False
+            raise
+        return True
+
+
+class ReplaySource(abc.ABC):
+    """Feeds recorded packets to the assembler instead of a socket.
+
+    Subclasses implement packets, a generator of (stamp, packet) tuples. In
+    realtime mode the packets are paced by their timestamps, otherwise they
+    are fed as fast as the pipeline takes them.
+
+    Attributes:
+        realtime: A boolean that indicates if the timestamps are honored
+        blocking: True when not in realtime mode, the source then waits for
+            the decoder instead of having access units dropped
+        packets_fed: The number of packets fed to the assembler
+    """
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.blocking = not realtime
+        self.packets_fed = 0
+        self.iterator = None
+        self.first_stamp = None
+        self.start = None
+
+    @abc.abstractmethod
+    def packets(self):
+        """Yields the (stamp, packet) tuples of the recording."""
+
+    def receive(self, assembler):
+        """Feeds the next recorded packet to the assembler.
+
+        Args:
+            assembler (AccessUnitAssembler): The reassembly stage
+        Returns:
+            bool: False once every packet has been fed
+        """
+        if self.iterator is None:
+            self.iterator = self.packets()
+        try:
+            stamp, packet = next(self.iterator)
+        except StopIteration:
+            return False
+
+        if self.realtime:
+            if self.first_stamp is None:
+                self.first_stamp, self.start = stamp, time()
+            delay = self.start + stamp - self.first_stamp - time()
+            if delay > 0:
+                sleep(delay)
+
+        assembler.feed(packet)
+        self.packets_fed += 1
+        return True
+
+
+class H264FileSource(ReplaySource):
+    """Replays a raw h264 stream file, e.g. one written by StreamRecorder.
+
+    If the recording index (.idx) exists, the access units are taken from
+    it along with their receive timestamps. Otherwise the NAL units of the
+    stream are grouped into access units, timed at DEFAULT_FPS. Either way
+    each access unit is split into PACKET_SIZE packets, as tello sends it.
+    """
+
+    def __init__(self, path, realtime=False):
+        super().__init__(realtime)
+        self.path = path
+
+    def packets(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        index_path = self.path + '.idx'
+        if os.path.exists(index_path) and os.path.getsize(index_path):
+            index = np.fromfile(index_path, dtype=INDEX_DTYPE)
+            units = ((float(stamp), int(offset), int(offset + size))
+                     for offset, size, stamp in index)
+        else:
+            units = ((ind / DEFAULT_FPS, start, end) for ind, (
+                start, end) in enumerate(_access_units(data)))
+
+        view = memoryview(data)
+        for stamp, start, end in units:
+            for offset in range(start, end, PACKET_SIZE):
+                yield stamp, view[offset:min(offset + PACKET_SIZE, end)]
+
+
+class PcapSource(ReplaySource):
+    """Replays the udp packets captured on the video port in a pcap file.
+
+    Ethernet, Linux cooked, raw IP and loopback captures of IPv4 traffic are
+    supported.
+    """
+
+    def __init__(self, path, realtime=False, port=VIDEO_PORT):
+        super().__init__(realtime)
+        self.path = path
+        self.port = port
+
+    def packets(self):
+        with open(self.path, 'rb') as f:
+            header = f.read(24)
+            magic = header[:4]
+            if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+                endian = '<'
+            elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+                endian = '>'
+            else:
+                raise ValueError('{} is not a pcap file'.format(self.path))
+            # nanosecond resolution captures have their own magic
+            resolution = 1e-9 if magic in (b'\x4d\x3c\xb2\xa1',
+                                           b'\xa1\xb2\x3c\x4d') else 1e-6
+            linktype = struct.unpack(endian + 'I', header[20:24])[0]
+            record = struct.Struct(endian + 'IIII')
+
+            while True:
+                record_header = f.read(record.size)
+                if len(record_header) < record.size:
+                    return
+                seconds, fraction, size, _ = record.unpack(record_header)
+                payload = _udp_payload(f.read(size), linktype, self.port)
+                if payload is not None:
+                    yield seconds + fraction * resolution, payload
+
+
+def _split_units(data):
+    """Yields the (start, end) offsets of the NAL units of a raw h264
+    stream."""
+    starts = []
+    position = data.find(START_CODES[1])
+    while position != -1:
+        # a four byte start code begins one byte earlier
+        if position and data[position - 1] == 0:
+            starts.append(position - 1)
+        else:
+            starts.append(position)
+        position = data.find(START_CODES[1], position + 3)
+    for ind, start in enumerate(starts):
+        yield start, starts[ind + 1] if ind + 1 < len(starts) else len(data)
+
+
+def _access_units(data):
+    """Yields the (start, end) offsets of the access units of a raw h264
+    stream, every one the NAL units of a picture.
+
+    An access unit ends before a prefix NAL unit, e.g. SPS or PPS, or
+    before the first slice of the next picture, the slice whose
+    first_mb_in_slice is 0, once it holds a slice.
+    """
+    unit_start = None
+    has_slice = False
+    for start, end in _split_units(data):
+        header = start + (4 if data.startswith(START_CODES[0], start) else 3)
+        if header >= end:
+            continue
+        nal_type = data[header] & 0x1f
+        # first_mb_in_slice is an exp-golomb code, 0 is a single 1 bit
+        first_slice = (nal_type in VCL_NAL_TYPES and header + 1 < end
+                       and data[header + 1] & 0x80)
+        if has_slice and (nal_type in PREFIX_NAL_TYPES or first_slice):
+            yield unit_start, start
+            unit_start, has_slice = None, False
+        if unit_start is None:
+            unit_start = start
+        has_slice = has_slice or nal_type in VCL_NAL_TYPES
+    if unit_start is not None:
+        yield unit_start, len(data)
+
+
+def _udp_payload(frame, linktype, port):
+    """Returns the payload of a captured IPv4 udp datagram sent to port, or
+    None for any other packet."""
+    if linktype == LINKTYPE_ETHERNET:
+        offset, ethertype = 14, frame[12:14]
+    elif linktype == LINKTYPE_LINUX_SLL:
+        offset, ethertype = 16, frame[14:16]
+    elif linktype == LINKTYPE_NULL:
+        offset, ethertype = 4, b'\x08\x00'
+    elif linktype == LINKTYPE_RAW:
+        offset, ethertype = 0, b'\x08\x00'
+    else:
+        raise ValueError('Unsupported pcap link type {}'.format(linktype))
+
+    if ethertype != b'\x08\x00' or len(frame) < offset + 28:
+        # not IPv4
+        return None
+    ip_header = (frame[offset] & 0x0f) * 4
+    if frame[offset] >> 4 != 4 or frame[offset + 9] != 17:
+        # not udp over IPv4
+        return None
+    udp = offset + ip_header
+    destination, length = struct.unpack('!HH', frame[udp + 2:udp + 6])
+    if destination != port:
+        return None
+    return frame[udp + 8:udp + length]
@@ -0,0 +1,111 @@
+import os
+import struct
+from time import time
+
+import numpy as np
+
+from batch_writer import BatchWriter
+
+# an index record holds the offset of an access unit in the stream file,
+# its size and the timestamp it was received
+INDEX_RECORD = struct.Struct('<QId')
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('size', '<u4'), ('stamp', '<f8')])
+
+
+class StreamRecorder:
+    """Writes the raw h264 stream to disk without re-encoding it.
+
+    Next to the stream file, a sidecar index file with the extension .idx
+    holds a fixed size record per access unit, so a recording can be
+    seeked by time or access unit number without scanning the stream.
+    Access units are written in batches by a BatchWriter.
+
+    Attributes:
+        path: The path of the stream file
+        written: The number of access units written
+    """
+
+    def __init__(self, path, batch_size=64, buffer_size=1 << 20):
+        """Opens the files and starts the writing thread.
+
+        Args:
+            path (string): The path of the stream file
+            batch_size (int): The number of access units written at most
+                between two flushes
+            buffer_size (int): The size of the stream file buffer
+        """
+        self.path = path
+        self.stream_file = open(path, 'wb', buffering=buffer_size)
+        self.index_file = open(path + '.idx', 'wb')
+        self.offset = 0
+        self.written = 0
+        self.writer = BatchWriter(self._write, batch_size, self._close_files)
+
+    def write(self, access_unit, stamp=None):
+        """Queues an access unit to be written.
+
+        Args:
+            access_unit (bytes): The h264 data of a whole frame
+            stamp (float): The timestamp it was received, defaults to now
+        """
+        self.writer.put((access_unit, time() if stamp is None else stamp))
+
+    def close(self):
+        """Writes the queued access units and closes the files."""
+        self.writer.close()
+
+    def _write(self, batch):
+        index = []
+        for access_unit, stamp in batch:
+            self.stream_file.write(access_unit)
+            index.append(
+                INDEX_RECORD.pack(self.offset, len(access_unit), stamp))
+            self.offset += len(access_unit)
+        self.index_file.write(b''.join(index))
+        self.written += len(index)
+
+        self.stream_file.flush()
+        self.index_file.flush()
+
+    def _close_files(self):
+        self.stream_file.close()
+        self.index_file.close()
+
+
+class Recording:
+    """Reads a recording written by StreamRecorder through its index.
+
+    Attributes:
+        index: A memory-mapped record array with the offset, size and stamp
+            of every access unit
+    """
+
+    def __init__(self, path):
+        """Maps the index and opens the stream file.
+
+        Args:
+            path (string): The path of the stream file
+        """
+        if os.path.getsize(path + '.idx'):
+            self.index = np.memmap(path + '.idx', dtype=INDEX_DTYPE, mode='r')
+        else:
+            # nothing was recorded, an empty file cannot be mapped
+            self.index = np.empty(0, dtype=INDEX_DTYPE)
+        self.stream_file = open(path, 'rb')
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, ind):
+        """Returns the bytes of the access unit with the given number."""
+        offset, size, _ = self.index[ind]
+        self.stream_file.seek(int(offset))
+        return self.stream_file.read(int(size))
+
+    def find(self, stamp):
+        """Returns the number of the first access unit received at or after
+        the given timestamp."""
+        return int(np.searchsorted(self.index['stamp'], stamp))
+
+    def close(self):
+        self.stream_file.close()
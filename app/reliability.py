@@ -0,0 +1,219 @@
+# policies for the commands that change the state of tello, e.g. moves
+# at most once: sent a single time, a lost datagram waits out the timeout
+AT_MOST_ONCE = 'at_most_once'
+# at least once: resent when unanswered, so the command is executed twice if
+# only its response was lost
+AT_LEAST_ONCE = 'at_least_once'
+
+# commands besides the "?" queries that can be repeated without changing
+# the outcome, so they are always retransmitted
+IDEMPOTENT_COMMANDS = {
+    'command', 'streamon', 'streamoff', 'emergency', 'speed'
+}
+
+# RFC 6298 gains and variance factor
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+
+
+class RtoEstimator:
+    """Estimates the retransmission timeout from round trip times, as in
+    RFC 6298.
+
+    The smoothed round trip time and its variation are updated with every
+    sample, and the timeout is their sum bounded by minimum and maximum.
+    The minimum is far below the 1 second of the RFC, as tello is reached
+    over a single wifi hop.
+
+    Attributes:
+        srtt: The smoothed round trip time, None before the first sample
+        rttvar: The round trip time variation
+        samples: The number of round trip times sampled
+    """
+
+    def __init__(self,
+                 initial=0.5,
+                 minimum=0.02,
+                 maximum=10.0,
+                 granularity=0.001):
+        """Configures the estimator.
+
+        Args:
+            initial (float): The timeout in seconds before the first sample
+            minimum (float): The lower bound of the timeout
+            maximum (float): The upper bound of the timeout, backed off
+                timeouts included
+            granularity (float): The clock granularity in seconds
+        """
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.granularity = granularity
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+
+    def sample(self, rtt):
+        """Updates the estimate with the round trip time of a command that
+        was sent a single time.
+
+        Args:
+            rtt (float): The seconds between sending and the response
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = ((1 - BETA) * self.rttvar +
+                           BETA * abs(self.srtt - rtt))
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.samples += 1
+
+    @property
+    def rto(self):
+        """float: The current retransmission timeout in seconds."""
+        if self.srtt is None:
+            rto = self.initial
+        else:
+            rto = self.srtt + max(self.granularity, K * self.rttvar)
+        return min(max(rto, self.minimum), self.maximum)
+
+    def timeout(self, retransmissions):
+        """Returns the timeout after the given number of retransmissions,
+        doubled for each one of them."""
+        return min(self.rto * 2**retransmissions, self.maximum)
+
+
+class PendingCommand:
+    """A command sent to tello that awaits its response.
+
+    Attributes:
+        command: The body of the command
+        future: Resolved with the success of the command
+        deadline: The time the command fails if still unanswered
+        sent: The time the command was first sent
+        sends: The number of times the command was sent
+        retransmit_at: The time the command is resent if still unanswered,
+            None if it is not resent
+    """
+    __slots__ = ('command', 'future', 'deadline', 'sent', 'sends',
+                 'retransmit_at')
+
+    def __init__(self, command, future, deadline, sent, retransmit_at):
+        self.command = command
+        self.future = future
+        self.deadline = deadline
+        self.sent = sent
+        self.sends = 1
+        self.retransmit_at = retransmit_at
+
+
+class Retransmitter:
+    """Decides when an unanswered command is sent again.
+
+    Queries and the IDEMPOTENT_COMMANDS are resent once the timeout
+    estimated from the round trip times of the queries expires, with
+    exponential backoff. Every other command changes the state of tello and
+    follows move_policy. Moves are answered once executed, so they have an
+    estimator of their own.
+
+    Round trip times are only sampled from commands sent once (Karn's
+    algorithm), since the response of a resent command may answer any of
+    its copies.
+
+    Attributes:
+        move_policy: AT_MOST_ONCE or AT_LEAST_ONCE
+        max_retransmissions: The times a command is resent at most
+        rto: The RtoEstimator of the queries
+        move_rto: The RtoEstimator of the other commands
+        sent: The number of commands sent
+        retransmitted: The number of datagrams resent
+        recovered: The number of resent commands that were answered
+        timed_out: The number of commands that were never answered
+    """
+
+    def __init__(self, move_policy=AT_MOST_ONCE, max_retransmissions=5):
+        if move_policy not in (AT_MOST_ONCE, AT_LEAST_ONCE):
+            raise ValueError('Unknown move policy {}'.format(move_policy))
+        self.move_policy = move_policy
+        self.max_retransmissions = max_retransmissions
+        self.rto = RtoEstimator()
+        # a long move takes seconds before it is answered
+        self.move_rto = RtoEstimator(initial=7.0, minimum=1.0)
+
+        self.sent = 0
+        self.retransmitted = 0
+        self.recovered = 0
+        self.timed_out = 0
+
+    def _estimator(self, command):
+        """Returns the estimator of the command, None if the command is
+        not to be resent."""
+        if is_idempotent(command):
+            return self.rto
+        if self.move_policy == AT_LEAST_ONCE:
+            return self.move_rto
+        return None
+
+    def retransmit_at(self, command, sent, sends):
+        """Returns the time a command is resent if still unanswered.
+
+        Args:
+            command (string): The body of the command
+            sent (float): The time the command was last sent
+            sends (int): The number of times the command was sent
+        Returns:
+            float: The time, None if the command is not to be resent
+        """
+        estimator = self._estimator(command)
+        if estimator is None or sends > self.max_retransmissions:
+            return None
+        return sent + estimator.timeout(sends - 1)
+
+    def answered(self, pending, now):
+        """Samples the round trip time of an answered command.
+
+        Args:
+            pending (PendingCommand): The answered command
+            now (float): The time the response arrived
+        """
+        if pending.sends > 1:
+            self.recovered += 1
+            return
+        if is_idempotent(pending.command):
+            self.rto.sample(now - pending.sent)
+        else:
+            self.move_rto.sample(now - pending.sent)
+
+    def quiet_period(self, pending):
+        """Returns the seconds a late answer to the copies of a resent
+        command may still arrive after it was answered."""
+        if is_idempotent(pending.command):
+            return self.rto.rto
+        return self.move_rto.rto
+
+    def stats(self):
+        """Returns the retransmission counters and the estimates of the
+        queries in seconds."""
+        return {
+            'sent': self.sent,
+            'retransmitted': self.retransmitted,
+            'recovered': self.recovered,
+            'timed_out': self.timed_out,
+            'srtt': self.rto.srtt,
+            'rttvar': self.rto.rttvar,
+            'rto': self.rto.rto,
+            'move_rto': self.move_rto.rto
+        }
+
+
+def is_idempotent(command):
+    """Returns True if repeating the command does not change its outcome.
+
+    Args:
+        command (string): The body of the command
+    """
+    name = command.split(' ')[0]
+    return name.endswith('?') or name in IDEMPOTENT_COMMANDS
+
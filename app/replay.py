@@ -0,0 +1,53 @@
+from collections import namedtuple
+
+import numpy as np
+
+# a replayed command: its success, the round trip time it had when recorded
+# and when replayed, and how late it was sent compared to its schedule
+ReplayStep = namedtuple(
+    'ReplayStep', ['command', 'success', 'original_rtt', 'rtt', 'send_lag'])
+
+
+def replay_schedule(records, speed=None):
+    """Yields when every recorded command is due to be sent again.
+
+    Args:
+        records: (command, sTime, rTime) tuples, e.g. from log.iter_session
+        speed (float): The factor the recorded timing is sped up by, 1.0
+            reproduces it and None sends every command as soon as the
+            previous one is answered
+    Yields:
+        tuple: (command, due, original_rtt), due is the seconds since the
+        replay started the command is to be sent at, None as soon as
+        possible
+    """
+    first = None
+    for command, send_time, rsp_time in records:
+        if first is None:
+            first = send_time
+        due = None if speed is None else (send_time - first) / speed
+        yield command, due, rsp_time - send_time
+
+
+def drift_report(steps):
+    """Summarizes how a replay drifted from the recording.
+
+    Args:
+        steps (list): The ReplayStep of every replayed command
+    Returns:
+        dict: The number of commands and failures, the mean and max round
+        trip time drift in seconds, replayed minus recorded, and the mean
+        and max send lag
+    """
+    if not steps:
+        return {'commands': 0, 'failed': 0}
+    drift = np.array([step.rtt - step.original_rtt for step in steps])
+    lag = np.array([step.send_lag for step in steps])
+    return {
+        'commands': len(steps),
+        'failed': sum(not step.success for step in steps),
+        'mean_drift': float(drift.mean()),
+        'max_drift': float(drift[np.abs(drift).argmax()]),
+        'mean_lag': float(lag.mean()),
+        'max_lag': float(lag.max())
+    }
@@ -0,0 +1,247 @@
+"""Converts sessions between the txt format of Logger.to_text and the
+binary .tses format.
+
+Usage: python session_file.py input output, the formats are taken from the
+extensions of the files.
+"""
+import struct
+import argparse
+
+import numpy as np
+
+from telemetry import STATE_FIELDS
+
+# a .tses file starts with a header holding the offset of the footer and the
+# starting time of the session
+MAGIC = b'TSES'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQ')
+# the footer holds the offset and count of the command records, the states
+# and the interned command strings
+FOOTER = struct.Struct('<QQQQQQ')
+STRING_LENGTH = struct.Struct('<H')
+
+# the outcome of a command record
+OK = 0
+ERROR = 1
+TIMEOUT = 2
+
+# a command record, the times are seconds since the session started and
+# the command is the index of its interned string
+RECORD_DTYPE = np.dtype([('stime', '<f8'), ('rtime', '<f8'),
+                         ('command', '<u4'), ('kind', '<u4')])
+# a state record, its receive time followed by the state fields
+STATE_DTYPE = np.dtype([('stamp', '<f8')] + [(field, '<f4')
+                                             for field in STATE_FIELDS])
+
+
+def write_session_file(path, starting_time, commands, states=()):
+    """Writes a session to a .tses file.
+
+    Args:
+        path (string): The path of the file
+        starting_time (string): The starting datetime of the session
+        commands (list): (command, stime, rtime, kind) tuples, rtime NaN
+            for commands that timed out
+        states (list): (stamp, state) tuples, the state values in
+            STATE_FIELDS order
+    """
+    strings = {}
+    records = np.empty(len(commands), dtype=RECORD_DTYPE)
+    for ind, (command, stime, rtime, kind) in enumerate(commands):
+        # every distinct command is stored once
+        records[ind] = (stime, rtime, strings.setdefault(command,
+                                                         len(strings)), kind)
+    state_records = np.empty(len(states), dtype=STATE_DTYPE)
+    if len(states):
+        stamps, values = zip(*states)
+        values = np.array(values, dtype=np.float32)
+        state_records['stamp'] = stamps
+        for ind, field in enumerate(STATE_FIELDS):
+            state_records[field] = values[:, ind]
+
+    title = starting_time.encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(title), 0))
+        f.write(title)
+        # align the records, so they can be mapped in place
+        f.write(b'\0' * (-f.tell() % 8))
+        records_offset = f.tell()
+        f.write(records.tobytes())
+        states_offset = f.tell()
+        f.write(state_records.tobytes())
+        strings_offset = f.tell()
+        for string in strings:
+            data = string.encode('utf-8')
+            f.write(STRING_LENGTH.pack(len(data)))
+            f.write(data)
+
+        footer_offset = f.tell()
+        f.write(
+            FOOTER.pack(records_offset, len(records), states_offset,
+                        len(state_records), strings_offset, len(strings)))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(title), footer_offset))
+
+
+class SessionFile:
+    """Reads a .tses session file without parsing it as a whole.
+
+    The command records and the states are memory-mapped arrays, so the
+    Nth command is read in place and the command sent at a time is found by
+    a binary search over the send times.
+
+    Attributes:
+        starting_time: The starting datetime of the session
+        records: The memory-mapped command records
+        states: The memory-mapped state records
+        strings: The interned command strings
+    """
+
+    def __init__(self, path):
+        """Reads the header and the footer and maps the records.
+
+        Args:
+            path (string): The path of the file
+        Raises:
+            ValueError: If the file is not a finished .tses file
+        """
+        try:
+            with open(path, 'rb') as f:
+                magic, version, title_size, footer_offset = HEADER.unpack(
+                    f.read(HEADER.size))
+                if magic != MAGIC or version != VERSION or not footer_offset:
+                    raise ValueError('{} is not a tses file'.format(path))
+                self.starting_time = f.read(title_size).decode('utf-8')
+
+                f.seek(footer_offset)
+                (records_offset, num_records, states_offset, num_states,
+                 strings_offset, num_strings) = FOOTER.unpack(
+                     f.read(FOOTER.size))
+
+                f.seek(strings_offset)
+                self.strings = []
+                for _ in range(num_strings):
+                    size, = STRING_LENGTH.unpack(f.read(STRING_LENGTH.size))
+                    self.strings.append(f.read(size).decode('utf-8'))
+        except struct.error:
+            # the file ends before its header, footer or strings do
+            raise ValueError('{} is truncated'.format(path))
+
+        self.records = _map(path, RECORD_DTYPE, records_offset, num_records)
+        self.states = _map(path, STATE_DTYPE, states_offset, num_states)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, ind):
+        """Returns the (command, stime, rtime, kind) of the Nth command."""
+        stime, rtime, command, kind = self.records[ind]
+        return self.strings[command], float(stime), float(rtime), int(kind)
+
+    def command(self, ind):
+        """Returns the body of the Nth command."""
+        return self.strings[self.records['command'][ind]]
+
+    def find(self, stime):
+        """Returns the number of the first command sent at or after the
+        given seconds since the session started."""
+        return int(np.searchsorted(self.records['stime'], stime))
+
+    def state_at(self, stamp):
+        """Returns the latest state received at or before the given seconds
+        since the session started, None if there is none."""
+        ind = int(np.searchsorted(self.states['stamp'], stamp, 'right'))
+        return self.states[ind - 1] if ind else None
+
+
+def _map(path, dtype, offset, count):
+    if not count:
+        # an empty range cannot be mapped
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                     shape=(count, ))
+
+
+def read_text_session(path):
+    """Parses a txt session, journal comment lines included.
+
+    Args:
+        path (string): The path of the txt session
+    Returns:
+        tuple: The starting time, the (command, stime, rtime, kind) tuples
+        and the (stamp, state) tuples
+    """
+    commands = []
+    states = []
+    with open(path, 'r') as f:
+        starting_time = f.readline().rstrip('\n')
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+            body, _, times = line.partition('\t')
+            times = times.split()
+            if body == '# state':
+                states.append((float(times[0]), [float(v)
+                                                  for v in times[1:]]))
+                continue
+            kind = OK
+            if body.startswith('# error '):
+                kind, body = ERROR, body[len('# error '):]
+            elif body.startswith('# timeout '):
+                kind, body = TIMEOUT, body[len('# timeout '):]
+            elif body.startswith('#'):
+                continue
+            rtime = float(times[1]) if len(times) > 1 else np.nan
+            commands.append((body, float(times[0]), rtime, kind))
+    return starting_time, commands, states
+
+
+def write_text_session(path, session):
+    """Writes a SessionFile in the txt format of Logger.to_text.
+
+    The commands and the states are written in the order they happened.
+
+    Args:
+        path (string): The path of the txt session
+        session (SessionFile): The session to convert
+    """
+    lines = []
+    for ind in range(len(session)):
+        command, stime, rtime, kind = session[ind]
+        if kind == OK:
+            lines.append((rtime, '{}\t {} {}'.format(command, stime, rtime)))
+        elif kind == ERROR:
+            lines.append((rtime, '# error {}\t {} {}'.format(
+                command, stime, rtime)))
+        else:
+            lines.append((stime, '# timeout {}\t {}'.format(command, stime)))
+    # the shortest strings that read back as the same float32 values
+    values = np.stack([session.states[field] for field in STATE_FIELDS],
+                      axis=-1).astype(str).tolist()
+    for stamp, row in zip(session.states['stamp'].tolist(), values):
+        lines.append((stamp, '# state\t {} {}'.format(stamp, ' '.join(row))))
+    lines.sort(key=lambda line: line[0])
+
+    with open(path, 'w') as f:
+        f.write(session.starting_time + '\n')
+        for _, line in lines:
+            f.write('\n' + line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Converts sessions between the txt and tses formats.')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    args = parser.parse_args()
+
+    if args.input.endswith('.tses'):
+        write_text_session(args.output, SessionFile(args.input))
+    else:
+        write_session_file(args.output, *read_text_session(args.input))
+
+
+if __name__ == '__main__':
+    main()
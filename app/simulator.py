@@ -0,0 +1,287 @@
+"""A local stand-in for tello, answering on the command port, streaming its
+state to the state port and a looped h264 file to the video port.
+
+Usage: python simulator.py [--latency S] [--jitter S] [--loss P] [--video F]
+"""
+import socket
+import random
+import argparse
+import threading
+from time import time, sleep
+
+from command_queue import MOVE_LIMITS
+from packet_source import H264FileSource
+
+# minimum value of every pathing command
+MOVE_MINIMUMS = {direction: 20 for direction in MOVE_LIMITS}
+MOVE_MINIMUMS.update({'cw': 1, 'ccw': 1})
+
+
+class TelloSimulator:
+    """Simulates the udp interface of a tello.
+
+    Commands are answered one at a time, as tello does, after a latency of
+    latency plus a random jitter. Both commands and responses are lost with
+    probability loss. Once a client sends "command", the state is sent to
+    its state_port at state_rate Hz, and after "streamon" the video file is
+    streamed to its video_port in a loop.
+
+    Attributes:
+        address: The (ip, port) the command socket is bound to
+        client: The ip of the client that sent "command"
+        commands: The number of commands received
+        battery: The simulated battery level
+        height: The simulated height in cm
+        yaw: The simulated heading in degrees
+    """
+
+    def __init__(self,
+                 host='127.0.0.1',
+                 cmd_port=8889,
+                 state_port=8890,
+                 video_port=11111,
+                 latency=0.0,
+                 jitter=0.0,
+                 loss=0.0,
+                 video_file=None,
+                 state_rate=10,
+                 seed=None):
+        """Configures the simulator, start binds the sockets.
+
+        Args:
+            host (string): The ip to bind the command socket to
+            cmd_port (int): The port to receive the commands on
+            state_port (int): The client port the state is sent to
+            video_port (int): The client port the video is streamed to
+            latency (float): The seconds every response is delayed
+            jitter (float): The maximum random seconds added to latency
+            loss (float): The probability of a datagram being lost
+            video_file (string): The raw h264 file to stream, None streams
+                nothing
+            state_rate (float): The state datagrams sent per second
+            seed (int): The seed of the random generator
+        """
+        self.address = (host, cmd_port)
+        self.state_port = state_port
+        self.video_port = video_port
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.video_file = video_file
+        self.state_rate = state_rate
+        self.random = random.Random(seed)
+
+        self.client = None
+        self.commands = 0
+        self.battery = 100
+        self.height = 0
+        self.yaw = 0
+        self.in_air = False
+        self.streaming = threading.Event()
+        self.stopped = threading.Event()
+        self.start_time = time()
+
+        self.cmd_socket = None
+        self.out_socket = None
+
+    def start(self):
+        """Binds the command socket and starts answering."""
+        self.cmd_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.cmd_socket.bind(self.address)
+        self.address = self.cmd_socket.getsockname()
+        # state and video are sent from a socket of their own
+        self.out_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # bound to the ip of the simulator, so that simulators on different
+        # loopback ips, e.g. 127.0.0.2 and 127.0.0.3, are told apart
+        self.out_socket.bind((self.address[0], 0))
+        for target in (self._cmd_thread, self._state_thread,
+                       self._video_thread):
+            threading.Thread(target=target, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stops the threads and closes the sockets."""
+        self.stopped.set()
+        self.streaming.set()
+        self.cmd_socket.close()
+        self.out_socket.close()
+
+    def _lost(self):
+        return self.loss and self.random.random() < self.loss
+
+    def _cmd_thread(self):
+        while not self.stopped.is_set():
+            try:
+                data, address = self.cmd_socket.recvfrom(1024)
+            except socket.error:
+                # the socket was closed
+                return
+            self.commands += 1
+            if self._lost():
+                continue
+
+            response = self.respond(data.decode('utf-8', errors='replace'),
+                                    address)
+            sleep(self.latency + self.random.uniform(0, self.jitter))
+            if self._lost():
+                continue
+            try:
+                self.cmd_socket.sendto(response.encode('utf-8'), address)
+            except socket.error:
+                return
+
+    def respond(self, command, address):
+        """Executes a command on the simulated state.
+
+        Args:
+            command (string): The body of the command
+            address (tuple): The (ip, port) of the client
+        Returns:
+            string: The response of tello
+        """
+        parts = command.strip().split(' ')
+        name = parts[0]
+
+        if name == 'command':
+            self.client = address[0]
+            return 'ok'
+        if name.endswith('?'):
+            return self._query(name)
+        if name == 'takeoff':
+            self.in_air = True
+            self.height = 80
+            return 'ok'
+        if name == 'land':
+            self.in_air = False
+            self.height = 0
+            return 'ok'
+        if name == 'streamon':
+            self.streaming.set()
+            return 'ok'
+        if name == 'streamoff':
+            self.streaming.clear()
+            return 'ok'
+        if name == 'emergency':
+            self.in_air = False
+            self.height = 0
+            return 'ok'
+        if name in MOVE_LIMITS and len(parts) == 2:
+            return self._move(name, parts[1])
+        if name == 'go' and len(parts) == 5:
+            return 'ok' if self.in_air else 'error Not in air'
+        return 'error'
+
+    def _move(self, direction, value):
+        try:
+            value = int(value)
+        except ValueError:
+            return 'error'
+        if not MOVE_MINIMUMS[direction] <= value <= MOVE_LIMITS[direction]:
+            return 'error'
+        if not self.in_air:
+            return 'error Not in air'
+        if direction == 'up':
+            self.height += value
+        elif direction == 'down':
+            self.height = max(self.height - value, 0)
+        elif direction == 'cw':
+            self.yaw = (self.yaw + value + 180) % 360 - 180
+        elif direction == 'ccw':
+            self.yaw = (self.yaw - value + 180) % 360 - 180
+        return 'ok'
+
+    def _query(self, name):
+        answers = {
+            'battery?': str(self.battery),
+            'speed?': '10.0',
+            'time?': '{}s'.format(int(time() - self.start_time)),
+            'height?': '{}dm'.format(self.height // 10),
+            'temp?': '60~63C',
+            'attitude?': 'pitch:0;roll:0;yaw:{};'.format(self.yaw),
+            'baro?': '113.35',
+            'tof?': '{}mm'.format(self.height * 10 + 100),
+            'wifi?': '90',
+            'sdk?': '20',
+            'sn?': '0TQDG000000000'
+        }
+        return answers.get(name, 'error')
+
+    def state_string(self):
+        """Returns the state string tello sends to the state port."""
+        return ('pitch:0;roll:0;yaw:{yaw};vgx:0;vgy:0;vgz:0;templ:60;'
+                'temph:63;tof:{tof};h:{h};bat:{bat};baro:113.35;time:{t};'
+                'agx:0.00;agy:0.00;agz:-1000.00;\r\n').format(
+                    yaw=self.yaw,
+                    tof=self.height * 10 + 100,
+                    h=self.height,
+                    bat=self.battery,
+                    t=int(time() - self.start_time))
+
+    def _state_thread(self):
+        while not self.stopped.wait(1 / self.state_rate):
+            if self.client is None:
+                continue
+            # the battery drains by one percent every 30 seconds
+            self.battery = max(100 - int((time() - self.start_time) / 30), 0)
+            try:
+                self.out_socket.sendto(self.state_string().encode('ascii'),
+                                       (self.client, self.state_port))
+            except socket.error:
+                return
+
+    def _video_thread(self):
+        if self.video_file is None:
+            return
+        while not self.stopped.is_set():
+            self.streaming.wait()
+            start = time()
+            first_stamp = None
+            for stamp, packet in H264FileSource(self.video_file).packets():
+                if self.stopped.is_set() or not self.streaming.is_set():
+                    break
+                if first_stamp is None:
+                    first_stamp = stamp
+                delay = start + stamp - first_stamp - time()
+                if delay > 0:
+                    sleep(delay)
+                if self._lost():
+                    continue
+                try:
+                    self.out_socket.sendto(packet,
+                                           (self.client, self.video_port))
+                except socket.error:
+                    return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulates a tello.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--cmd-port', type=int, default=8889)
+    parser.add_argument('--state-port', type=int, default=8890)
+    parser.add_argument('--video-port', type=int, default=11111)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds every response is delayed')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='maximum random seconds added to the latency')
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help='probability of a datagram being lost')
+    parser.add_argument('--video', help='raw h264 file streamed in a loop')
+    args = parser.parse_args()
+
+    simulator = TelloSimulator(host=args.host,
+                               cmd_port=args.cmd_port,
+                               state_port=args.state_port,
+                               video_port=args.video_port,
+                               latency=args.latency,
+                               jitter=args.jitter,
+                               loss=args.loss,
+                               video_file=args.video).start()
+    print('[INFO]  Simulating tello on {}:{}'.format(*simulator.address))
+    try:
+        simulator.stopped.wait()
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
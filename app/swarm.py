@@ -0,0 +1,332 @@
+import socket
+import selectors
+import threading
+from time import time
+from collections import deque
+from concurrent.futures import Future, wait
+
+import numpy as np
+
+from console import console
+from log import Logger, decode_response
+from tello import TIMEOUT
+from telemetry import TelemetryReceiver
+from reliability import AT_MOST_ONCE, PendingCommand, Retransmitter
+
+# round trip times kept per drone for the latency stats
+LATENCY_SAMPLES = 1024
+
+
+class SwarmDrone:
+    """The state of one drone of a swarm.
+
+    Attributes:
+        ip: The ip of the drone
+        address: The (ip, port) tuple commands are sent to
+        log: The Logger of the drone
+        telemetry: The TelemetryReceiver of the state of the drone
+        retransmitter: Decides when an unanswered command is sent again
+        pending: The PendingCommand that awaits a response, None when idle
+        queued: A deque of (command, future) tuples waiting to be sent
+        latencies: The round trip times of the latest answered commands
+    """
+
+    def __init__(self, ip, cmd_port, move_policy, history_seconds):
+        self.ip = ip
+        self.address = (ip, cmd_port)
+        self.log = Logger()
+        self.telemetry = TelemetryReceiver(history_seconds)
+        self.retransmitter = Retransmitter(move_policy)
+        self.pending = None
+        self.queued = deque()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def stats(self):
+        """Returns the round trip time percentiles in seconds along with the
+        retransmission and discarded response counters."""
+        stats = self.retransmitter.stats()
+        stats['late'] = self.log.late
+        stats['duplicates'] = self.log.duplicates
+        stats['answered'] = len(self.latencies)
+        if self.latencies:
+            latencies = np.array(self.latencies)
+            stats['mean'] = latencies.mean()
+            stats['p50'], stats['p99'] = np.percentile(latencies, (50, 99))
+            stats['max'] = latencies.max()
+        return stats
+
+
+class Swarm:
+    """Controls many tellos from a single command and a single state socket.
+
+    Every drone has an ip of its own, e.g. tellos joined to a router in
+    station mode, so responses and states are told apart by the ip they
+    come from. A single thread waits on both sockets with a selector,
+    matches the responses to the commands of their drone and resends or
+    fails the unanswered ones.
+
+    A drone executes one command at a time, further commands sent to it
+    are queued until the previous one is answered. Commands to different
+    drones are in flight at the same time, so a broadcast takes about the
+    round trip time of the slowest drone.
+
+    Attributes:
+        drones: A dictionary of the SwarmDrone of every ip
+        unknown: The number of datagrams received from unknown ips
+    """
+
+    def __init__(self,
+                 tello_ips,
+                 cmd_port=8889,
+                 state_port=8890,
+                 local_cmd_port=0,
+                 host='',
+                 move_policy=AT_MOST_ONCE,
+                 history_seconds=600):
+        """Binds the sockets and starts the receiving thread.
+
+        Args:
+            tello_ips (list): The ips of the drones
+            cmd_port (int): The port the drones receive commands on
+            state_port (int): The local port the drones send their state to,
+                None does not receive the state
+            local_cmd_port (int): The local port commands are sent from, 0
+                picks a free one, tello replies to the address the command
+                came from
+            host (string): The local ip to bind the sockets to
+            move_policy (string): If unanswered moves are resent, one of
+                reliability.AT_MOST_ONCE and reliability.AT_LEAST_ONCE
+            history_seconds (int): The duration of state history kept per
+                drone
+        """
+        self.drones = {
+            ip: SwarmDrone(ip, cmd_port, move_policy, history_seconds)
+            for ip in tello_ips
+        }
+        self.unknown = 0
+        self.lock = threading.Lock()
+        self.closed = False
+
+        self.selector = selectors.DefaultSelector()
+        self.cmd_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.cmd_socket.bind((host, local_cmd_port))
+        self.cmd_socket.setblocking(False)
+        self.selector.register(self.cmd_socket, selectors.EVENT_READ,
+                               self._on_responses)
+        self.state_socket = None
+        if state_port is not None:
+            self.state_socket = socket.socket(socket.AF_INET,
+                                              socket.SOCK_DGRAM)
+            self.state_socket.bind((host, state_port))
+            self.state_socket.setblocking(False)
+            self.selector.register(self.state_socket, selectors.EVENT_READ,
+                                   self._on_states)
+        # written to wake up the thread when a command is sent
+        self.wakeup, self.wakeup_reader = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ,
+                               self._on_wakeup)
+
+        self.io_thread = threading.Thread(target=self._io_thread, daemon=True)
+        self.io_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stops the receiving thread and closes the sockets."""
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.send(b'\0')
+        self.io_thread.join()
+        self.selector.close()
+        for sock in (self.cmd_socket, self.state_socket, self.wakeup,
+                     self.wakeup_reader):
+            if sock is not None:
+                sock.close()
+
+    def send(self, ip, command):
+        """Sends a command to a drone without waiting for the response.
+
+        Args:
+            ip (string): The ip of the drone
+            command (string): The command to be sent
+        Returns:
+            Future: Resolved with True if the response was "ok" and False if
+            it was an error or the command timed out
+        """
+        drone = self.drones[ip]
+        future = Future()
+        with self.lock:
+            if command != 'command' and not drone.log.initialized:
+                console.error('{} must be initialized. Run "command" '
+                              'first.', ip)
+                future.set_result(False)
+                return future
+            drone.queued.append((command, future))
+            if drone.pending is None:
+                self._send_next(drone, time())
+        self.wakeup.send(b'\0')
+        return future
+
+    def send_command(self, ip, command):
+        """Sends a command to a drone and waits for the response.
+
+        Returns:
+            bool: True if the response was "ok"
+        """
+        return self.send(ip, command).result()
+
+    def broadcast(self, command, ips=None):
+        """Sends a command to many drones at once and waits for all of them
+        to respond.
+
+        Args:
+            command (string): The command to be sent
+            ips (list): The ips of the drones, None sends to all of them
+        Returns:
+            dict: The success of the command per ip
+        """
+        futures = {ip: self.send(ip, command) for ip in ips or self.drones}
+        wait(futures.values())
+        return {ip: future.result() for ip, future in futures.items()}
+
+    def initialize(self):
+        """Sends "command" to every drone.
+
+        Returns:
+            dict: True per ip of the drones that were initialized
+        """
+        return self.broadcast('command')
+
+    def get_state(self, ip):
+        """Returns the latest state of a drone as a dictionary, or None if
+        no state has been received."""
+        return self.drones[ip].telemetry.snapshot()
+
+    def get_battery(self, ip):
+        """Returns the battery level of the latest state of a drone."""
+        battery = self.drones[ip].telemetry.get('bat')
+        if np.isnan(battery):
+            return self.drones[ip].log.battery
+        return int(battery)
+
+    def get_latency_stats(self):
+        """Returns the round trip time and retransmission stats per ip."""
+        with self.lock:
+            return {ip: drone.stats() for ip, drone in self.drones.items()}
+
+    def _send_next(self, drone, now):
+        """Sends the first queued command of an idle drone, lock held."""
+        if not drone.queued:
+            return
+        command, future = drone.queued.popleft()
+        drone.pending = PendingCommand(
+            command, future, now + TIMEOUT, now,
+            drone.retransmitter.retransmit_at(command, now, 1))
+        drone.log.set_command_sent(command)
+        drone.retransmitter.sent += 1
+        self.cmd_socket.sendto(command.encode('utf-8'), drone.address)
+
+    def _service(self, now):
+        """Resends and fails the unanswered commands, lock held.
+
+        Returns:
+            float: The seconds until the next command is due to be resent
+            or to time out, None if no command awaits a response
+        """
+        next_event = None
+        for drone in self.drones.values():
+            pending = drone.pending
+            if pending is None:
+                continue
+            if pending.deadline <= now:
+                drone.pending = None
+                drone.log.reset()
+                drone.retransmitter.timed_out += 1
+                console.error('Command {} to {} timed out after {} sends.',
+                              pending.command, drone.ip, pending.sends)
+                pending.future.set_result(False)
+                self._send_next(drone, now)
+                pending = drone.pending
+                if pending is None:
+                    continue
+            elif (pending.retransmit_at is not None
+                  and pending.retransmit_at <= now):
+                self.cmd_socket.sendto(pending.command.encode('utf-8'),
+                                       drone.address)
+                pending.sends += 1
+                drone.log.resent()
+                drone.retransmitter.retransmitted += 1
+                pending.retransmit_at = drone.retransmitter.retransmit_at(
+                    pending.command, now, pending.sends)
+
+            due = pending.deadline
+            if pending.retransmit_at is not None:
+                due = min(due, pending.retransmit_at)
+            if next_event is None or due < next_event:
+                next_event = due
+        return None if next_event is None else max(next_event - now, 0)
+
+    def _io_thread(self):
+        """Dispatches the ready sockets to their handlers until closed."""
+        while not self.closed:
+            with self.lock:
+                timeout = self._service(time())
+            for key, _ in self.selector.select(timeout):
+                key.data(key.fileobj)
+
+    def _on_wakeup(self, sock):
+        try:
+            while sock.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _on_responses(self, sock):
+        """Matches every received response to the command of its drone."""
+        while True:
+            try:
+                data, (ip, _) = sock.recvfrom(1024)
+            except BlockingIOError:
+                return
+            except socket.error as e:
+                console.error('{}', e)
+                return
+            now = time()
+            drone = self.drones.get(ip)
+            if drone is None:
+                self.unknown += 1
+                continue
+
+            with self.lock:
+                success = drone.log.received(decode_response(data))
+                pending = drone.pending
+                if success is None or pending is None:
+                    # a late or duplicate response
+                    continue
+                drone.pending = None
+                drone.retransmitter.answered(pending, now)
+                drone.latencies.append(now - pending.sent)
+                self._send_next(drone, now)
+            pending.future.set_result(success)
+
+    def _on_states(self, sock):
+        """Parses every received state into the telemetry of its drone."""
+        while True:
+            try:
+                data, (ip, _) = sock.recvfrom(2048)
+            except BlockingIOError:
+                return
+            except socket.error as e:
+                console.error('{}', e)
+                return
+            drone = self.drones.get(ip)
+            if drone is None:
+                self.unknown += 1
+                continue
+            drone.telemetry.parse(data)
@@ -0,0 +1,296 @@
+import socket
+from time import time
+
+import numpy as np
+
+from console import console
+
+# fields of the state string tello sends to state_port, in the order of the
+# record columns
+STATE_FIELDS = ('pitch', 'roll', 'yaw', 'vgx', 'vgy', 'vgz', 'templ', 'temph',
+                'tof', 'h', 'bat', 'baro', 'time', 'agx', 'agy', 'agz')
+FIELD_INDEX = {field: ind for ind, field in enumerate(STATE_FIELDS)}
+# the fields by the integer value of their key bytes, which can be read from
+# the receive buffer in place, unlike a hashable bytes key
+_KEY_CODES = {
+    int.from_bytes(field.encode('ascii'), 'little'): ind
+    for field, ind in FIELD_INDEX.items()
+}
+
+
+# columns of a TelemetryHistory, the receive timestamp followed by the state
+HISTORY_COLUMNS = ('stamp', ) + STATE_FIELDS
+# samples a TelemetryHistory allocates at first, a minute at 10 Hz, it
+# doubles whenever full until it reaches its capacity
+INITIAL_SAMPLES = 600
+
+
+class TelemetryHistory:
+    """A columnar ring buffer of the latest state samples.
+
+    Each column of HISTORY_COLUMNS is a contiguous float array. The buffer
+    starts small and doubles whenever it is full until it holds capacity
+    samples, so a short session only allocates what it uses. Once at
+    capacity, the oldest samples are overwritten, so memory stays bounded
+    however long the session lasts. Queries are vectorized over the stored
+    samples.
+
+    Attributes:
+        capacity: The maximum number of samples kept
+        columns: A (len(HISTORY_COLUMNS), allocated samples) float array
+        count: The number of samples appended since creation
+    """
+
+    def __init__(self, seconds=600, rate=10):
+        """Allocates the initial buffer.
+
+        Args:
+            seconds (int): The duration of history to keep
+            rate (int): The expected samples per second
+        """
+        self.capacity = max(int(seconds * rate), 1)
+        self.columns = np.full(
+            (len(HISTORY_COLUMNS), min(INITIAL_SAMPLES, self.capacity)),
+            np.nan)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, stamp, state):
+        """Stores a sample, overwriting the oldest one when full.
+
+        Args:
+            stamp (float): The timestamp of the sample
+            state (numpy.ndarray): The values in STATE_FIELDS order
+        """
+        allocated = self.columns.shape[1]
+        if self.count == allocated and allocated < self.capacity:
+            # nothing was overwritten yet, so the samples are in order
+            columns = np.full(
+                (len(HISTORY_COLUMNS), min(allocated * 2, self.capacity)),
+                np.nan)
+            columns[:, :allocated] = self.columns
+            self.columns = columns
+            allocated = columns.shape[1]
+        ind = self.count % allocated
+        self.columns[0, ind] = stamp
+        self.columns[1:, ind] = state
+        self.count += 1
+
+    def _segments(self):
+        """Returns the (begin, end) column ranges holding samples, oldest
+        first."""
+        allocated = self.columns.shape[1]
+        if self.count <= allocated:
+            return ((0, self.count), )
+        split = self.count % allocated
+        return ((split, allocated), (0, split))
+
+    def column(self, name):
+        """Returns the samples of a column, oldest first.
+
+        The result is a view when the buffer has not wrapped around.
+
+        Args:
+            name (string): One of HISTORY_COLUMNS
+        Returns:
+            numpy.ndarray: The stored values of the column
+        """
+        row = self.columns[HISTORY_COLUMNS.index(name)]
+        segments = [row[begin:end] for begin, end in self._segments()]
+        if len(segments) == 1:
+            return segments[0]
+        return np.concatenate(segments)
+
+    def _range(self, start, end):
+        """Returns the column indexes of the samples received in
+        [start, end), oldest first."""
+        stamps = self.columns[0]
+        parts = []
+        for begin, stop in self._segments():
+            # stamps are sorted within a segment, so both bounds are a
+            # binary search
+            first, last = np.searchsorted(stamps[begin:stop], (start, end))
+            parts.append(np.arange(begin + first, begin + last))
+        return np.concatenate(parts)
+
+    def _latest(self, seconds):
+        """Returns the column indexes of the samples of the latest
+        seconds."""
+        now = self.latest_stamp()
+        return self._range(now - seconds, np.nextafter(now, np.inf))
+
+    def between(self, start, end):
+        """Returns the samples received between two timestamps.
+
+        Args:
+            start (float): The inclusive starting timestamp
+            end (float): The exclusive ending timestamp
+        Returns:
+            dict: Arrays of the samples per column of HISTORY_COLUMNS
+        """
+        samples = self.columns[:, self._range(start, end)]
+        return dict(zip(HISTORY_COLUMNS, samples))
+
+    def window(self, field, seconds):
+        """Returns the mean, min and max of a field over the latest samples.
+
+        Args:
+            field (string): One of STATE_FIELDS
+            seconds (float): The duration of the window
+        Returns:
+            tuple: (mean, min, max), NaNs if the window is empty
+        """
+        values = self.columns[HISTORY_COLUMNS.index(field),
+                              self._latest(seconds)]
+        if not values.size:
+            return np.nan, np.nan, np.nan
+        return values.mean(), values.min(), values.max()
+
+    def battery_drain(self, seconds=60):
+        """Returns the battery drain rate over the latest samples.
+
+        The rate is the slope of a least squares line fitted to the battery
+        level.
+
+        Args:
+            seconds (float): The duration of the window
+        Returns:
+            float: Battery percent lost per minute, NaN with fewer than two
+            samples
+        """
+        ind = self._latest(seconds)
+        if ind.size < 2:
+            return np.nan
+        stamps = self.columns[0, ind]
+        battery = self.columns[HISTORY_COLUMNS.index('bat'), ind]
+        stamps = stamps - stamps.mean()
+        denominator = np.dot(stamps, stamps)
+        if not denominator:
+            return np.nan
+        slope = np.dot(stamps, battery - battery.mean()) / denominator
+        return -slope * 60
+
+    def latest_stamp(self):
+        """Returns the timestamp of the newest sample, NaN if empty."""
+        if not self.count:
+            return np.nan
+        return self.columns[0, (self.count - 1) % self.columns.shape[1]]
+
+
+class TelemetryReceiver:
+    """Parses the ~10 Hz state datagrams of tello into fixed-layout records.
+
+    The state string has the format "pitch:0;roll:0;...;agz:0.00;\\r\\n".
+    Datagrams are received into a preallocated buffer and parsed in place,
+    without copying them, into one of two preallocated float records. When
+    a record is complete the state reference is swapped to it, so readers
+    always see a whole record without taking a lock. A record is only
+    overwritten two datagrams later.
+
+    Attributes:
+        state: A float array with the latest values in STATE_FIELDS order,
+            NaN before the first datagram arrives
+        stamp: The timestamp the latest state was received
+        received: The number of state datagrams parsed
+        history: The TelemetryHistory every parsed state is appended to,
+            None if no history is kept
+        on_state: Called with the stamp and the record of every parsed
+            state, None calls nothing
+    """
+
+    def __init__(self, history_seconds=600):
+        """Allocates the records and the history.
+
+        Args:
+            history_seconds (int): The duration of state history to keep,
+                None keeps no history
+        """
+        self.records = np.full((2, len(STATE_FIELDS)), np.nan)
+        self.back = 1  # index of the record the next datagram is parsed into
+        self.state = self.records[0]
+        self.stamp = None
+        self.received = 0
+        self.history = None
+        if history_seconds is not None:
+            self.history = TelemetryHistory(seconds=history_seconds)
+        self.on_state = None
+
+        self.buffer = bytearray(2048)
+
+    def parse(self, data, size=None):
+        """Parses a state datagram and publishes it as the latest state.
+
+        Args:
+            data (bytes): The body of the state datagram, a bytearray
+                receive buffer is parsed in place
+            size (int): The size of the datagram at the start of data, None
+                parses the whole of it
+        """
+        end = len(data) if size is None else size
+        view = memoryview(data)
+        record = self.records[self.back]
+        pos = 0
+        while pos < end:
+            stop = data.find(b';', pos, end)
+            if stop < 0:
+                stop = end
+            colon = data.find(b':', pos, stop)
+            ind = None
+            if colon >= 0:
+                ind = _KEY_CODES.get(int.from_bytes(view[pos:colon], 'little'))
+            # None for the trailing "\r\n" or a field of a newer sdk
+            if ind is not None:
+                try:
+                    record[ind] = float(view[colon + 1:stop])
+                except ValueError:
+                    record[ind] = np.nan
+            pos = stop + 1
+
+        self.stamp = time()
+        if self.history is not None:
+            self.history.append(self.stamp, record)
+        if self.on_state is not None:
+            self.on_state(self.stamp, record)
+        self.state = record
+        self.back ^= 1
+        self.received += 1
+
+    def get(self, field):
+        """Returns the latest value of the given state field.
+
+        Args:
+            field (string): One of STATE_FIELDS
+        Returns:
+            float: The value, NaN if no state has been received
+        """
+        return self.state[FIELD_INDEX[field]]
+
+    def snapshot(self):
+        """Returns a copy of the latest state as a dictionary, or None if no
+        state has been received."""
+        if not self.received:
+            return None
+        return dict(zip(STATE_FIELDS, self.state.tolist()))
+
+    def run(self, sock):
+        """Receives and parses state datagrams until the socket is closed.
+
+        Args:
+            sock (socket.socket): The socket bound to the state port
+        """
+        view = memoryview(self.buffer)
+        while True:
+            try:
+                size = sock.recv_into(view)
+            except socket.error as e:
+                if sock.fileno() == -1:
+                    # the socket was closed, stop listening
+                    break
+                console.error('{}', e)
+                continue
+            if not size:
+                # woken up by close
+                continue
+            self.parse(self.buffer, size)
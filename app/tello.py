@@ -1,14 +1,37 @@
 import os
+import queue
 import socket
 import threading
 import numpy as np
 from time import time, sleep
-
-# import libh264decoder
-
-from log import Logger
+from datetime import datetime
+from collections import deque
+from concurrent.futures import Future, TimeoutError, wait
+
+try:
+    import libh264decoder
+except ImportError:
+    # the decoder library is not built, the stream is received undecoded
+    libh264decoder = None
+
+from log import Logger, decode_response, iter_session
+from recorder import StreamRecorder
+from packet_source import SocketSource
+from command_queue import CommandQueue
+from console import console
+from metrics import MetricsRegistry
+from reliability import AT_MOST_ONCE, PendingCommand, Retransmitter
+from replay import ReplayStep, drift_report, replay_schedule
+from telemetry import TelemetryReceiver
+from video import (LATEST, AccessUnitAssembler, FrameHub, FramePool,
+                   decode_frames)
 
 TIMEOUT = 10
+# access units waiting to be decoded, the oldest is dropped when full
+DECODE_QUEUE_SIZE = 8
+# commands that discard the queued ones and are sent at once, even while
+# the in-flight window is full
+PRIORITY_COMMANDS = ('emergency', 'land')
 
 
 class Tello:
@@ -22,51 +45,274 @@ class Tello:
     state_address = (tello_ip, state_port)
     video_address = (tello_ip, video_port)
 
-    def __init__(self):
-        # create command socket and bind it to cmd_port
-        self.cmd_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.cmd_socket.bind((self.host, self.cmd_port))
+    def __init__(self,
+                 max_in_flight=1,
+                 coalesce=True,
+                 history_seconds=10800,
+                 video_format='rgb24',
+                 video_size=None,
+                 video_source=None,
+                 tello_ip=None,
+                 cmd_port=None,
+                 state_port=None,
+                 video_port=None,
+                 local_cmd_port=0,
+                 move_policy=AT_MOST_ONCE,
+                 session_dir='../sessions',
+                 journal_telemetry=False,
+                 metrics=None):
+        """Binds the sockets and starts the receiving and dispatching
+        threads.
 
-        # create video socket and bind it to video address
+        Args:
+            max_in_flight (int): The number of commands that may await a
+                response at the same time
+            coalesce (bool): If consecutive queued moves of the same
+                direction are merged to one command
+            history_seconds (int): The duration of state history kept in
+                telemetry.history
+            video_format (string): The format of the decoded frames, one of
+                "rgb24", "bgr24", "gray" and "yuv420p"
+            video_size (tuple): The (width, height) the frames are scaled
+                to, None keeps the 960x720 of the stream
+            video_source: Where the video packets come from, e.g. a
+                packet_source.H264FileSource replaying a recording. None
+                receives them from tello on the video socket
+            tello_ip (string): The ip of tello, or of a local
+                simulator.TelloSimulator
+            cmd_port (int): The port tello receives commands on
+            state_port (int): The local port tello sends its state to
+            video_port (int): The local port tello streams the video to
+            local_cmd_port (int): The local port commands are sent from, 0
+                picks a free one. Tello replies to the address the command
+                came from, so any port works, and a free one never collides
+                with a simulator.TelloSimulator bound to cmd_port on the
+                same host
+            move_policy (string): If unanswered commands that change the
+                state of tello, e.g. moves, are resent, one of
+                reliability.AT_MOST_ONCE and reliability.AT_LEAST_ONCE.
+                Queries are always resent
+            session_dir (string): The directory the session is saved in by
+                write_session. The session is journaled to its journals
+                subdirectory as it happens, None keeps it in memory only
+            journal_telemetry (bool): If the states of tello are journaled
+                along with the commands
+            metrics (MetricsRegistry): Where the latencies and the counts of
+                timeouts, drops and errors are recorded, None records
+                nothing
+        """
+        # None keeps the class defaults of the real tello
+        if tello_ip is not None:
+            self.tello_ip = tello_ip
+        if cmd_port is not None:
+            self.cmd_port = cmd_port
+        if state_port is not None:
+            self.state_port = state_port
+        if video_port is not None:
+            self.video_port = video_port
+        self.cmd_address = (self.tello_ip, self.cmd_port)
+        self.state_address = (self.tello_ip, self.state_port)
+        self.video_address = (self.tello_ip, self.video_port)
+
+        # writes the received stream to disk while recording
+        self.recorder = None
+        self.log = None
+        # the started threads that receive on a socket, joined by close
+        self.receive_threads = []
+        # the started threads that wait on a queue or a condition, told to
+        # stop and joined by close
+        self.worker_threads = []
+        self.closed = False
+
+        # create the sockets, closed by close if a port is already in use
+        self.cmd_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.state_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.video_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.video_socket.bind((self.host, self.video_port))
+        try:
+            # bind the command socket to local_cmd_port
+            self.cmd_socket.bind((self.host, local_cmd_port))
+            # bind the state socket to state_port
+            self.state_socket.bind((self.host, self.state_port))
+            # bind the video socket to video address
+            self.video_socket.bind((self.host, self.video_port))
+        except OSError:
+            self.close()
+            raise
+
+        # initialize the logger object, streaming the session to a journal
+        # file that write_session copies. journals are kept in a
+        # subdirectory, so they are not mistaken for saved sessions
+        self.session_dir = session_dir
+        journal_path = None
+        if session_dir is not None:
+            journal_dir = os.path.join(session_dir, 'journals')
+            os.makedirs(journal_dir, exist_ok=True)
+            journal_path = os.path.join(
+                journal_dir, 'journal_{}.txt'.format(
+                    datetime.now().strftime('%Y%m%d_%H%M%S_%f')))
+        self.log = Logger(journal_path=journal_path)
+
+        # PendingCommands that await a response, in the order they were
+        # sent. Tello answers in order, so the receiving command thread
+        # resolves the oldest one.
+        self.pending = deque()
+        self.pending_lock = threading.Lock()
+        # notified when a command is sent, resent or answered
+        self.pending_changed = threading.Condition(self.pending_lock)
+        self.max_in_flight = max_in_flight
+
+        # resends the unanswered commands, with a timeout adapted to the
+        # round trip times
+        self.retransmitter = Retransmitter(move_policy)
+        # commands are held back until then after a resent command was
+        # answered, so a late answer to one of its copies is not taken for
+        # the answer of the next command
+        self.quiet_until = 0.0
+
+        # the latency histograms and event counters, the instruments of a
+        # disabled registry record nothing
+        self.metrics = metrics or MetricsRegistry(enabled=False)
+        self.rtt_histogram = self.metrics.histogram('command_rtt')
+        self.packet_histogram = self.metrics.histogram(
+            'video_packet_interarrival')
+        self.reassembly_histogram = self.metrics.histogram('reassembly_time')
+        self.decode_histogram = self.metrics.histogram('decode_time')
+        # recorded by the consumers of the frames, e.g. video.DisplayStats
+        self.display_histogram = self.metrics.histogram('display_latency')
+        self.sent_counter = self.metrics.counter('commands_sent')
+        self.retransmit_counter = self.metrics.counter('retransmissions')
+        self.timeout_counter = self.metrics.counter('timeouts')
+        self.error_counter = self.metrics.counter('command_errors')
+        self.stray_counter = self.metrics.counter('stray_responses')
+        self.drop_counter = self.metrics.counter('dropped_access_units')
+
+        # commands queued by queue_command, sent by the dispatch thread
+        self.command_queue = CommandQueue(coalesce=coalesce)
+        # incremented whenever a priority command discards the queue, so
+        # the dispatch thread drops the command it is holding back
+        self.preemptions = 0
 
         # start the receiving command thread
         self.receive_cmd_thread = threading.Thread(
-            target=self._receive_cmd_thread)
+            target=self._receive_cmd_thread, daemon=True)
         self.receive_cmd_thread.start()
-
-        # create the video thread
+        self.receive_threads.append(self.receive_cmd_thread)
+
+        # start the receiving state thread
+        self.telemetry = TelemetryReceiver(history_seconds)
+        if journal_telemetry:
+            self.telemetry.on_state = self.log.record_state
+        self.receive_state_thread = threading.Thread(
+            target=self.telemetry.run, args=(self.state_socket, ), daemon=True)
+        self.receive_state_thread.start()
+        self.receive_threads.append(self.receive_state_thread)
+
+        # start the command dispatching thread
+        self.dispatch_thread = threading.Thread(
+            target=self._dispatch_thread, daemon=True)
+        self.dispatch_thread.start()
+        self.worker_threads.append(self.dispatch_thread)
+
+        # start the retransmitting thread
+        self.retransmit_thread = threading.Thread(
+            target=self._retransmit_thread, daemon=True)
+        self.retransmit_thread.start()
+        self.worker_threads.append(self.retransmit_thread)
+
+        # create the video threads, the receiving thread hands complete
+        # access units to the decoding thread over the decode queue
         self.receive_video_thread = threading.Thread(
-            target=self._receive_video_thread)
-
-        # response waiting flag
-        self.waiting = False
-
-        # initialize the logger object
-        self.log = Logger()
-
-        # indicates whether a command was executed successfully
-        self.command_success = False
+            target=self._receive_video_thread, daemon=True)
+        self.decode_video_thread = threading.Thread(
+            target=self._decode_video_thread, daemon=True)
+        self.decode_queue = queue.Queue(maxsize=DECODE_QUEUE_SIZE)
+        self.dropped_access_units = 0
+        self.assembler = AccessUnitAssembler(self._on_access_unit)
+        if video_source is None:
+            video_source = SocketSource(self.video_socket)
+        self.video_source = video_source
 
         # tello status
         self.status = 'Not connected'
 
         # h264 decoder
-        # self.decoder = libh264decoder.H264Decoder()
-
-        self.frame = None
+        self.video_format = video_format
+        if libh264decoder is not None:
+            self.decoder = libh264decoder.H264Decoder()
+            self.decoder.set_output(video_format, *(video_size or (0, 0)))
+        else:
+            console.error('libh264decoder not found, video is not decoded')
+            self.decoder = None
+        # buffers the decoder writes the frames into
+        self.frame_pool = FramePool()
+        # the latest decoded frame and its subscribers
+        self.frames = FrameHub()
 
     def __del__(self):
-        """On delete, closes the running sockets."""
-        self.cmd_socket.close()
-        self.video_socket.close()
+        """On delete, closes the running sockets and the recording."""
+        self.close()
+
+    def close(self):
+        """Stops recording, closes the session journal and the sockets,
+        which releases the local ports and ends the receiving threads, and
+        stops the dispatching, retransmitting and decoding threads."""
+        if self.closed:
+            return
+        self.closed = True
+        self._stop_workers()
+        self.stop_recording()
+        if self.log is not None:
+            self.log.close()
+        for sock in (self.cmd_socket, self.state_socket, self.video_socket):
+            try:
+                # wakes up a thread blocked receiving on the socket, which
+                # otherwise keeps the port bound
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                # not connected or already closed
+                pass
+            sock.close()
+        for thread in self.receive_threads:
+            if thread is not threading.current_thread():
+                # the port is only released once the thread stops receiving
+                thread.join(timeout=1)
+
+    def _stop_workers(self):
+        """Wakes up the threads waiting on a queue or a condition, so that
+        they see closed and return, and joins them. None of them refers to
+        this Tello afterwards, so it can be collected."""
+        if not self.worker_threads:
+            return
+        self.command_queue.close()
+        with self.pending_changed:
+            self.pending_changed.notify_all()
+        while True:
+            # the sentinel of the decoding thread, replacing the oldest
+            # queued access unit if the queue is full
+            try:
+                self.decode_queue.put_nowait(None)
+                break
+            except queue.Full:
+                try:
+                    self.decode_queue.get_nowait()
+                    self.decode_queue.task_done()
+                except queue.Empty:
+                    pass
+        for thread in self.worker_threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=1)
 
     def send_command(self, command, reverse=False):
-        """Sends the given command to tello and waits in a loop for the response.
+        """Sends the given command to tello and waits for the response.
 
-        The loop is exited if the waiting flag is set to False or the timeout
-        window has expired.
+        The caller blocks on a per-command future that is resolved by the
+        receiving command thread as soon as the response arrives, or until
+        the timeout window has expired. Meanwhile, the command is resent
+        when the retransmitter policy allows it.
+
+        "emergency" and "land" are priority commands: the queued commands
+        are discarded and the command is sent at once, even while the
+        in-flight window is full.
 
         Args:
             command (string): The command to be sent
@@ -76,181 +322,531 @@ class Tello:
             "OK". False if the command could not be sent or the response was
             "ERROR".
         """
-        if self.waiting:
-            # if the server is waiting for a reponse, no further command
-            # can be accepted and sent
-            print('[ERROR] Another command awaits reponse, please wait')
-            return False
-
         if command != 'command' and not self.log.initialized:
             # if tello is not initialized it cannot accept any commands
-            print('[ERROR]: Tello must be initialized. Run "command" first.')
+            console.error('Tello must be initialized. Run "command" first.')
             return False
 
+        priority = command in PRIORITY_COMMANDS
+        if priority:
+            self._preempt()
         if not reverse:
             # if the command is part of fetching, dont print it
-            print('[INFO]  Sending: {}'.format(command))
-        # send the command encoded to utf-8
-        self.cmd_socket.sendto(command.encode('utf-8'), self.cmd_address)
-        self.log.set_command_sent(command)
-        # waiting flag is set to True
-        self.waiting = True
+            console.info('Sending: {}', command)
+        pending = self._dispatch(command, priority)
+        if pending is None:
+            # if the in-flight window is full, no further command
+            # can be accepted and sent
+            console.error('Another command awaits reponse, please wait')
+            return False
 
-        start = time()
-        while self.waiting:
-            # when the response arrives, self.waiting is set to False
-            sleep(0.005)  # limit to 200 checks per second
-            if time() - start > TIMEOUT:
-                # when the waiting period exceeds the timeout limit print the
-                # error and set the waiting flag to False, so that the server
-                # can accept a new command
-                print('[ERROR] Command {} timed out.'.format(command))
-                self.log.reset()
-                self.waiting = False
-                return False
-        else:
-            # executed when while is terminated by the self.waiting command and
-            # not the break
-            if self.command_success:
-                if command == 'streamon':
-                    # start the video receiving thread
-                    self.receive_video_thread.start()
-                return True
-            else:
-                return False
+        try:
+            # woken up by the receiving thread when the response arrives
+            return pending.result(timeout=TIMEOUT)
+        except TimeoutError:
+            self._expire_pending()
+            # the future is resolved, unless the response raced the timeout
+            return pending.done() and pending.result()
+
+    def queue_command(self, command):
+        """Queues the given command to be sent by the dispatch thread.
+
+        Unlike send_command it never blocks nor drops the command while
+        another one awaits a response. A priority command discards the
+        queued commands and is sent at once.
+
+        Args:
+            command (string): The command to be sent
+        """
+        if command in PRIORITY_COMMANDS:
+            self._preempt()
+            console.info('Sending: {}', command)
+            self._dispatch(command, priority=True)
+            return
+        self.command_queue.put(command)
+
+    def get_queue_stats(self):
+        """Returns the depth and wait time metrics of the command queue."""
+        stats = self.command_queue.stats()
+        with self.pending_lock:
+            stats['in_flight'] = len(self.pending)
+        return stats
+
+    def get_reliability_stats(self):
+        """Returns the retransmission counters, the round trip time
+        estimates and the counts of the discarded responses."""
+        with self.pending_lock:
+            stats = self.retransmitter.stats()
+            stats['late'] = self.log.late
+            stats['duplicates'] = self.log.duplicates
+            stats['unmatched'] = self.log.unmatched
+            return stats
+
+    def get_metrics(self):
+        """Returns the snapshot of the latency histograms and the event
+        counters, empty unless a metrics registry was given."""
+        return self.metrics.snapshot()
+
+    @property
+    def waiting(self):
+        """bool: True while a command awaits its response."""
+        return len(self.pending) > 0
+
+    def _preempt(self):
+        """Discards the queued commands, so that none of them is sent after
+        a priority command or the route home."""
+        with self.pending_lock:
+            self.command_queue.clear()
+            self.preemptions += 1
+
+    def _dispatch(self, command, priority=False, preemptions=None):
+        """Sends the command if the in-flight window has room for it.
+
+        Args:
+            command (string): The command to be sent
+            priority (bool): If the command is sent at once, without waiting
+                for the quiet period nor for room in the window
+            preemptions (int): The preemptions count when the command was
+                taken out of the queue, it is not sent if the queue was
+                discarded since. None sends it regardless
+        Returns:
+            Future: Resolved with the success of the command when its
+            response arrives, None if the window is full or the command
+            was discarded
+        """
+        self._expire_pending()
+        delay = self.quiet_until - time()
+        if delay > 0 and not priority:
+            sleep(delay)
+        with self.pending_lock:
+            if preemptions is not None and preemptions != self.preemptions:
+                return None
+            if len(self.pending) >= self.max_in_flight and not priority:
+                return None
+            pending = Future()
+            if command == 'streamon':
+                pending.add_done_callback(self._on_streamon)
+            now = time()
+            self.pending.append(
+                PendingCommand(command, pending, now + TIMEOUT, now,
+                               self.retransmitter.retransmit_at(
+                                   command, now, 1)))
+            self.log.set_command_sent(command)
+            # send the command encoded to utf-8
+            self.cmd_socket.sendto(command.encode('utf-8'), self.cmd_address)
+            self.retransmitter.sent += 1
+            self.sent_counter.increment()
+            self.pending_changed.notify()
+        return pending
+
+    def _expire_pending(self):
+        """Fails the in-flight commands whose timeout window has expired, so
+        that the server can accept new commands."""
+        with self.pending_lock:
+            self._expire_locked(time())
+
+    def _expire_locked(self, now):
+        """Fails the expired in-flight commands, pending_lock held."""
+        while self.pending and self.pending[0].deadline <= now:
+            pending = self.pending.popleft()
+            self.log.reset()
+            if pending.future.done():
+                continue
+            self.retransmitter.timed_out += 1
+            self.timeout_counter.increment()
+            console.error('Command {} timed out after {} sends.',
+                          pending.command, pending.sends)
+            pending.future.set_result(False)
+
+    def _retransmit_thread(self):
+        """Resends the oldest command while it is unanswered and fails the
+        commands whose timeout window has expired.
+
+        A command is only resent while it is the single one in flight, since
+        a late answer to one of its copies could otherwise not be told from
+        the answers of the commands sent after it.
+        """
+        with self.pending_changed:
+            while not self.closed:
+                now = time()
+                self._expire_locked(now)
+                if not self.pending:
+                    self.pending_changed.wait()
+                    continue
+
+                oldest = self.pending[0]
+                wake = oldest.deadline
+                if oldest.retransmit_at is not None and len(self.pending) == 1:
+                    if oldest.retransmit_at <= now:
+                        try:
+                            self.cmd_socket.sendto(
+                                oldest.command.encode('utf-8'),
+                                self.cmd_address)
+                        except socket.error as e:
+                            console.error('{}', e)
+                        oldest.sends += 1
+                        self.log.resent()
+                        oldest.retransmit_at = (
+                            self.retransmitter.retransmit_at(
+                                oldest.command, now, oldest.sends))
+                        self.retransmitter.retransmitted += 1
+                        self.retransmit_counter.increment()
+                        continue
+                    wake = min(wake, oldest.retransmit_at)
+                self.pending_changed.wait(wake - now)
+
+    def _on_streamon(self, pending):
+        if pending.result():
+            self.start_video()
+
+    def start_video(self):
+        """Starts the video receiving and decoding threads, if not started.
+
+        Called when streamon succeeds. A replaying video source is started
+        directly, without a connection to tello.
+        """
+        if self.receive_video_thread.ident is None:
+            self.receive_video_thread.start()
+            self.decode_video_thread.start()
+            self.receive_threads.append(self.receive_video_thread)
+            self.worker_threads.append(self.decode_video_thread)
+
+    def _dispatch_thread(self):
+        """Sends the queued commands in order, keeping at most max_in_flight
+        of them awaiting a response."""
+        while True:
+            command = self.command_queue.get()
+            if command is None:
+                # the queue was closed
+                break
+            preemptions = self.preemptions
+            if command != 'command' and not self.log.initialized:
+                console.error('Tello must be initialized. Run "command" '
+                              'first.')
+                continue
+
+            console.info('Sending: {}', command)
+            while self._dispatch(command, preemptions=preemptions) is None:
+                if self.preemptions != preemptions:
+                    # a priority command discarded the queue meanwhile
+                    break
+                # the window is full, wait for the oldest command to be
+                # answered or to time out
+                with self.pending_lock:
+                    oldest = self.pending[0] if self.pending else None
+                if oldest is not None:
+                    wait([oldest.future],
+                         timeout=max(oldest.deadline - time(), 0))
 
     def _receive_cmd_thread(self):
         """Listens for a response from the cmd_socket.
 
-        When the response arrives, calls log.received which sets the
-        command_success attribute and sets the waiting flag to False.
+        When the response arrives, calls log.received and resolves the
+        oldest pending command future with its result, waking up its sender.
+        A late or duplicate response matches no pending command and is
+        discarded.
         """
         while True:
             try:
-                response, ip = self.cmd_socket.recvfrom(1024)
-                try:
-                    print('[INFO]  Response: {}'.format(
-                        response.decode('UTF-8')))
-                except UnicodeDecodeError:
-                    print('[INFO]  Response: {}'.format(
-                        response.decode('latin-1')))
-
-                self.command_success = self.log.received(response)
-                self.waiting = False
+                data, ip = self.cmd_socket.recvfrom(1024)
             except socket.error as e:
-                print('[ERROR] {}'.format(e))
+                if self.cmd_socket.fileno() == -1:
+                    # the socket was closed, stop listening
+                    break
+                console.error('{}', e)
+                continue
+            if not data:
+                # woken up by close
+                continue
+
+            response = decode_response(data)
+            console.info('Response: {}', response)
+
+            now = time()
+            with self.pending_lock:
+                success = self.log.received(response)
+                pending = None
+                if success is None:
+                    self.stray_counter.increment()
+                    console.info('Discarded a response that answers no '
+                                 'pending command')
+                elif self.pending:
+                    pending = self.pending.popleft()
+                    self.retransmitter.answered(pending, now)
+                    self.rtt_histogram.record(now - pending.sent)
+                    if not success:
+                        self.error_counter.increment()
+                    if pending.sends > 1:
+                        self.quiet_until = (
+                            now + self.retransmitter.quiet_period(pending))
+                    self.pending_changed.notify()
+            if pending is not None:
+                pending.future.set_result(success)
 
     def _receive_video_thread(self):
-        """Listens for a response from the video_socket.
+        """Passes the packets of the video source to the assembler.
 
-        When the response's body length is not 1460, the data included in the
-        packet_data string are decoded to frames with dimensions 960x720.
-        When a frame is decoded, it is assigned to the frame attribute.
+        The assembler hands every complete access unit to the decoding
+        thread. Receiving never waits for decoding. The thread ends when the
+        source is exhausted or its socket is closed.
         """
-        # python 2
-        # packet_data = ""
-        # while True:
-        #     try:
-        #         res_string, ip = self.video_socket.recvfrom(2048)
-        #         packet_data += res_string
-        #         # end of frame
-        #         if len(res_string) != 1460:
-        #             for frame in self._h264_decode(packet_data):
-        #                 self.frame = frame
-        #             packet_data = ""
-
-        #     except socket.error as exc:
-        #         print("Caught exception socket.error : %s" % exc)
-
-        # python 3
-        packet_data = bytearray("", encoding='utf8')
+        # the clock is only read per packet if the metrics record
+        timed = self.metrics.enabled
+        last = None
         while True:
             try:
-                response, ip = self.video_socket.recvfrom(2048)
-                packet_data.extend(response)
-                if len(response) != 1460:
-                    # decode packet_data to frames
-                    packet_data.clear()
+                if not self.video_source.receive(self.assembler):
+                    break
             except socket.error as e:
-                print('[ERROR] {}'.format(e))
+                console.error('{}', e)
+                continue
+            if timed:
+                now = time()
+                if last is not None:
+                    self.packet_histogram.record(now - last)
+                last = now
+
+    def get_video_stats(self):
+        """Returns the reassembly counters and the number of access units
+        dropped because the decoder fell behind."""
+        stats = self.assembler.stats()
+        stats['dropped'] = self.dropped_access_units
+        return stats
+
+    def _on_access_unit(self, access_unit):
+        """Hands a complete access unit to the recorder, if recording, and
+        to the decoding thread."""
+        if self.metrics.enabled:
+            self.reassembly_histogram.record(
+                time() - self.assembler.unit_started)
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.write(access_unit)
+        self._enqueue_access_unit(access_unit)
+
+    def start_recording(self, path=None):
+        """Starts writing the received h264 stream to disk.
+
+        Args:
+            path (string): The path of the stream file, defaults to a file
+                named after the current time in ../recordings
+        Returns:
+            string: The path of the stream file
+        """
+        if self.recorder is not None:
+            return self.recorder.path
+        if path is None:
+            os.makedirs('../recordings', exist_ok=True)
+            path = '../recordings/recording_{}.h264'.format(
+                datetime.now().strftime('%Y%m%d_%H%M%S'))
+        self.recorder = StreamRecorder(path)
+        console.info('Recording to {}', path)
+        return path
+
+    def stop_recording(self):
+        """Stops recording and closes the recording files."""
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+            console.info('Recorded {} frames', recorder.written)
+
+    def _enqueue_access_unit(self, access_unit):
+        """Puts the access unit in the decode queue without blocking.
+
+        If the decoder falls behind and the queue is full, the oldest access
+        unit is dropped, so that the receiving thread keeps draining the
+        socket. Sources replaying at full speed block instead.
+
+        Args:
+            access_unit (bytes): The h264 data of a whole frame
+        """
+        if self.video_source.blocking:
+            # a replay at full speed waits for the decoder instead
+            self.decode_queue.put(access_unit)
+            return
+        while True:
+            try:
+                self.decode_queue.put_nowait(access_unit)
+                return
+            except queue.Full:
+                try:
+                    self.decode_queue.get_nowait()
+                    self.decode_queue.task_done()
+                    self.dropped_access_units += 1
+                    self.drop_counter.increment()
+                except queue.Empty:
+                    pass
+
+    def _decode_video_thread(self):
+        """Decodes the queued access units and publishes the decoded frames
+        to the frames mailbox."""
+        # the clock is only read per access unit if the metrics record
+        timed = self.metrics.enabled
+        while True:
+            access_unit = self.decode_queue.get()
+            if access_unit is None:
+                # the sentinel of close
+                break
+            if timed:
+                start = time()
+                frames = self._h264_decode(access_unit)
+                self.decode_histogram.record(time() - start)
+            else:
+                frames = self._h264_decode(access_unit)
+            for frame in frames:
+                self.frames.publish(frame)
+            self.decode_queue.task_done()
+
+    @property
+    def frame(self):
+        """numpy.ndarray: The latest decoded frame, None before the first
+        one."""
+        return self.frames.frame
+
+    def wait_for_frame(self, last_seq=0, timeout=None):
+        """Waits for a frame newer than last_seq.
+
+        Args:
+            last_seq (int): The sequence number of the last frame consumed
+            timeout (float): Seconds to wait, None waits forever
+        Returns:
+            tuple: (frame, seq, stamp) of the latest frame, None if the
+            timeout expired
+        """
+        return self.frames.wait_next(last_seq, timeout)
+
+    def subscribe_frames(self, policy=LATEST, maxsize=4):
+        """Subscribes a consumer to the decoded frames.
+
+        Args:
+            policy (string): What happens when the consumer falls behind,
+                one of video.LATEST, video.DROP_OLDEST and video.BLOCK
+            maxsize (int): The number of frames queued for the consumer
+        Returns:
+            FrameSubscription: The subscription to get the frames from
+        """
+        return self.frames.subscribe(policy, maxsize)
+
+    def unsubscribe_frames(self, subscription):
+        """Stops delivering frames to the given subscription."""
+        self.frames.unsubscribe(subscription)
 
     def _h264_decode(self, packet_data):
         """Decode raw h264 format data from Tello.
 
+        Frames are decoded into the buffers of the frame pool and returned
+        as views of them.
+
         :param packet_data: raw h264 data array
 
         :return: a list of decoded frame
         """
-        res_frame_list = []
-        # frames = self.decoder.decode(packet_data)
-        frames = []
-        for framedata in frames:
-            (frame, w, h, ls) = framedata
-            if frame is not None:
-                frame = np.fromstring(frame,
-                                      dtype=np.ubyte,
-                                      count=len(frame),
-                                      sep='')
-                frame = (frame.reshape((h, ls / 3, 3)))
-                frame = frame[:, :w, :]
-                res_frame_list.append(frame)
-
-        return res_frame_list
+        if self.decoder is None:
+            return []
+        return decode_frames(self.decoder, packet_data, self.frame_pool,
+                             self.video_format)
 
     def fetch(self):
-        """Retrieves the reversed pathing commands and sends them to tello."""
-        print('[INFO] Returning home...')
+        """Sends the route back to where the session started, a straight
+        line followed by the rotation to the starting heading.
+
+        The queued commands are discarded and the route is computed once
+        the commands in flight are answered or timed out, so that the moves
+        among them are part of it.
+        """
+        console.info('Returning home...')
+        self._preempt()
+        self._wait_in_flight()
         r_cmds = self.log.reverse_path_cmd()
         for cmd in r_cmds:
             # TODO: what if command fails
             self.send_command(cmd, reverse=True)
 
-    def replay_session(self, session_file):
-        """Reads the command of the session file given and executes them.
+    def _wait_in_flight(self):
+        """Waits until no command awaits a response."""
+        while True:
+            self._expire_pending()
+            with self.pending_lock:
+                oldest = self.pending[0] if self.pending else None
+            if oldest is None:
+                return
+            wait([oldest.future], timeout=max(oldest.deadline - time(), 0))
+
+    def replay_session(self, session_file, speed=None):
+        """Streams the commands of the session file given and executes them.
+
+        With a speed, each command is sent when it is due by the recorded
+        timing, otherwise as soon as the previous one is answered. The
+        drift from the recording is printed once done.
 
         Args:
             session_file (string): The file of the session to be loaded
+            speed (float): The factor the recorded timing is sped up by,
+                e.g. 1.0 reproduces it and 2.0 halves every pause. None
+                replays as fast as tello answers
+        Returns:
+            list: The ReplayStep of every command
         """
-        with open(session_file, 'r') as f:
-            lines = f.readlines()
-            # line1: date, line2: new_line, line3: "command"
-            cmd_tuples = lines[3:]
-
-        # the command part of the tuple
-        raw_cmds = list(map(lambda x: x.split('\t')[0], cmd_tuples))
-        for cmd in raw_cmds:
-            self.send_command(cmd)
+        steps = []
+        start = time()
+        schedule = replay_schedule(iter_session(session_file), speed)
+        for cmd, due, original_rtt in schedule:
+            send_lag = 0.0
+            if due is not None:
+                delay = start + due - time()
+                if delay > 0:
+                    sleep(delay)
+                send_lag = max(-delay, 0.0)
+            sent = time()
+            success = self.send_command(cmd)
+            steps.append(
+                ReplayStep(cmd, success, original_rtt, time() - sent,
+                           send_lag))
+
+        console.info('Replay drift: {}', drift_report(steps))
+        return steps
 
     def write_session(self, session_name):
-        """Writes the current session to a txt file by calling log.to_text
+        """Saves the current session to a txt file by calling log.save.
+
+        The journaled session is already on disk, so its journal is copied.
 
         Args:
             session_name (string): The name of the session
         """
+        session_dir = self.session_dir or '../sessions'
         try:
-            os.makedirs('../sessions')
+            os.makedirs(session_dir)
         except FileExistsError:
             # session directory already exists
             pass
-        name = '../sessions/session_{}.txt'.format(session_name)
-        self.log.to_text(name)
+        name = os.path.join(session_dir, 'session_{}.txt'.format(session_name))
+        self.log.save(name)
 
     def get_status(self):
         return self.log.status
 
     def get_battery(self):
-        return self.log.battery
+        """Returns the battery level of the latest state received, or the
+        response of the last "battery?" query if no state has arrived."""
+        battery = self.telemetry.get('bat')
+        if np.isnan(battery):
+            return self.log.battery
+        return int(battery)
+
+    def get_state(self):
+        """Returns the latest state of tello as a dictionary, or None if no
+        state has been received."""
+        return self.telemetry.snapshot()
 
     def initialize(self):
-        """Sends "command" command and if the response was successful, sends
-        "battery" command.
+        """Sends "command" command, after which tello starts streaming its
+        state, battery included, to the state port.
 
         Returns:
             bool: True if "command" was sent successfully, False if "command" failed
         """
         if self.send_command('command'):
             self.status = 'Connected'
-            # get the battery level of tello
-            self.send_command('battery?')
             return True
         return False
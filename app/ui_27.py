@@ -180,7 +180,8 @@ class ControlUI:
         self.tello = Tello()
         flag = self.tello.initialize()
         if not flag:
-            # if initialization fails
+            # if initialization fails, release the ports before a retry
+            self.tello.close()
             del self.tello
         else:
             self.update_status()
@@ -0,0 +1,502 @@
+import weakref
+import threading
+from time import time
+from collections import deque
+
+import numpy as np
+
+from metrics import NULL_HISTOGRAM
+
+# tello splits each access unit into packets of this size, the last one of
+# an access unit is shorter
+PACKET_SIZE = 1460
+# the largest datagram received on the video port
+MAX_PACKET_SIZE = 2048
+# partial access units growing beyond this size are discarded
+MAX_ACCESS_UNIT_SIZE = 512 * 1024
+# the first packet of an access unit starts with a NAL start code
+START_CODES = (b'\x00\x00\x00\x01', b'\x00\x00\x01')
+
+
+class AccessUnitAssembler:
+    """Reassembles the h264 access units tello streams in udp packets.
+
+    Packets are received straight into a preallocated buffer. An access
+    unit is complete when a packet shorter than PACKET_SIZE arrives, or
+    when a packet starting with a NAL start code arrives after data has been
+    buffered, which also covers access units whose size is a multiple of
+    PACKET_SIZE. A partial access unit that outgrows max_size, because its
+    last packet was lost, is discarded and the packets up to the next start
+    code are skipped. So are the packets of an access unit whose first
+    packet was lost, unless the previous access unit was still buffered
+    because its size is a multiple of PACKET_SIZE, in which case they
+    cannot be told apart from its own packets.
+
+    Attributes:
+        packets: The number of packets received
+        bytes: The number of bytes received
+        access_units: The number of complete access units
+        discarded: The number of partial access units discarded
+        unit_started: The time the first packet of the buffered access unit
+            arrived, so on_access_unit can measure the reassembly time
+    """
+
+    def __init__(self, on_access_unit, max_size=MAX_ACCESS_UNIT_SIZE):
+        """Allocates the buffer.
+
+        Args:
+            on_access_unit (function): Called with the bytes of every
+                complete access unit
+            max_size (int): The size partial access units may grow to
+        """
+        self.on_access_unit = on_access_unit
+        self.max_size = max_size
+        self.buffer = bytearray(max_size + MAX_PACKET_SIZE)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+        # False until a packet with a start code arrives
+        self.synced = False
+        self.unit_started = 0.0
+
+        self.packets = 0
+        self.bytes = 0
+        self.access_units = 0
+        self.discarded = 0
+
+    def receive(self, sock):
+        """Receives a packet from the socket into the buffer, without
+        allocating it.
+
+        Args:
+            sock (socket.socket): The socket bound to the video port
+        """
+        size = sock.recv_into(self.view[self.length:], MAX_PACKET_SIZE)
+        self._commit(size)
+
+    def feed(self, packet):
+        """Appends a packet from any other source to the buffer.
+
+        Args:
+            packet (bytes): The body of the packet
+        """
+        size = len(packet)
+        self.view[self.length:self.length + size] = packet
+        self._commit(size)
+
+    def _commit(self, size):
+        """Handles a packet of the given size written at the end of the
+        buffered data."""
+        start = self.length
+        self.packets += 1
+        self.bytes += size
+        starts_unit = self.buffer.startswith(START_CODES, start)
+
+        if not self.synced:
+            if not starts_unit:
+                # the start of this access unit was lost, skip the packet
+                return
+            self.synced = True
+        elif not start and not starts_unit:
+            # the first packet of this access unit was lost, skip the
+            # packets up to the next start code
+            self.discarded += 1
+            self.synced = False
+            return
+
+        if starts_unit and start:
+            # a new access unit starts, the buffered one is complete
+            self._emit(start)
+            self.buffer[:size] = self.view[start:start + size].tobytes()
+            start = 0
+        if not start:
+            self.unit_started = time()
+
+        self.length = start + size
+        if size < PACKET_SIZE:
+            self._emit(self.length)
+        elif self.length > self.max_size:
+            # the end of the access unit was lost
+            self.discarded += 1
+            self.length = 0
+            self.synced = False
+
+    def _emit(self, length):
+        """Hands the first length buffered bytes over as an access unit and
+        empties the buffer."""
+        self.access_units += 1
+        self.length = 0
+        self.on_access_unit(self.view[:length].tobytes())
+
+    def stats(self):
+        """Returns the packet, byte, access unit and discard counters."""
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'access_units': self.access_units,
+            'discarded': self.discarded
+        }
+
+
+class FrameMailbox:
+    """Holds the latest decoded frame and wakes up the consumers waiting
+    for a new one.
+
+    Every published frame gets the next sequence number, so a consumer
+    passing the sequence number of the last frame it saw knows how many
+    frames it skipped.
+
+    Attributes:
+        frame: The latest frame, None before the first one
+        seq: The sequence number of the latest frame, 0 before the first one
+        stamp: The timestamp the latest frame was decoded
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.seq = 0
+        self.stamp = None
+        self.condition = threading.Condition()
+
+    def publish(self, frame, stamp=None):
+        """Replaces the latest frame and notifies the waiting consumers.
+
+        Args:
+            frame (numpy.ndarray): The decoded frame
+            stamp (float): The timestamp the frame was decoded, defaults to
+                now
+        """
+        with self.condition:
+            self.frame = frame
+            self.stamp = time() if stamp is None else stamp
+            self.seq += 1
+            self.condition.notify_all()
+
+    def wait_next(self, last_seq=0, timeout=None):
+        """Waits for a frame newer than last_seq.
+
+        Args:
+            last_seq (int): The sequence number of the last frame consumed
+            timeout (float): Seconds to wait, None waits forever
+        Returns:
+            tuple: (frame, seq, stamp) of the latest frame, None if the
+            timeout expired. seq - last_seq - 1 frames were skipped.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > last_seq,
+                                           timeout):
+                return None
+            return self.frame, self.seq, self.stamp
+
+
+# policies of a FrameSubscription
+LATEST = 'latest'
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+
+class FrameSubscription:
+    """A consumer's queue of the frames published to a FrameHub.
+
+    The policy decides what happens when the consumer falls behind:
+    LATEST keeps only the newest frame, DROP_OLDEST keeps the newest
+    maxsize frames, and BLOCK makes the publisher wait up to put_timeout
+    for room before dropping the frame, so that a stalled consumer delays
+    decoding by at most put_timeout per frame.
+
+    Attributes:
+        policy: One of LATEST, DROP_OLDEST and BLOCK
+        maxsize: The number of frames queued at most
+        dropped: The number of frames dropped for this consumer
+    """
+
+    def __init__(self, policy=LATEST, maxsize=4, put_timeout=0.05):
+        """Creates the empty queue.
+
+        Args:
+            policy (string): One of LATEST, DROP_OLDEST and BLOCK
+            maxsize (int): The number of frames queued at most, 1 for LATEST
+            put_timeout (float): Seconds the publisher waits for room under
+                BLOCK
+        """
+        if policy not in (LATEST, DROP_OLDEST, BLOCK):
+            raise ValueError('Unknown policy {}'.format(policy))
+        self.policy = policy
+        self.maxsize = 1 if policy == LATEST else maxsize
+        self.put_timeout = put_timeout
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.dropped = 0
+
+    def deliver(self, item):
+        """Queues a (frame, seq, stamp) tuple according to the policy.
+
+        Called by the publishing thread. Frames are queued by reference.
+        """
+        with self.condition:
+            if len(self.queue) >= self.maxsize:
+                if self.policy != BLOCK:
+                    self.queue.popleft()
+                    self.dropped += 1
+                elif not self.condition.wait_for(
+                        lambda: len(self.queue) < self.maxsize,
+                        self.put_timeout):
+                    # the consumer is stalled, drop the new frame
+                    self.dropped += 1
+                    return
+            self.queue.append(item)
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        """Removes and returns the oldest queued frame.
+
+        Args:
+            timeout (float): Seconds to wait for a frame, None waits forever
+        Returns:
+            tuple: (frame, seq, stamp), None if the timeout expired
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.queue, timeout):
+                return None
+            item = self.queue.popleft()
+            # wake up a publisher blocked on a full queue
+            self.condition.notify_all()
+            return item
+
+
+class FrameHub(FrameMailbox):
+    """A FrameMailbox that also fans every frame out to subscriptions.
+
+    Each subscription has its own queue and policy, so a slow consumer does
+    not hold back the others. Frames are shared by reference.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # replaced on every change, so publish iterates it without a lock
+        self.subscriptions = ()
+        self.subscriptions_lock = threading.Lock()
+
+    def subscribe(self, policy=LATEST, maxsize=4, put_timeout=0.05):
+        """Creates a FrameSubscription receiving the following frames.
+
+        Args:
+            policy (string): One of LATEST, DROP_OLDEST and BLOCK
+            maxsize (int): The number of frames queued at most
+            put_timeout (float): Seconds the publisher waits for room under
+                BLOCK
+        Returns:
+            FrameSubscription: The subscription to get the frames from
+        """
+        subscription = FrameSubscription(policy, maxsize, put_timeout)
+        with self.subscriptions_lock:
+            self.subscriptions = self.subscriptions + (subscription, )
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stops delivering frames to the subscription."""
+        with self.subscriptions_lock:
+            self.subscriptions = tuple(
+                s for s in self.subscriptions if s is not subscription)
+
+    def publish(self, frame, stamp=None):
+        """Replaces the latest frame and delivers it to every subscription.
+
+        Args:
+            frame (numpy.ndarray): The decoded frame
+            stamp (float): The timestamp the frame was decoded, defaults to
+                now
+        """
+        super().publish(frame, stamp)
+        item = (frame, self.seq, self.stamp)
+        for subscription in self.subscriptions:
+            subscription.deliver(item)
+
+
+class DisplayStats:
+    """Counts the frames a consumer displayed and skipped and measures the
+    latency from decoding to display.
+
+    Attributes:
+        displayed: The number of frames displayed
+        skipped: The number of frames never displayed
+        total_latency: The sum of the decode to display latencies
+        max_latency: The longest decode to display latency
+        latency_histogram: Where every latency is recorded as well, e.g.
+            the display_latency histogram of Tello
+    """
+
+    def __init__(self, latency_histogram=NULL_HISTOGRAM):
+        self.latency_histogram = latency_histogram
+        self.displayed = 0
+        self.skipped = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def update(self, skipped, stamp):
+        """Records a displayed frame.
+
+        Args:
+            skipped (int): The frames skipped since the previous one
+            stamp (float): The timestamp the frame was decoded
+        """
+        latency = time() - stamp
+        self.displayed += 1
+        self.skipped += skipped
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.latency_histogram.record(latency)
+
+    def stats(self):
+        """Returns the displayed and skipped frame counts and the mean and
+        max latency in seconds."""
+        mean = self.total_latency / self.displayed if self.displayed else 0.0
+        return {
+            'displayed': self.displayed,
+            'skipped': self.skipped,
+            'mean_latency': mean,
+            'max_latency': self.max_latency
+        }
+
+
+class FrameLease(np.ndarray):
+    """A view of a FramePool buffer handed out for one decoded frame.
+
+    Slices and reshapes of a FrameLease are FrameLeases whose base is the
+    lease, and plain ndarray views of them keep them alive as their base,
+    so the lease lives as long as any view of the frame does.
+    """
+
+
+class FramePool:
+    """A ring of preallocated buffers the decoder writes frames into.
+
+    Decoded frames are views of these buffers, so no memory is allocated
+    per frame in steady state. Every acquire hands a buffer out as a new
+    FrameLease and keeps a weak reference to it. A buffer is only reused
+    once its lease is gone, that is once no frame view of it is alive, so
+    frames shared with slow consumers are never overwritten. When every
+    buffer is in use the pool grows by one.
+
+    Attributes:
+        buffers: The flat byte arrays of the pool
+        leases: A weak reference to the latest lease of every buffer, None
+            for buffers never handed out
+        nbytes: The size of each buffer
+    """
+
+    def __init__(self, size=4, nbytes=0):
+        """Allocates the buffers.
+
+        Args:
+            size (int): The number of buffers
+            nbytes (int): The size of each buffer, 0 to allocate them with
+                the size of the first decoded frame
+        """
+        self.nbytes = nbytes
+        self.buffers = [np.empty(nbytes, dtype=np.ubyte) for _ in range(size)]
+        self.leases = [None] * size
+        self.next = 0
+
+    def acquire(self):
+        """Leases the next buffer of the ring no frame refers to.
+
+        Returns:
+            FrameLease: The buffer to decode a frame into
+        """
+        for _ in range(len(self.buffers)):
+            ind = self.next
+            self.next = (self.next + 1) % len(self.buffers)
+            lease = self.leases[ind]
+            if lease is None or lease() is None:
+                return self._lease(ind)
+        # every buffer is held by a consumer
+        ind = self.next
+        self.buffers.insert(ind, np.empty(self.nbytes, dtype=np.ubyte))
+        self.leases.insert(ind, None)
+        self.next = (ind + 1) % len(self.buffers)
+        return self._lease(ind)
+
+    def _lease(self, ind):
+        lease = self.buffers[ind].view(FrameLease)
+        self.leases[ind] = weakref.ref(lease)
+        return lease
+
+    def resize(self, nbytes):
+        """Reallocates the buffers when a frame does not fit in them.
+
+        The frames leased from the old buffers keep them alive.
+
+        Args:
+            nbytes (int): The size of the frame
+        """
+        self.nbytes = nbytes
+        self.buffers = [
+            np.empty(nbytes, dtype=np.ubyte) for _ in self.buffers
+        ]
+        self.leases = [None] * len(self.buffers)
+
+
+def decode_frames(decoder, access_unit, frame_pool, video_format='rgb24'):
+    """Decodes the frames of an access unit into the buffers of a pool.
+
+    Args:
+        decoder (libh264decoder.H264Decoder): The decoder of the stream
+        access_unit (bytes): The h264 data of a whole frame
+        frame_pool (FramePool): The pool the frames are decoded into
+        video_format (string): The output format of the decoder
+    Returns:
+        list: The decoded frames, views of the buffers of the pool
+    """
+    frames = []
+    data = memoryview(access_unit)
+    while len(data):
+        out = frame_pool.acquire()
+        try:
+            framedata, num_consumed = decoder.decode_frame_into(data, out)
+        except RuntimeError:
+            # the decoder cannot move ahead in the stream
+            break
+        data = data[num_consumed:]
+
+        (frame, w, h, ls) = framedata
+        if frame is not None:
+            if frame is not out:
+                # the frame did not fit, the decoder allocated it
+                frame_pool.resize(len(frame))
+            frames.append(frame_view(frame, w, h, ls, video_format))
+    return frames
+
+
+def frame_view(buffer, width, height, row_size, video_format='rgb24'):
+    """Returns the frame held in a buffer as an array, without copying.
+
+    Args:
+        buffer: The frame buffer, a numpy array, e.g. a FrameLease whose
+            views stay FrameLeases, or bytes
+        width (int): The width of the frame in pixels
+        height (int): The height of the frame in pixels
+        row_size (int): The number of bytes of a row, padding included
+        video_format (string): The output format of the decoder, one of
+            "rgb24", "bgr24", "gray" and "yuv420p"
+    Returns:
+        numpy.ndarray: A (height, width, 3) view for rgb24 and bgr24, a
+        (height, width) view for gray and a (height * 3 / 2, width) view of
+        the Y, U and V planes for yuv420p, the layout cv2 expects for I420
+    """
+    if video_format == 'yuv420p':
+        size = width * height * 3 // 2
+        frame = _flat(buffer, size)
+        return frame.reshape((height * 3 // 2, width))
+
+    frame = _flat(buffer, height * row_size)
+    if video_format == 'gray':
+        return frame.reshape((height, row_size))[:, :width]
+    return frame.reshape((height, row_size // 3, 3))[:, :width, :]
+
+
+def _flat(buffer, size):
+    """Returns the first size bytes of a buffer as a flat array."""
+    if isinstance(buffer, np.ndarray):
+        # slicing keeps the type and the base of a FrameLease
+        return buffer[:size]
+    return np.frombuffer(buffer, dtype=np.ubyte, count=size)
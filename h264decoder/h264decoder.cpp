@@ -1,6 +1,7 @@
 extern "C" {
 #include <libavcodec/avcodec.h>
 #include <libavutil/avutil.h>
+#include <libavutil/imgutils.h>
 #include <libavutil/mem.h>
 #include <libswscale/swscale.h>
 }
@@ -19,6 +20,8 @@ extern "C" {
 
 #include "h264decoder.hpp"
 #include <utility>
+#include <stdexcept>
+#include <tuple>
 
 typedef unsigned char ubyte;
 
@@ -103,55 +106,98 @@ const AVFrame& H264Decoder::decode_frame()
 }
 
 
-ConverterRGB24::ConverterRGB24()
+OutputStage::OutputStage()
+  : context(nullptr), format(OutputFormat::RGB24), target_w(0), target_h(0)
 {
-  framergb = av_frame_alloc();
-  if (!framergb)
+  frameout = av_frame_alloc();
+  if (!frameout)
     throw H264DecodeFailure("cannot allocate frame");
-  context = nullptr;
 }
 
-ConverterRGB24::~ConverterRGB24()
+OutputStage::~OutputStage()
 {
   sws_freeContext(context);
-  av_frame_free(&framergb);
+  av_frame_free(&frameout);
 }
 
 
-const AVFrame& ConverterRGB24::convert(const AVFrame &frame, ubyte* out_rgb)
+static AVPixelFormat pixel_format(OutputFormat format)
+{
+  switch (format)
+  {
+    case OutputFormat::BGR24:   return AV_PIX_FMT_BGR24;
+    case OutputFormat::GRAY8:   return AV_PIX_FMT_GRAY8;
+    case OutputFormat::YUV420P: return AV_PIX_FMT_YUV420P;
+    default:                    return PIX_FMT_RGB24;
+  }
+}
+
+
+void OutputStage::configure(OutputFormat format_, int w, int h)
+{
+  if (w < 0 || h < 0)
+    throw std::invalid_argument("output size must not be negative");
+  format = format_;
+  target_w = w;
+  target_h = h;
+}
+
+
+std::pair<int, int> OutputStage::output_size(int w, int h) const
+{
+  if (target_w > 0 && target_h > 0)
+    return std::make_pair(target_w, target_h);
+  return std::make_pair(w, h);
+}
+
+
+const AVFrame& OutputStage::convert(const AVFrame &frame, ubyte* out)
 {
   int w = frame.width;
   int h = frame.height;
   int pix_fmt = frame.format;
+  int out_w, out_h; std::tie(out_w, out_h) = output_size(w, h);
+  AVPixelFormat out_fmt = pixel_format(format);
   
+  // Setup frameout with out as external buffer in the output format.
+  av_image_fill_arrays(frameout->data, frameout->linesize, out, out_fmt,
+                       out_w, out_h, 1);
+  frameout->width = out_w;
+  frameout->height = out_h;
+
+  if (pix_fmt == out_fmt && out_w == w && out_h == h)
+  {
+    // Passthrough, the planes only need to be packed into out.
+    av_image_copy(frameout->data, frameout->linesize,
+                  const_cast<const uint8_t**>(frame.data), frame.linesize,
+                  out_fmt, w, h);
+    return *frameout;
+  }
+
   context = sws_getCachedContext(context, 
                                  w, h, (AVPixelFormat)pix_fmt, 
-                                 w, h, PIX_FMT_RGB24, SWS_BILINEAR, 
+                                 out_w, out_h, out_fmt, SWS_BILINEAR, 
                                  nullptr, nullptr, nullptr);
   if (!context)
     throw H264DecodeFailure("cannot allocate context");
   
-  // Setup framergb with out_rgb as external buffer. Also say that we want RGB24 output.
-  avpicture_fill((AVPicture*)framergb, out_rgb, PIX_FMT_RGB24, w, h);
   // Do the conversion.
   sws_scale(context, frame.data, frame.linesize, 0, h,
-            framergb->data, framergb->linesize);
-  framergb->width = w;
-  framergb->height = h;
-  return *framergb;
+            frameout->data, frameout->linesize);
+  return *frameout;
 }
 
 /*
 Determine required size of framebuffer.
 
-avpicture_get_size is used in http://dranger.com/ffmpeg/tutorial01.html 
-to do this. However, avpicture_get_size returns the size of a compact 
-representation, without padding bytes. Since we use avpicture_fill to 
-fill the buffer we should also use it to determine the required size.
+The buffer is filled by av_image_fill_arrays with an alignment of 1, i.e.
+a compact representation without padding bytes, so av_image_get_buffer_size
+with the same alignment gives the required size.
 */
-int ConverterRGB24::predict_size(int w, int h)
+int OutputStage::predict_size(int w, int h)
 {
-  return avpicture_fill((AVPicture*)framergb, nullptr, PIX_FMT_RGB24, w, h);  
+  int out_w, out_h; std::tie(out_w, out_h) = output_size(w, h);
+  return av_image_get_buffer_size(pixel_format(format), out_w, out_h, 1);
 }
 
 
@@ -75,24 +75,44 @@ bytes at frame boundaries.
   const AVFrame& decode_frame();
 };
 
-// TODO: Rename to OutputStage or so?!
-class ConverterRGB24
+/* Pixel formats the output stage can produce. YUV420P is the decoder's own
+format, the planes are copied without swscale unless a resize is requested. */
+enum class OutputFormat
+{
+  RGB24,
+  BGR24,
+  GRAY8,
+  YUV420P
+};
+
+/* Converts decoded frames to the configured pixel format and size. */
+class OutputStage
 {
   SwsContext *context;
-  AVFrame *framergb;
+  AVFrame *frameout;
+  OutputFormat format;
+  /* Target size, 0 keeps the size of the decoded frame. */
+  int target_w, target_h;
   
 public:
-  ConverterRGB24();
-  ~ConverterRGB24();
-   
-  /*  Returns, given a width and height, 
-      how many bytes the frame buffer is going to need. */
+  OutputStage();
+  ~OutputStage();
+
+  /*  Selects the pixel format and the size of the output. A zero width or 
+      height keeps the decoded size. Throws std::invalid_argument for
+      negative sizes. */
+  void configure(OutputFormat format, int w, int h);
+  /*  Returns, given the width and height of a decoded frame, the width and
+      height of the output frame. */
+  std::pair<int, int> output_size(int w, int h) const;
+  /*  Returns, given the width and height of a decoded frame, 
+      how many bytes the output frame buffer is going to need. */
   int predict_size(int w, int h);
-  /*  Given a decoded frame, convert it to RGB format and fill 
-out_rgb with the result. Returns a AVFrame structure holding 
-additional information about the RGB frame, such as the number of
+  /*  Given a decoded frame, convert it to the output format and fill 
+out with the result. Returns a AVFrame structure holding 
+additional information about the output frame, such as its size and the number of
 bytes in a row and so on. */
-  const AVFrame& convert(const AVFrame &frame, unsigned char* out_rgb);
+  const AVFrame& convert(const AVFrame &frame, unsigned char* out);
 };
 
 void disable_logging();
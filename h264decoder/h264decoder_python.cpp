@@ -2,15 +2,17 @@
 #include <cstdlib>
 #include <stdexcept>
 #include <cassert>
+#include <vector>
+#include <string>
 
-// python string api, see
-// https://docs.python.org/2/c-api/string.html
+// python bytes and buffer api, see
+// https://docs.python.org/3/c-api/bytes.html
+// https://docs.python.org/3/c-api/buffer.html
 extern "C" {
   #include <Python.h>
 }
 
 #include <boost/python.hpp>
-#include <boost/python/str.hpp>
 #include <boost/python/tuple.hpp>
 #include <boost/python/module.hpp>
 #include <boost/python/class.hpp>
@@ -23,7 +25,7 @@ using ubyte = unsigned char;
 
 class GILScopedReverseLock
 {
-  // see https://docs.python.org/2/c-api/init.html (Releasing the GIL ...)  
+  // see https://docs.python.org/3/c-api/init.html (Releasing the GIL ...)  
 public:
   GILScopedReverseLock() 
     : state(nullptr)
@@ -62,11 +64,41 @@ private:
 };
 
 
+/* Holds a buffer exported through the buffer protocol, e.g. by a numpy array,
+ * and releases it on destruction. Must be created and destroyed with the GIL held.
+ */
+class PyBufferView
+{
+public:
+  PyBufferView(PyObject *obj, int flags)
+  {
+    if (PyObject_GetBuffer(obj, &view, flags) < 0)
+      py::throw_error_already_set();
+  }
+
+  ~PyBufferView()
+  {
+    PyBuffer_Release(&view);
+  }
+
+  ubyte* data() const { return (ubyte*)view.buf; }
+  ssize_t size() const { return view.len; }
+
+  PyBufferView(const PyBufferView &) = delete;
+  PyBufferView operator=(const PyBufferView &) = delete;
+private:
+  Py_buffer view;
+};
+
+
 /* The class wrapped in python via boost::python */
 class PyH264Decoder
 {
   H264Decoder decoder;
-  ConverterRGB24 converter;
+  OutputStage converter;
+  /* Holds the converted frame while the GIL is released, when the caller supplied no buffer or a too
+   * small one. */
+  std::vector<ubyte> scratch;
 
   /* Extract frames from input stream. Stops at frame boundaries and returns the number of consumed bytes
    * in num_consumed.
@@ -76,65 +108,134 @@ class PyH264Decoder
    * 
    * Else, i.e. all data in the buffer is consumed, is_frame_available is set to false. The returned tuple
    * contains dummy data.
+   *
+   * The frame is converted into out_buffer, which belongs to the python object out, if it holds at least
+   * out_capacity bytes. Otherwise it is converted into the scratch buffer and copied to a new bytes object
+   * at the end. Pass nullptr and 0 to always return a new bytes object.
+   *
+   * Must be called with the GIL held. The GIL is released for the whole of parsing, decoding and
+   * conversion, so the input and output buffers must be exported through the buffer protocol, which
+   * keeps them alive and unresized.
    */ 
-  py::tuple decode_frame_impl(const ubyte *data, ssize_t num, ssize_t &num_consumed, bool &is_frame_available);
+  py::tuple decode_frame_impl(const ubyte *data, ssize_t num, ssize_t &num_consumed, bool &is_frame_available,
+                              PyObject *out, ubyte *out_buffer, ssize_t out_capacity);
   
 public:
   /* Decoding style analogous to c/c++ way. Stop at frame boundaries. 
-   * Return tuple containing frame data as above as nested tuple, and an integer telling how many bytes were consumed.  */
-  py::tuple decode_frame(const py::str &data_in_str);
+   * Return tuple containing frame data as above as nested tuple, and an integer telling how many bytes were consumed.
+   * data_in may be any contiguous bytes-like object, e.g. bytes, bytearray or memoryview. It is not copied. */
+  py::tuple decode_frame(const py::object &data_in);
   /* Process all the input data and return a list of all contained frames. */
-  py::list  decode(const py::str &data_in_str);
+  py::list  decode(const py::object &data_in);
+  /* Like decode_frame, but the frame is written into out, a writable object supporting the buffer
+   * protocol such as a numpy array, and out itself is returned in the frame tuple. No memory is
+   * allocated, unless out is too small for the frame, in which case a new bytes object is returned in
+   * its place. A frame that fails to decode is skipped, as in decode, and its tuple contains dummy data. */
+  py::tuple decode_frame_into(const py::object &data_in, const py::object &out);
+  /* Select the output of the following frames. format is one of "rgb24", "bgr24", "gray" and "yuv420p".
+   * The frames are scaled to width x height, unless any of them is 0. A yuv420p frame holds the Y, U
+   * and V planes one after the other and its row size is the width of the Y plane. */
+  void set_output(const std::string &format, int width, int height);
 };
 
 
-py::tuple PyH264Decoder::decode_frame_impl(const ubyte *data_in, ssize_t len, ssize_t &num_consumed, bool &is_frame_available)
+py::tuple PyH264Decoder::decode_frame_impl(const ubyte *data_in, ssize_t len, ssize_t &num_consumed, bool &is_frame_available,
+                                           PyObject *out, ubyte *out_buffer, ssize_t out_capacity)
 {
-  GILScopedReverseLock gilguard;
-  num_consumed = decoder.parse((ubyte*)data_in, len);
-  
-  if (is_frame_available = decoder.is_frame_available())
+  int w = 0, h = 0, ls = 0;
+  bool in_scratch = false;
   {
-    const auto &frame = decoder.decode_frame();
-    int w, h; std::tie(w,h) = width_height(frame);
-    Py_ssize_t out_size = converter.predict_size(w,h);
-
-    gilguard.lock();
-    //   Construction of py::handle causes ... TODO: WHAT? No increase of ref count ?!
-    py::object py_out_str(py::handle<>(PyString_FromStringAndSize(NULL, out_size)));
-    char* out_buffer = PyString_AsString(py_out_str.ptr());
-
-    gilguard.unlock();
-    const auto &rgbframe = converter.convert(frame, (ubyte*)out_buffer);
-    
-    gilguard.lock();
-    return py::make_tuple(py_out_str, w, h, row_size(rgbframe));
+    GILScopedReverseLock gilguard;
+    num_consumed = decoder.parse(data_in, len);
+
+    if (is_frame_available = decoder.is_frame_available())
+    {
+      const auto &frame = decoder.decode_frame();
+      int frame_w, frame_h; std::tie(frame_w, frame_h) = width_height(frame);
+      ssize_t out_size = converter.predict_size(frame_w, frame_h);
+
+      if (out_size > out_capacity)
+      {
+        // The caller supplied buffer cannot hold the frame.
+        scratch.resize(out_size);
+        out_buffer = scratch.data();
+        in_scratch = true;
+      }
+      const auto &outframe = converter.convert(frame, out_buffer);
+      std::tie(w,h) = width_height(outframe);
+      ls = row_size(outframe);
+    }
   }
-  else
-  {
-    gilguard.lock();
+
+  if (!is_frame_available)
     return py::make_tuple(py::object(), 0, 0, 0);
-  }
+
+  py::object py_out;
+  if (in_scratch)
+    py_out = py::object(py::handle<>(PyBytes_FromStringAndSize((const char*)scratch.data(), scratch.size())));
+  else
+    py_out = py::object(py::handle<>(py::borrowed(out)));
+  return py::make_tuple(py_out, w, h, ls);
 }
 
 
-py::tuple PyH264Decoder::decode_frame(const py::str &data_in_str)
+py::tuple PyH264Decoder::decode_frame(const py::object &data_in)
 {
-  ssize_t len = PyString_Size(data_in_str.ptr());
-  const ubyte* data_in = (const ubyte*)(PyString_AsString(data_in_str.ptr()));
+  PyBufferView in_view(data_in.ptr(), PyBUF_SIMPLE);
 
   ssize_t num_consumed = 0;
   bool is_frame_available = false;
-  auto frame = decode_frame_impl(data_in, len, num_consumed, is_frame_available);
+  auto frame = decode_frame_impl(in_view.data(), in_view.size(), num_consumed, is_frame_available, nullptr, nullptr, 0);
   
   return py::make_tuple(frame, num_consumed);
 }
 
 
-py::list PyH264Decoder::decode(const py::str &data_in_str)
+py::tuple PyH264Decoder::decode_frame_into(const py::object &data_in, const py::object &out)
+{
+  PyBufferView in_view(data_in.ptr(), PyBUF_SIMPLE);
+  PyBufferView out_view(out.ptr(), PyBUF_WRITABLE);
+
+  ssize_t num_consumed = 0;
+  bool is_frame_available = false;
+  try
+  {
+    auto frame = decode_frame_impl(in_view.data(), in_view.size(), num_consumed, is_frame_available,
+                                   out.ptr(), out_view.data(), out_view.size());
+    return py::make_tuple(frame, num_consumed);
+  }
+  catch (const H264DecodeFailure &e)
+  {
+    if (num_consumed <= 0)
+      // This case is fatal because we cannot continue to move ahead in the stream.
+      throw;
+    return py::make_tuple(py::make_tuple(py::object(), 0, 0, 0), num_consumed);
+  }
+}
+
+
+void PyH264Decoder::set_output(const std::string &format, int width, int height)
+{
+  OutputFormat output_format;
+  if (format == "rgb24")
+    output_format = OutputFormat::RGB24;
+  else if (format == "bgr24")
+    output_format = OutputFormat::BGR24;
+  else if (format == "gray")
+    output_format = OutputFormat::GRAY8;
+  else if (format == "yuv420p")
+    output_format = OutputFormat::YUV420P;
+  else
+    throw std::invalid_argument("unknown output format " + format);
+  converter.configure(output_format, width, height);
+}
+
+
+py::list PyH264Decoder::decode(const py::object &data_in)
 {
-  ssize_t len = PyString_Size(data_in_str.ptr());
-  const ubyte* data_in = (const ubyte*)(PyString_AsString(data_in_str.ptr()));
+  PyBufferView in_view(data_in.ptr(), PyBUF_SIMPLE);
+  ssize_t len = in_view.size();
+  const ubyte* data = in_view.data();
   
   py::list out;
   
@@ -147,7 +248,7 @@ py::list PyH264Decoder::decode(const py::str &data_in_str)
       
       try
       {
-        auto frame = decode_frame_impl(data_in, len, num_consumed, is_frame_available);
+        auto frame = decode_frame_impl(data, len, num_consumed, is_frame_available, nullptr, nullptr, 0);
         if (is_frame_available)
         {
           out.append(frame);
@@ -161,7 +262,7 @@ py::list PyH264Decoder::decode(const py::str &data_in_str)
       }
       
       len -= num_consumed;
-      data_in += num_consumed;
+      data += num_consumed;
     }
   }
   catch (const H264DecodeFailure &e)
@@ -174,9 +275,14 @@ py::list PyH264Decoder::decode(const py::str &data_in_str)
 
 BOOST_PYTHON_MODULE(libh264decoder)
 {
+#if PY_VERSION_HEX < 0x03070000
   PyEval_InitThreads(); // need for release of the GIL (http://stackoverflow.com/questions/8009613/boost-python-not-supporting-parallelism)
+#endif
   py::class_<PyH264Decoder>("H264Decoder")
                             .def("decode_frame", &PyH264Decoder::decode_frame)
-                            .def("decode", &PyH264Decoder::decode);
+                            .def("decode", &PyH264Decoder::decode)
+                            .def("decode_frame_into", &PyH264Decoder::decode_frame_into)
+                            .def("set_output", &PyH264Decoder::set_output,
+                                 (py::arg("format"), py::arg("width") = 0, py::arg("height") = 0));
   py::def("disable_logging", disable_logging);
 }
\ No newline at end of file
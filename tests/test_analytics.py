@@ -0,0 +1,81 @@
+import pytest
+
+from analytics import aggregate, summarize_directory, summarize_session
+
+
+def _write_session(path, lines):
+    with open(path, 'w') as f:
+        f.write('Sunday 18. October, 12:00\n\n' + '\n'.join(lines))
+    return str(path)
+
+
+def test_session_summary(tmp_path):
+    path = _write_session(tmp_path / 'session.txt', [
+        'command\t 0.0 0.1',
+        'forward 100\t 1.0 1.5',
+        'cw 90\t 2.0 2.2',
+        'go 30 40 0 50\t 3.0 3.4',
+        '# error flip l\t 4.0 4.3',
+        '# timeout left 50\t 5.0',
+    ])
+    summary = summarize_session(path)
+
+    assert summary['file'] == 'session.txt'
+    assert (summary['commands'], summary['ok'], summary['errors'],
+            summary['timeouts']) == (6, 4, 1, 1)
+    assert summary['error_rate'] == pytest.approx(2 / 6)
+    assert summary['duration'] == 5.0
+    # the failed flip and the timed out move are not flown
+    assert summary['distance'] == pytest.approx(150.0)
+    assert summary['rotation'] == 90.0
+    assert summary['rtt_mean'] == pytest.approx(1.5 / 5)
+    assert summary['rtt_p50'] == pytest.approx(0.3)
+    assert summary['rtt_max'] == pytest.approx(0.5)
+
+
+def test_not_a_session(tmp_path):
+    path = tmp_path / 'session.tses'
+    path.write_bytes(b'not a tses session file')
+
+    assert summarize_session(str(path)) is None
+
+
+def test_aggregate(tmp_path):
+    first = summarize_session(
+        _write_session(tmp_path / 'first.txt',
+                       ['forward 20\t 0.0 0.1', 'forward 20\t 1.0 1.2']))
+    second = summarize_session(
+        _write_session(tmp_path / 'second.txt',
+                       ['cw 90\t 0.0 2.25', '# timeout cw 90\t 3.0']))
+    total = aggregate([first, second])
+
+    assert total['sessions'] == 2
+    assert (total['commands'], total['ok'], total['timeouts']) == (4, 3, 1)
+    assert total['distance'] == 40.0
+    assert total['rtt_mean'] == pytest.approx(2.55 / 3)
+    assert total['rtt_max'] == 2.25
+    # the median lies in the bin of 0.2 s
+    assert 0.2 <= total['rtt_p50'] <= 0.25
+    # the bin edges above the maximum are capped by it
+    assert total['rtt_p90'] == total['rtt_p99'] == 2.25
+
+
+def test_aggregate_without_answers(tmp_path):
+    summary = summarize_session(
+        _write_session(tmp_path / 'session.txt', ['# timeout command\t 0.0']))
+    total = aggregate([summary])
+
+    assert total['rtt_mean'] is None
+    assert total['rtt_p99'] is None
+    assert total['rtt_max'] is None
+
+
+def test_directory_summaries_are_cached(tmp_path):
+    _write_session(tmp_path / 'session.txt', ['forward 20\t 0.0 0.1'])
+    (tmp_path / 'notes.md').write_text('not a session')
+    summaries, total = summarize_directory(str(tmp_path), workers=1)
+    cached, _ = summarize_directory(str(tmp_path), workers=1)
+
+    assert [summary['file'] for summary in summaries] == ['session.txt']
+    assert cached == summaries
+    assert total['commands'] == 1
@@ -0,0 +1,64 @@
+from command_queue import CommandQueue
+
+
+def _drain(commands):
+    return [commands.get(0) for _ in range(len(commands))]
+
+
+def test_moves_of_the_same_direction_are_coalesced():
+    commands = CommandQueue()
+    for command in ('forward 20', 'forward 20', 'forward 20', 'cw 90',
+                    'cw 90'):
+        commands.put(command)
+
+    assert _drain(commands) == ['forward 60', 'cw 180']
+    stats = commands.stats()
+    assert stats['enqueued'] == 5
+    assert stats['coalesced'] == 3
+    assert stats['dispatched'] == 2
+
+
+def test_coalescing_stays_within_the_limit():
+    commands = CommandQueue()
+    for command in ('up 300', 'up 150', 'up 100', 'cw 300', 'cw 100'):
+        commands.put(command)
+
+    assert _drain(commands) == ['up 450', 'up 100', 'cw 300', 'cw 100']
+
+
+def test_other_commands_are_not_coalesced():
+    commands = CommandQueue()
+    for command in ('forward 20', 'back 20', 'forward 20', 'battery?',
+                    'battery?', 'forward 20'):
+        commands.put(command)
+
+    assert _drain(commands) == ['forward 20', 'back 20', 'forward 20',
+                                'battery?', 'battery?', 'forward 20']
+
+
+def test_coalescing_can_be_disabled():
+    commands = CommandQueue(coalesce=False)
+    commands.put('forward 20')
+    commands.put('forward 20')
+
+    assert _drain(commands) == ['forward 20', 'forward 20']
+
+
+def test_dispatched_commands_are_not_coalesced_into():
+    commands = CommandQueue()
+    commands.put('forward 20')
+    assert commands.get(0) == 'forward 20'
+    commands.put('forward 20')
+
+    assert _drain(commands) == ['forward 20']
+
+
+def test_get_after_clear_and_close():
+    commands = CommandQueue()
+    commands.put('forward 20')
+    commands.clear()
+    assert commands.get(0) is None
+
+    commands.put('forward 20')
+    commands.close()
+    assert commands.get() is None
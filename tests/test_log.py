@@ -0,0 +1,179 @@
+import numpy as np
+import pytest
+
+from log import COMMAND_HISTORY, GO_LIMIT, Logger
+
+
+def test_received_matches_the_oldest_command():
+    log = Logger()
+    log.set_command_sent('command')
+    log.set_command_sent('battery?')
+
+    assert log.received('ok') is True
+    assert log.initialized
+    assert log.received('87') is True
+    assert log.battery == '87'
+    assert [cmd.command for cmd in log.command_tuples] == ['command',
+                                                           'battery?']
+
+
+def test_received_error():
+    log = Logger()
+    log.set_command_sent('takeoff')
+
+    assert log.received('error Not joystick') is False
+    assert not log.command_sent
+    assert not log.command_tuples
+
+
+def test_received_without_a_command_is_unmatched():
+    log = Logger()
+
+    assert log.received('ok') is None
+    assert log.unmatched == 1
+
+
+def test_late_response_is_not_credited_to_the_next_command():
+    log = Logger()
+    log.set_command_sent('forward 20')
+    log.reset()
+    log.set_command_sent('battery?')
+
+    # the late "ok" of the move cannot answer the query
+    assert log.received('ok') is None
+    assert log.late == 1
+    assert log.received('87') is True
+    assert log.battery == '87'
+
+
+def test_early_response_is_taken_for_a_late_one():
+    log = Logger()
+    log.min_rtt['forward'] = 10.0
+    log.set_command_sent('forward 20')
+    log.reset()
+    log.set_command_sent('forward 30')
+
+    # far sooner than forward 30 can be answered
+    assert log.received('ok') is None
+    assert log.late == 1
+    assert [cmd[1] for cmd in log.command_sent] == ['forward 30']
+
+
+def test_duplicate_response_to_a_resent_command():
+    log = Logger()
+    log.set_command_sent('forward 20')
+    log.resent()
+
+    assert log.received('ok') is True
+    assert log.received('ok') is None
+    assert log.duplicates == 1
+    assert not log.strays
+    # every expected copy was answered
+    assert log.received('ok') is None
+    assert log.unmatched == 1
+
+
+def test_strays_expire_after_the_window():
+    log = Logger(stray_window=-1.0)
+    log.set_command_sent('forward 20')
+    log.reset()
+
+    assert log.received('ok') is None
+    assert log.late == 0
+    assert log.unmatched == 1
+
+
+
+def test_session_without_a_journal_keeps_every_command(tmp_path):
+    log = Logger()
+    for _ in range(COMMAND_HISTORY + 1):
+        log.set_command_sent('battery?')
+        log.received('87')
+    path = str(tmp_path / 'session.txt')
+    log.save(path)
+
+    with open(path) as f:
+        lines = f.read().split('\n')
+    assert len(lines) == COMMAND_HISTORY + 3
+    assert lines[2].startswith('battery?\t ')
+
+
+def test_journal_snapshots_are_independent_files(tmp_path):
+    log = Logger(journal_path=str(tmp_path / 'journal.txt'))
+    log.set_command_sent('command')
+    log.received('ok')
+    first = str(tmp_path / 'first.txt')
+    log.save(first)
+    log.set_command_sent('takeoff')
+    log.received('ok')
+    second = str(tmp_path / 'second.txt')
+    log.save(second)
+    log.close()
+
+    with open(first) as f:
+        assert f.read().split('\n')[2:] == ['command\t {} {}'.format(
+            *log.command_tuples[0][1:])]
+    with open(second) as f:
+        assert len(f.read().split('\n')) == 4
+    with pytest.raises(ValueError):
+        log.save(str(tmp_path / 'third.txt'))
+
+
+def test_journal_of_a_session_never_connected_is_deleted(tmp_path):
+    path = tmp_path / 'journal.txt'
+    log = Logger(journal_path=str(path))
+    log.set_command_sent('command')
+    log.reset()
+    log.close()
+
+    assert not path.exists()
+
+
+def test_pose_follows_moves_and_rotations():
+    log = Logger()
+    for command in ('forward 100', 'cw 90', 'forward 50', 'up 30'):
+        log.update_pose(command)
+
+    np.testing.assert_allclose(log.pose, [100, -50, 30, -90], atol=1e-9)
+
+
+def test_pose_ignores_other_commands():
+    log = Logger()
+    for command in ('takeoff', 'battery?', 'forward x', 'speed 50'):
+        log.update_pose(command)
+
+    np.testing.assert_array_equal(log.pose, np.zeros(4))
+
+
+def test_pose_is_updated_by_executed_commands_only():
+    log = Logger()
+    log.set_command_sent('forward 100')
+    log.set_command_sent('left 50')
+    log.received('ok')
+    log.received('error')
+
+    np.testing.assert_allclose(log.pose, [100, 0, 0, 0])
+
+
+def test_return_route():
+    log = Logger()
+    for command in ('forward 100', 'cw 90', 'forward 50'):
+        log.update_pose(command)
+
+    assert log.reverse_path_cmd() == ['go -50 -100 0 50', 'ccw 90']
+
+
+def test_return_route_splits_long_distances():
+    log = Logger()
+    log.update_pose('forward {}'.format(2 * GO_LIMIT + 200))
+
+    route = log.reverse_path_cmd()
+    assert route == ['go -400 0 0 50'] * 3
+
+
+def test_return_route_close_to_the_start():
+    log = Logger()
+    log.update_pose('forward 10')
+    log.update_pose('ccw 45')
+
+    assert log.reverse_path_cmd() == ['cw 45']
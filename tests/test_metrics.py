@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from metrics import (NULL_HISTOGRAM, SUB_BUCKET_BITS, SUB_BUCKETS, Histogram,
+                     MetricsRegistry)
+
+RELATIVE_ERROR = 2.0**(1 - SUB_BUCKET_BITS)
+
+
+def test_every_value_falls_in_its_bucket():
+    units = np.unique(np.geomspace(1, 1e10, 2000).astype(int)).tolist()
+    indexes = [Histogram._index(value) for value in units]
+
+    assert indexes == sorted(indexes)
+    for value, index in zip(units, indexes):
+        low, high = Histogram._bounds(index)
+        assert low <= value <= high
+        if value >= SUB_BUCKETS:
+            assert high - low + 1 <= value * RELATIVE_ERROR
+
+
+def test_small_values_are_exact():
+    for units in range(SUB_BUCKETS):
+        assert Histogram._bounds(Histogram._index(units)) == (units, units)
+
+
+def test_percentiles_are_within_the_relative_error():
+    histogram = Histogram('rtt')
+    values = np.arange(1, 10001) * 1e-3
+    for value in values:
+        histogram.record(value)
+
+    for percentile in (50, 90, 99, 99.9):
+        expected = np.percentile(values, percentile)
+        assert histogram.percentile(percentile) == pytest.approx(
+            expected, rel=RELATIVE_ERROR)
+    assert histogram.percentile(100) == histogram.max == 10.0
+    assert histogram.percentile(0) == pytest.approx(1e-3, rel=RELATIVE_ERROR)
+
+
+def test_percentiles_stay_within_the_recorded_range():
+    histogram = Histogram('rtt')
+    histogram.record(0.1005)
+
+    assert histogram.percentile(50) == 0.1005
+
+
+def test_out_of_range_values():
+    histogram = Histogram('rtt', highest=1.0)
+    histogram.record(-1.0)
+    histogram.record(5.0)
+
+    assert histogram.counts[0] == 1
+    assert histogram.counts[-1] == 1
+    assert histogram.min == -1.0
+    assert histogram.max == 5.0
+
+
+def test_snapshot_and_reset():
+    histogram = Histogram('rtt')
+    assert histogram.percentile(50) is None
+    histogram.record(0.25)
+    histogram.record(0.75)
+
+    snapshot = histogram.snapshot()
+    assert (snapshot['count'], snapshot['sum'], snapshot['mean']) == (2, 1.0,
+                                                                      0.5)
+    assert list(snapshot) == ['count', 'sum', 'min', 'mean', 'p50', 'p90',
+                              'p99', 'p99.9', 'max']
+
+    histogram.reset()
+    assert histogram.snapshot()['count'] == 0
+    assert not any(histogram.counts)
+
+
+def test_registry():
+    registry = MetricsRegistry()
+    assert registry.histogram('rtt') is registry.histogram('rtt')
+    registry.histogram('rtt').record(0.5)
+    registry.counter('timeouts').increment()
+
+    snapshot = registry.snapshot()
+    assert snapshot['histograms']['rtt']['count'] == 1
+    assert snapshot['counters'] == {'timeouts': 1}
+    assert 'rtt{quantile="0.5"} 0.5' in registry.to_text()
+
+
+def test_disabled_registry_records_nothing():
+    registry = MetricsRegistry(enabled=False)
+    registry.histogram('rtt').record(0.5)
+    registry.counter('timeouts').increment()
+
+    assert registry.histogram('rtt') is NULL_HISTOGRAM
+    assert registry.snapshot() == {'histograms': {}, 'counters': {}}
@@ -0,0 +1,110 @@
+import struct
+
+import pytest
+
+from packet_source import (DEFAULT_FPS, LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL,
+                           LINKTYPE_NULL, LINKTYPE_RAW, VIDEO_PORT,
+                           H264FileSource, PcapSource, _access_units,
+                           _udp_payload)
+from video import PACKET_SIZE
+
+SPS = b'\x00\x00\x00\x01\x67' + b'\x11' * 8
+PPS = b'\x00\x00\x00\x01\x68' + b'\x22' * 4
+AUD = b'\x00\x00\x01\x09\xf0'
+
+
+def _slice(nal_type, first, size=16):
+    # first_mb_in_slice 0 is the single bit 1, 1 is the bits 010
+    return (b'\x00\x00\x01' + bytes([nal_type, 0x80 if first else 0x40]) +
+            b'\x33' * size)
+
+
+def _units(data):
+    return [data[start:end] for start, end in _access_units(data)]
+
+
+def test_access_units_group_the_nal_units_of_a_picture():
+    first = SPS + PPS + _slice(5, True) + _slice(5, False)
+    second = _slice(1, True) + _slice(1, False)
+    third = AUD + _slice(1, True)
+
+    assert _units(first + second + third) == [first, second, third]
+
+
+def test_access_unit_ends_before_a_prefix_nal_unit():
+    first = _slice(1, True)
+    second = SPS + PPS + _slice(5, True)
+
+    assert _units(first + second) == [first, second]
+
+
+def test_stream_without_slices():
+    assert _units(SPS + PPS) == [SPS + PPS]
+    assert _units(b'') == []
+
+
+def _udp(payload, port=VIDEO_PORT, protocol=17):
+    udp = struct.pack('!HHHH', 62512, port, 8 + len(payload), 0) + payload
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 0, 0, 64,
+                     protocol, 0, bytes([192, 168, 10, 1]),
+                     bytes([192, 168, 10, 2]))
+    return ip + udp
+
+
+def test_udp_payload_of_every_link_type():
+    packet = _udp(b'h264')
+    ethernet = b'\x00' * 12 + b'\x08\x00' + packet
+    linux_sll = b'\x00' * 14 + b'\x08\x00' + packet
+    loopback = b'\x02\x00\x00\x00' + packet
+
+    assert _udp_payload(ethernet, LINKTYPE_ETHERNET, VIDEO_PORT) == b'h264'
+    assert _udp_payload(linux_sll, LINKTYPE_LINUX_SLL, VIDEO_PORT) == b'h264'
+    assert _udp_payload(loopback, LINKTYPE_NULL, VIDEO_PORT) == b'h264'
+    assert _udp_payload(packet, LINKTYPE_RAW, VIDEO_PORT) == b'h264'
+
+
+def test_other_packets_have_no_payload():
+    # another port, tcp, IPv6 and a truncated frame
+    assert _udp_payload(_udp(b'h264', port=8890), LINKTYPE_RAW,
+                        VIDEO_PORT) is None
+    assert _udp_payload(_udp(b'h264', protocol=6), LINKTYPE_RAW,
+                        VIDEO_PORT) is None
+    assert _udp_payload(b'\x00' * 12 + b'\x86\xdd' + _udp(b'h264'),
+                        LINKTYPE_ETHERNET, VIDEO_PORT) is None
+    assert _udp_payload(b'\x45' * 10, LINKTYPE_RAW, VIDEO_PORT) is None
+
+    with pytest.raises(ValueError):
+        _udp_payload(_udp(b'h264'), 105, VIDEO_PORT)
+
+
+def test_pcap_source(tmp_path):
+    path = str(tmp_path / 'capture.pcap')
+    frames = [(10, 500000, _udp(b'first')), (10, 750000,
+                                              _udp(b'other', port=8890)),
+              (11, 0, _udp(b'second'))]
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535,
+                            LINKTYPE_RAW))
+        for seconds, micros, frame in frames:
+            f.write(struct.pack('<IIII', seconds, micros, len(frame),
+                                len(frame)))
+            f.write(frame)
+
+    assert list(PcapSource(path).packets()) == [(10.5, b'first'),
+                                                (11.0, b'second')]
+
+
+def test_h264_file_source_splits_access_units(tmp_path):
+    first = SPS + PPS + _slice(5, True, size=2 * PACKET_SIZE)
+    second = _slice(1, True)
+    path = tmp_path / 'stream.h264'
+    path.write_bytes(first + second)
+
+    packets = [(stamp, bytes(packet))
+               for stamp, packet in H264FileSource(str(path)).packets()]
+    assert [stamp for stamp, _ in packets] == [0.0] * 3 + [1 / DEFAULT_FPS]
+    assert [len(packet) for _, packet in packets[:3]] == [
+        PACKET_SIZE, PACKET_SIZE, len(first) - 2 * PACKET_SIZE
+    ]
+    assert b''.join(packet for _, packet in packets[:3]) == first
+    assert packets[3][1] == second
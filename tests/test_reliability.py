@@ -0,0 +1,98 @@
+import pytest
+
+from reliability import (AT_LEAST_ONCE, AT_MOST_ONCE, PendingCommand,
+                         Retransmitter, RtoEstimator, is_idempotent)
+
+
+def test_initial_timeout():
+    estimator = RtoEstimator(initial=0.5)
+
+    assert estimator.srtt is None
+    assert estimator.rto == 0.5
+
+
+def test_first_sample():
+    estimator = RtoEstimator()
+    estimator.sample(0.1)
+
+    assert estimator.srtt == pytest.approx(0.1)
+    assert estimator.rttvar == pytest.approx(0.05)
+    # srtt + 4 * rttvar
+    assert estimator.rto == pytest.approx(0.3)
+
+
+def test_following_samples():
+    estimator = RtoEstimator()
+    estimator.sample(0.1)
+    estimator.sample(0.2)
+
+    # rttvar is updated with the srtt before the sample
+    assert estimator.rttvar == pytest.approx(0.75 * 0.05 + 0.25 * 0.1)
+    assert estimator.srtt == pytest.approx(0.875 * 0.1 + 0.125 * 0.2)
+    assert estimator.samples == 2
+
+
+def test_timeout_is_bounded():
+    estimator = RtoEstimator(minimum=0.02, maximum=1.0)
+    for _ in range(100):
+        estimator.sample(0.001)
+    assert estimator.rto == 0.02
+
+    estimator.sample(5.0)
+    assert estimator.rto == 1.0
+
+
+def test_timeout_backs_off():
+    estimator = RtoEstimator(initial=0.5, maximum=3.0)
+
+    assert [estimator.timeout(ind) for ind in range(4)] == [0.5, 1.0, 2.0,
+                                                            3.0]
+
+
+def test_idempotent_commands():
+    assert is_idempotent('battery?')
+    assert is_idempotent('speed 50')
+    assert is_idempotent('command')
+    assert not is_idempotent('forward 20')
+    assert not is_idempotent('takeoff')
+
+
+def test_queries_are_resent_with_backoff():
+    retransmitter = Retransmitter(max_retransmissions=2)
+    rto = retransmitter.rto.rto
+
+    assert retransmitter.retransmit_at('battery?', 10.0, 1) == 10.0 + rto
+    assert retransmitter.retransmit_at('battery?', 10.0, 2) == pytest.approx(
+        10.0 + 2 * rto)
+    assert retransmitter.retransmit_at('battery?', 10.0, 3) is None
+
+
+def test_moves_follow_the_policy():
+    assert Retransmitter(AT_MOST_ONCE).retransmit_at('forward 20', 0.0,
+                                                     1) is None
+    at_least_once = Retransmitter(AT_LEAST_ONCE)
+    assert at_least_once.retransmit_at(
+        'forward 20', 0.0, 1) == at_least_once.move_rto.rto
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Retransmitter('exactly_once')
+
+
+def test_only_commands_sent_once_are_sampled():
+    retransmitter = Retransmitter()
+    query = PendingCommand('battery?', None, 5.0, 1.0, None)
+    move = PendingCommand('forward 20', None, 5.0, 1.0, None)
+    resent = PendingCommand('battery?', None, 5.0, 1.0, None)
+    resent.sends = 2
+    retransmitter.answered(query, 1.1)
+    retransmitter.answered(move, 3.0)
+    retransmitter.answered(resent, 1.5)
+
+    assert retransmitter.rto.samples == 1
+    assert retransmitter.rto.srtt == pytest.approx(0.1)
+    assert retransmitter.move_rto.srtt == pytest.approx(2.0)
+    assert retransmitter.recovered == 1
+    assert retransmitter.quiet_period(query) == retransmitter.rto.rto
+    assert retransmitter.quiet_period(move) == retransmitter.move_rto.rto
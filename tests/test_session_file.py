@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from log import iter_session
+from session_file import (ERROR, OK, TIMEOUT, SessionFile, read_text_session,
+                          write_session_file, write_text_session)
+from telemetry import STATE_FIELDS
+
+STATE = [float(ind) / 4 for ind in range(len(STATE_FIELDS))]
+TEXT = '\n'.join([
+    'Sunday 18. October, 12:00',
+    '',
+    'command\t 0.5 0.75',
+    '# state\t 1.0 ' + ' '.join(map(str, STATE)),
+    'takeoff\t 1.25 3.5',
+    '# error flip l\t 4.0 4.25',
+    '# timeout forward 20\t 5.0',
+    'forward 20\t 6.0 6.5',
+])
+
+
+def _write_text(path, text=TEXT):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_text_session_is_parsed(tmp_path):
+    path = str(tmp_path / 'session.txt')
+    _write_text(path)
+    starting_time, commands, states = read_text_session(path)
+
+    assert starting_time == 'Sunday 18. October, 12:00'
+    assert commands[:3] == [('command', 0.5, 0.75, OK),
+                            ('takeoff', 1.25, 3.5, OK),
+                            ('flip l', 4.0, 4.25, ERROR)]
+    assert commands[3][0] == 'forward 20'
+    assert commands[3][3] == TIMEOUT
+    assert np.isnan(commands[3][2])
+    assert states == [(1.0, STATE)]
+
+
+def test_tses_round_trip(tmp_path):
+    txt = str(tmp_path / 'session.txt')
+    tses = str(tmp_path / 'session.tses')
+    _write_text(txt)
+    starting_time, commands, states = read_text_session(txt)
+    write_session_file(tses, starting_time, commands, states)
+
+    session = SessionFile(tses)
+    assert session.starting_time == starting_time
+    assert len(session) == len(commands)
+    for ind, (command, stime, rtime, kind) in enumerate(commands):
+        assert session.command(ind) == command
+        assert session[ind][1] == stime
+        assert session[ind][3] == kind
+        np.testing.assert_equal(session[ind][2], rtime)
+    assert session.find(1.25) == 1
+    assert session.state_at(0.5) is None
+    assert list(session.state_at(2.0))[1:] == STATE
+
+
+def test_txt_tses_txt_round_trip(tmp_path):
+    txt = str(tmp_path / 'session.txt')
+    tses = str(tmp_path / 'session.tses')
+    copy = str(tmp_path / 'copy.txt')
+    _write_text(txt)
+    write_session_file(tses, *read_text_session(txt))
+    write_text_session(copy, SessionFile(tses))
+
+    with open(copy) as f:
+        assert f.read() == TEXT
+
+
+def test_both_formats_replay_the_same_commands(tmp_path):
+    txt = str(tmp_path / 'session.txt')
+    tses = str(tmp_path / 'session.tses')
+    _write_text(txt)
+    write_session_file(tses, *read_text_session(txt))
+
+    assert list(iter_session(txt)) == list(iter_session(tses))
+
+
+def test_truncated_tses_file(tmp_path):
+    txt = str(tmp_path / 'session.txt')
+    tses = str(tmp_path / 'session.tses')
+    _write_text(txt)
+    write_session_file(tses, *read_text_session(txt))
+    with open(tses, 'rb') as f:
+        data = f.read()
+
+    for size in (4, len(data) - 4):
+        truncated = str(tmp_path / 'truncated.tses')
+        with open(truncated, 'wb') as f:
+            f.write(data[:size])
+        with pytest.raises(ValueError):
+            SessionFile(truncated)
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from telemetry import (INITIAL_SAMPLES, STATE_FIELDS, TelemetryHistory,
+                       TelemetryReceiver)
+
+STATE = (b'pitch:1;roll:-2;yaw:3;vgx:0;vgy:0;vgz:0;templ:60;temph:62;tof:10;'
+         b'h:0;bat:87;baro:12.34;time:5;agx:-2.00;agy:1.00;agz:-999.00;\r\n')
+
+
+def test_state_is_parsed():
+    telemetry = TelemetryReceiver(None)
+    telemetry.parse(STATE)
+
+    assert telemetry.snapshot() == dict(
+        zip(STATE_FIELDS, [1.0, -2.0, 3.0, 0.0, 0.0, 0.0, 60.0, 62.0, 10.0,
+                           0.0, 87.0, 12.34, 5.0, -2.0, 1.0, -999.0]))
+    assert telemetry.received == 1
+
+
+def test_state_is_parsed_in_the_receive_buffer():
+    telemetry = TelemetryReceiver(None)
+    # the rest of the buffer holds an older, longer datagram
+    telemetry.buffer[:len(STATE) + 8] = STATE + b'bat:10;\n'
+    telemetry.parse(telemetry.buffer, len(STATE))
+
+    assert telemetry.get('bat') == 87.0
+    assert telemetry.get('agz') == -999.0
+
+
+def test_unknown_and_malformed_fields():
+    telemetry = TelemetryReceiver(None)
+    telemetry.parse(b'pitch:x;bat:50;mpry:0,0,0;\r\n')
+
+    assert np.isnan(telemetry.get('pitch'))
+    assert telemetry.get('bat') == 50.0
+    assert np.isnan(telemetry.get('yaw'))
+
+
+def test_readers_see_the_previous_record_while_parsing():
+    telemetry = TelemetryReceiver(None)
+    telemetry.parse(b'bat:80;')
+    first = telemetry.state
+    telemetry.parse(b'bat:79;')
+
+    assert first[STATE_FIELDS.index('bat')] == 80.0
+    assert telemetry.get('bat') == 79.0
+
+
+def _state(bat):
+    state = np.zeros(len(STATE_FIELDS))
+    state[STATE_FIELDS.index('bat')] = bat
+    return state
+
+
+def _history(stamps, seconds, rate=1):
+    history = TelemetryHistory(seconds=seconds, rate=rate)
+    for stamp in stamps:
+        history.append(stamp, _state(100 - stamp))
+    return history
+
+
+def test_history_grows_until_its_capacity():
+    history = _history(range(INITIAL_SAMPLES + 100), INITIAL_SAMPLES * 3)
+
+    assert history.columns.shape[1] == INITIAL_SAMPLES * 2
+    assert len(history) == INITIAL_SAMPLES + 100
+    np.testing.assert_array_equal(history.column('stamp'),
+                                  np.arange(INITIAL_SAMPLES + 100))
+
+
+def test_history_overwrites_the_oldest_samples():
+    history = _history(range(8), seconds=1, rate=5)
+
+    assert history.columns.shape[1] == 5
+    assert len(history) == 5
+    np.testing.assert_array_equal(history.column('stamp'), [3, 4, 5, 6, 7])
+    np.testing.assert_array_equal(history.column('bat'), [97, 96, 95, 94, 93])
+    assert history.latest_stamp() == 7
+
+
+def test_between_spans_the_wraparound():
+    history = _history(range(8), seconds=1, rate=5)
+
+    samples = history.between(3.5, 6.5)
+    np.testing.assert_array_equal(samples['stamp'], [4, 5, 6])
+    np.testing.assert_array_equal(samples['bat'], [96, 95, 94])
+    assert not history.between(10, 20)['stamp'].size
+
+
+def test_window_of_the_latest_samples():
+    history = _history(range(8), seconds=1, rate=5)
+
+    # the samples of 5, 6 and 7
+    assert history.window('bat', 2) == (94.0, 93.0, 95.0)
+
+
+def test_battery_drain():
+    history = TelemetryHistory(seconds=100)
+    for stamp in range(60):
+        history.append(stamp, _state(100 - stamp / 30))
+
+    assert history.battery_drain(60) == pytest.approx(2.0)
+
+
+def test_empty_history():
+    history = TelemetryHistory()
+
+    assert len(history) == 0
+    assert np.isnan(history.latest_stamp())
+    assert all(np.isnan(value) for value in history.window('bat', 10))
+    assert np.isnan(history.battery_drain())
@@ -0,0 +1,137 @@
+import numpy as np
+
+from video import PACKET_SIZE, AccessUnitAssembler, FramePool, frame_view
+
+
+def _packets(access_unit):
+    """Splits an access unit into packets the way tello does."""
+    return [access_unit[ind:ind + PACKET_SIZE]
+            for ind in range(0, len(access_unit), PACKET_SIZE)]
+
+
+def _access_unit(size, fill):
+    return b'\x00\x00\x00\x01' + bytes([fill]) * (size - 4)
+
+
+def _assembler(**kwargs):
+    units = []
+    return AccessUnitAssembler(units.append, **kwargs), units
+
+
+def test_access_unit_ends_with_a_short_packet():
+    assembler, units = _assembler()
+    unit = _access_unit(3 * PACKET_SIZE + 100, 1)
+    for packet in _packets(unit):
+        assembler.feed(packet)
+
+    assert units == [unit]
+    assert assembler.stats() == {
+        'packets': 4,
+        'bytes': len(unit),
+        'access_units': 1,
+        'discarded': 0
+    }
+
+
+def test_exact_multiple_ends_with_the_next_start_code():
+    assembler, units = _assembler()
+    first = _access_unit(2 * PACKET_SIZE, 1)
+    second = _access_unit(100, 2)
+    for packet in _packets(first):
+        assembler.feed(packet)
+    assert units == []
+
+    assembler.feed(second)
+    assert units == [first, second]
+
+
+def test_packets_before_the_first_start_code_are_skipped():
+    assembler, units = _assembler()
+    unit = _access_unit(PACKET_SIZE + 100, 1)
+    assembler.feed(b'\x05' * PACKET_SIZE)
+    for packet in _packets(unit):
+        assembler.feed(packet)
+
+    assert units == [unit]
+    assert assembler.discarded == 0
+
+
+def test_lost_first_packet_discards_the_access_unit():
+    assembler, units = _assembler()
+    first = _access_unit(100, 1)
+    second = _access_unit(3 * PACKET_SIZE + 100, 2)
+    third = _access_unit(100, 3)
+    assembler.feed(first)
+    for packet in _packets(second)[1:]:
+        assembler.feed(packet)
+    assembler.feed(third)
+
+    assert units == [first, third]
+    assert assembler.discarded == 1
+
+
+def test_lost_last_packet_discards_the_access_unit():
+    assembler, units = _assembler(max_size=4 * PACKET_SIZE)
+    lost = _access_unit(3 * PACKET_SIZE + 100, 1)
+    # the short packet closing the access unit never arrives
+    for packet in _packets(lost)[:-1]:
+        assembler.feed(packet)
+    # nor do the start codes, so the buffer outgrows max_size
+    for _ in range(2):
+        assembler.feed(b'\x05' * PACKET_SIZE)
+    unit = _access_unit(100, 2)
+    assembler.feed(unit)
+
+    assert units == [unit]
+    assert assembler.discarded == 1
+
+
+def test_buffers_are_reused_once_their_frames_are_gone():
+    pool = FramePool(size=2, nbytes=12)
+    first = pool.acquire()
+    first_base = first.base
+    del first
+    pool.acquire()
+
+    assert pool.acquire().base is first_base
+    assert len(pool.buffers) == 2
+
+
+def test_buffers_held_by_frame_views_are_not_reused():
+    pool = FramePool(size=2, nbytes=12)
+    frames = [frame_view(pool.acquire(), 2, 2, 6) for _ in range(2)]
+    held = {id(frame.base.base) for frame in frames}
+    # views of views keep the lease alive too
+    rows = [np.asarray(frame)[0] for frame in frames]
+    del frames
+
+    lease = pool.acquire()
+    assert id(lease.base) not in held
+    assert len(pool.buffers) == 3
+
+    del rows
+    pool.acquire()
+    assert len(pool.buffers) == 3
+
+
+def test_resize_keeps_the_leased_frames():
+    pool = FramePool(size=2, nbytes=12)
+    lease = pool.acquire()
+    lease[:] = 7
+    pool.resize(48)
+
+    assert len(pool.acquire()) == 48
+    assert (lease == 7).all()
+
+
+def test_frame_views():
+    buffer = np.arange(2 * 9, dtype=np.ubyte)
+
+    # rows of 9 bytes padding 2 rgb pixels
+    rgb = frame_view(buffer, 2, 2, 9)
+    assert rgb.shape == (2, 2, 3)
+    assert rgb[1, 1].tolist() == [12, 13, 14]
+    gray = frame_view(buffer, 6, 2, 9, 'gray')
+    assert gray.shape == (2, 6)
+    yuv = frame_view(bytes(buffer), 4, 2, 4, 'yuv420p')
+    assert yuv.shape == (3, 4)
@@ -0,0 +1,61 @@
+"""Drives many AsyncTello clients from one event loop against local UDP
+stand-in drones and reports the command throughput.
+
+Usage: python bench_async_drones.py [num_drones] [commands_per_drone]
+"""
+import os
+import sys
+import asyncio
+import threading
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+from async_tello import AsyncTello  # noqa: E402
+
+FIRST_PORT = 20000
+
+
+class StandInDrone(asyncio.DatagramProtocol):
+    """Answers every command with "ok"."""
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.transport.sendto(b'ok', address)
+
+
+async def control_loop(drone, num_commands):
+    await drone.initialize()
+    for ind in range(num_commands):
+        await drone.send_command('up 20' if ind % 2 else 'down 20',
+                                 reverse=True)
+
+
+async def main(num_drones, num_commands):
+    loop = asyncio.get_running_loop()
+    drones = []
+    for ind in range(num_drones):
+        await loop.create_datagram_endpoint(
+            StandInDrone, local_addr=('127.0.0.1', FIRST_PORT + ind))
+        drone = AsyncTello(tello_ip='127.0.0.1',
+                           cmd_port=FIRST_PORT + ind,
+                           state_port=None)
+        await drone.connect()
+        drones.append(drone)
+
+    start = perf_counter()
+    await asyncio.gather(*(control_loop(d, num_commands) for d in drones))
+    elapsed = perf_counter() - start
+
+    total = num_drones * (num_commands + 2)
+    print('{} drones, {} commands in {:.3f} s ({:.0f} commands/s, '
+          '{} threads)'.format(num_drones, total, elapsed, total / elapsed,
+                               threading.active_count()))
+    for drone in drones:
+        drone.close()
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.run(main(*(args + [50, 200][len(args):])))
@@ -0,0 +1,67 @@
+"""Micro-benchmark of the command round-trip latency of Tello.send_command.
+
+A local TelloSimulator answers the commands without any added latency, so
+the measured time is the overhead of the client handshake on top of the
+loopback RTT. With a loss probability, the simulator drops commands and
+responses, and the tail latency shows the cost of recovering them.
+
+Usage: python bench_command_latency.py [num_commands] [loss]
+"""
+import os
+import sys
+import socket
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+from tello import Tello  # noqa: E402
+from simulator import TelloSimulator  # noqa: E402
+
+SIMULATOR_ADDRESS = ('127.0.0.1', 18889)
+
+
+def summarize(name, samples):
+    samples = np.asarray(samples) * 1e6
+    print('{:<14} mean {:8.1f} us   p50 {:8.1f} us   p99 {:8.1f} us'.format(
+        name, samples.mean(), np.percentile(samples, 50),
+        np.percentile(samples, 99)))
+
+
+def main(num_commands, loss):
+    simulator = TelloSimulator(*SIMULATOR_ADDRESS).start()
+
+    # raw loopback round trip, the lower bound of any client
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    raw = []
+    for _ in range(num_commands):
+        start = perf_counter()
+        client.sendto(b'command', SIMULATOR_ADDRESS)
+        client.recvfrom(1024)
+        raw.append(perf_counter() - start)
+    client.close()
+
+    tello = Tello(tello_ip=SIMULATOR_ADDRESS[0],
+                  cmd_port=SIMULATOR_ADDRESS[1],
+                  local_cmd_port=0,
+                  session_dir=None)
+    tello.send_command('command')
+    # the raw round trip above is measured without loss
+    simulator.loss = loss
+    rtts = []
+    for _ in range(num_commands):
+        start = perf_counter()
+        tello.send_command('battery?', reverse=True)
+        rtts.append(perf_counter() - start)
+
+    print('{} commands'.format(num_commands))
+    summarize('raw udp', raw)
+    summarize('send_command', rtts)
+    if loss:
+        print('loss {:.0%}: {}'.format(loss, tello.get_reliability_stats()))
+    simulator.stop()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 0.0)
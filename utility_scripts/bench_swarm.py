@@ -0,0 +1,56 @@
+"""Controls a swarm of local TelloSimulators, each on a loopback ip of its
+own, from a single Swarm and reports the round trip times per drone.
+
+Usage: python bench_swarm.py [num_drones] [rounds] [loss]
+"""
+import os
+import sys
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+from swarm import Swarm  # noqa: E402
+from simulator import TelloSimulator  # noqa: E402
+
+CMD_PORT = 18889
+STATE_PORT = 18890
+
+
+def main(num_drones, rounds, loss):
+    ips = ['127.0.0.{}'.format(ind + 2) for ind in range(num_drones)]
+    simulators = [
+        TelloSimulator(ip, cmd_port=CMD_PORT, state_port=STATE_PORT,
+                       loss=loss).start() for ip in ips
+    ]
+    swarm = Swarm(ips, cmd_port=CMD_PORT, state_port=STATE_PORT,
+                  local_cmd_port=0, host='127.0.0.1')
+
+    print('initialized {} of {}'.format(sum(swarm.initialize().values()),
+                                        num_drones))
+    swarm.broadcast('takeoff')
+    start = perf_counter()
+    for ind in range(rounds):
+        swarm.broadcast('battery?')
+    elapsed = perf_counter() - start
+    print('{} broadcasts to {} drones in {:.3f} s ({:.0f} commands/s)'.format(
+        rounds, num_drones, elapsed, rounds * num_drones / elapsed))
+
+    # let a few states arrive
+    sleep(0.3)
+    print('{:<11} {:>6} {:>9} {:>9} {:>9} {:>7} {:>7}'.format(
+        'drone', 'cmds', 'p50 us', 'p99 us', 'max us', 'resent', 'height'))
+    for ip, stats in swarm.get_latency_stats().items():
+        state = swarm.get_state(ip)
+        print('{:<11} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>7} {:>7}'.format(
+            ip, stats['answered'], stats['p50'] * 1e6, stats['p99'] * 1e6,
+            stats['max'] * 1e6, stats['retransmitted'],
+            state['h'] if state else '-'))
+
+    swarm.close()
+    for simulator in simulators:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 200,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 0.0)
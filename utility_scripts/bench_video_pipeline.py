@@ -0,0 +1,82 @@
+"""Measures the frame rate and per-stage latency of the Tello video
+pipeline on a recorded stream, without a drone.
+
+The recording is a raw h264 file (with the .idx index written by
+StreamRecorder, if any) or a pcap capture of the udp traffic to port 11111.
+
+Usage: python bench_video_pipeline.py recording.h264|capture.pcap [--realtime]
+"""
+import os
+import sys
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+from tello import Tello  # noqa: E402
+from video import AccessUnitAssembler  # noqa: E402
+from packet_source import H264FileSource, PcapSource  # noqa: E402
+
+
+def make_source(path, realtime):
+    if path.endswith(('.pcap', '.cap')):
+        return PcapSource(path, realtime)
+    return H264FileSource(path, realtime)
+
+
+def summarize(name, samples, unit=1e3, label='ms'):
+    samples = np.asarray(samples) * unit
+    print('{:<12} mean {:8.3f} {}   p50 {:8.3f} {}   p99 {:8.3f} {}'.format(
+        name, samples.mean(), label, np.percentile(samples, 50), label,
+        np.percentile(samples, 99), label))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path')
+    parser.add_argument('--realtime', action='store_true',
+                        help='honor the recorded timestamps')
+    args = parser.parse_args()
+
+    # reassembly stage alone
+    access_units = []
+    assembler = AccessUnitAssembler(access_units.append)
+    source = make_source(args.path, realtime=False)
+    packet_times = []
+    while True:
+        start = perf_counter()
+        if not source.receive(assembler):
+            break
+        packet_times.append(perf_counter() - start)
+    print('{} packets, {} access units, {} discarded'.format(
+        assembler.packets, assembler.access_units, assembler.discarded))
+    summarize('reassembly', packet_times, 1e6, 'us')
+
+    tello = Tello(video_source=make_source(args.path, args.realtime),
+                  session_dir=None)
+    if tello.decoder is None:
+        print('libh264decoder is not built, skipping the decode stages')
+        return
+
+    # decode stage alone
+    decode_times = []
+    for access_unit in access_units:
+        start = perf_counter()
+        tello._h264_decode(access_unit)
+        decode_times.append(perf_counter() - start)
+    summarize('decode', decode_times)
+
+    # the whole pipeline, receiving and decoding on their own threads
+    start = perf_counter()
+    tello.start_video()
+    tello.receive_video_thread.join()
+    tello.decode_queue.join()
+    elapsed = perf_counter() - start
+    print('{} frames in {:.3f} s, {:.1f} fps, {} access units dropped'.format(
+        tello.frames.seq, elapsed, tello.frames.seq / elapsed,
+        tello.dropped_access_units))
+
+
+if __name__ == '__main__':
+    main()
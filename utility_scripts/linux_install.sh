@@ -3,28 +3,24 @@
 cd ..
 sudo apt-get update -y
 
-# install python 2.7
-sudo apt-get install python2.7 python-pip -y
-sudo pip install --upgrade pip
-
-#switch to python2.7
-sudo update-alternatives --install /usr/bin/python python /usr/bin/python2 150 
-sudo update-alternatives --install /usr/bin/python python /usr/bin/python3 100
+# install python 3
+sudo apt-get install python3 python3-pip -y
+sudo pip3 install --upgrade pip
 
 sudo apt-get update -y
 
 # install cmake
 # sudo apt-get install cmake -y
-sudo pip install cmake
+sudo pip3 install cmake
 
 # install dependencies
-sudo apt-get install libboost-all-dev -y
+sudo apt-get install libboost-python-dev -y
 sudo apt-get install libavcodec-dev -y
 sudo apt-get install libswscale-dev -y
-sudo apt-get install python-numpy -y
-sudo apt-get install python-matplotlib -y
-sudo pip install opencv-python
-sudo apt-get install python-imaging-tk
+sudo apt-get install python3-numpy -y
+sudo apt-get install python3-matplotlib -y
+sudo pip3 install opencv-python
+sudo apt-get install python3-tk
 
 # pull and build h264 decoder library
 cd h264decoder